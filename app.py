@@ -1,18 +1,208 @@
 import os
+import sys
+import re
+import io
+import csv
 import json
+import datetime
+import decimal
+import gzip
+import hashlib
+import itertools
+import contextlib
+import time
+import random
 import sqlite3
+import struct
+import tempfile
+import threading
+import uuid
 import requests
-from flask import Flask, render_template, request, jsonify
+import httpx
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import click
+from flask import Flask, render_template, request, jsonify, g, has_request_context, stream_with_context
 from dotenv import load_dotenv
 from groq import Groq
 
+# Optional fast-path encoders / compressors. Everything works without them.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Optional: embedded columnar engine for running queries side by side with SQLite
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Optional: SQL parser for the deterministic rewrite rules (/optimize mode "rules")
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 
-# Initialize Groq client
-groq_client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+# LLM providers (see "LLM PROVIDERS" below)
+GROQ_MODEL = os.getenv('GROQ_MODEL', 'llama-3.3-70b-versatile')
+# Optional second Groq model used as a hedge target, e.g. llama-3.1-8b-instant
+GROQ_HEDGE_MODEL = os.getenv('GROQ_HEDGE_MODEL')
+# Optional OpenAI-compatible endpoint, e.g. http://127.0.0.1:8000/v1 (vLLM, llama.cpp, Ollama)
+LOCAL_LLM_URL = os.getenv('LOCAL_LLM_URL')
+LOCAL_LLM_MODEL = os.getenv('LOCAL_LLM_MODEL', 'local-model')
+LOCAL_LLM_API_KEY = os.getenv('LOCAL_LLM_API_KEY', '')
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '60'))
+# Ask providers for JSON mode (response_format json_object) on JSON prompts
+LLM_JSON_MODE = os.getenv('LLM_JSON_MODE', '1') == '1'
+LOCAL_LLM_JSON_MODE = os.getenv('LOCAL_LLM_JSON_MODE', '1' if LLM_JSON_MODE else '0') == '1'
+# Fire a second request when the first one is slower than the provider's p90
+LLM_HEDGE = os.getenv('LLM_HEDGE', '0') == '1'
+# Hedge deadline used until a provider has enough samples for a p90
+LLM_HEDGE_DEFAULT_DEADLINE = float(os.getenv('LLM_HEDGE_DEFAULT_DEADLINE', '4.0'))
+# Providers with fewer samples than this are tried first so every one gets measured
+LLM_MIN_SAMPLES = 5
+
+# Local storage for imported datasets and prebuilt databases
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+IMPORT_DIR = os.path.join(DATA_DIR, 'imports')
+# Prebuilt read-only question databases (flask --app app build-datasets)
+QUESTION_DB_DIR = os.path.join(DATA_DIR, 'questions')
+# Normalized external questions (<source>.json) and their prebuilt databases (<source>/<id>.db)
+EXTERNAL_QUESTION_DIR = os.path.join(DATA_DIR, 'external')
+QUESTION_DB_MMAP_BYTES = int(os.getenv('QUESTION_DB_MMAP_MB', '256')) * 1024 * 1024
+PRACTICE_QUESTION_IDS = range(1, 21)
+# Rows per executemany() call and rows sampled to infer column types
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '5000'))
+IMPORT_SAMPLE_ROWS = 1000
+
+# Playground sessions: idle timeout, max count and memory budget across all sessions
+PLAYGROUND_SESSION_TTL = int(os.getenv('PLAYGROUND_SESSION_TTL', '1800'))
+PLAYGROUND_MAX_SESSIONS = int(os.getenv('PLAYGROUND_MAX_SESSIONS', '200'))
+PLAYGROUND_MEMORY_BUDGET_MB = int(os.getenv('PLAYGROUND_MEMORY_BUDGET_MB', '256'))
+# Prepared statements kept per playground / batch connection (the sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = int(os.getenv('STATEMENT_CACHE_SIZE', '256'))
+
+# Parameterized batches: parameter sets per transaction (one executemany() call for DML),
+# result sets returned as samples, result rows returned with return_rows, and the time
+# limit for a whole run
+BATCH_DEFAULT_SIZE = int(os.getenv('BATCH_DEFAULT_SIZE', '1000'))
+BATCH_MAX_SIZE = 50000
+BATCH_SAMPLE_RESULTS = 5
+BATCH_MAX_RESULT_ROWS = 100000
+BATCH_TIMEOUT_SECONDS = float(os.getenv('BATCH_TIMEOUT_SECONDS', '30'))
+
+# Optimization tournament: default / max candidates, data scale-up and timing
+TOURNAMENT_DEFAULT_K = 3
+TOURNAMENT_MAX_K = 6
+TOURNAMENT_DEFAULT_SCALE = 20
+TOURNAMENT_MAX_ROWS = int(os.getenv('TOURNAMENT_MAX_ROWS', '1000000'))
+QUERY_TIMEOUT_SECONDS = float(os.getenv('QUERY_TIMEOUT_SECONDS', '5'))
+# Time limit for a whole tournament (equivalence checks, scale-up and timing)
+TOURNAMENT_TIMEOUT_SECONDS = float(os.getenv('TOURNAMENT_TIMEOUT_SECONDS', '60'))
+
+# Execution engine used when a request does not name one: "sqlite" or "duckdb" (if installed)
+DEFAULT_ENGINE = os.getenv('DEFAULT_ENGINE', 'sqlite')
+# Engine comparison: timed runs per engine, rows of each result returned
+ENGINE_COMPARE_MAX_RUNS = 10
+ENGINE_COMPARE_SAMPLE_ROWS = 20
+
+# Workload index advisor: candidates evaluated, default budget, minimum gain to keep an index
+INDEX_ADVISOR_MAX_CANDIDATES = 40
+INDEX_ADVISOR_DEFAULT_MAX_INDEXES = 5
+INDEX_ADVISOR_MIN_GAIN = 0.05
+# Time limit for measuring candidates; the indexes chosen by then are returned
+INDEX_ADVISOR_TIMEOUT_SECONDS = float(os.getenv('INDEX_ADVISOR_TIMEOUT_SECONDS', '60'))
+
+# Schema-change impact: slowdown ratio and added milliseconds that flag a workload query as regressed
+SCHEMA_CHANGE_MIN_SLOWDOWN = 1.5
+SCHEMA_CHANGE_MIN_DELTA_MS = 1.0
+
+# Scale grading of practice answers: rows generated per table (lower for questions whose
+# reference solution is quadratic), the budget multiples of the reference's time / VM steps
+# and the grades by median time relative to the reference (the last one is open-ended).
+# VM steps are counted in SCALE_PROGRESS_INTERVAL increments (SCALE_TIMING_INTERVAL on timed runs).
+SCALE_DEFAULT_ROWS = int(os.getenv('SCALE_DEFAULT_ROWS', '50000'))
+SCALE_QUESTION_ROWS = {6: 1000, 8: 2000, 13: 5000}
+SCALE_TIME_BUDGET_FACTOR = 20
+SCALE_MIN_TIME_BUDGET_MS = 250
+SCALE_STEP_BUDGET_FACTOR = 50
+SCALE_PROGRESS_INTERVAL = 100
+SCALE_TIMING_INTERVAL = 10000
+SCALE_GRADES = [
+    (1.25, 'A', 'as efficient as the reference'),
+    (2, 'B', 'within 2x of the reference'),
+    (5, 'C', 'within 5x of the reference'),
+    (None, 'D', 'more than 5x the reference')
+]
+
+# Similarity cache for /analyze: entries kept, Jaccard similarity needed to
+# return a cached analysis as-is (flagged approximate) or to pass it as a hint
+SIMILARITY_CACHE_SIZE = int(os.getenv('SIMILARITY_CACHE_SIZE', '2000'))
+SIMILARITY_RETURN_THRESHOLD = float(os.getenv('SIMILARITY_RETURN_THRESHOLD', '0.9'))
+SIMILARITY_HINT_THRESHOLD = float(os.getenv('SIMILARITY_HINT_THRESHOLD', '0.6'))
+
+# Table statistics (ANALYZE) in analyze / optimize prompts: off unless PROMPT_STATISTICS=1 or the
+# request sends "statistics": true; quantile samples and most common values per leading index
+# column, and the longest statistics text per prompt
+PROMPT_STATISTICS = os.getenv('PROMPT_STATISTICS', '0') == '1'
+STATS_QUANTILES = 5
+STATS_TOP_VALUES = 3
+STATS_PROMPT_MAX_CHARS = 2000
+
+# Slow-log ingestion: distinct fingerprints kept in memory, and text kept per statement / example
+SLOWLOG_MAX_FINGERPRINTS = int(os.getenv('SLOWLOG_MAX_FINGERPRINTS', '10000'))
+SLOWLOG_MAX_STATEMENT_CHARS = 65536
+SLOWLOG_EXAMPLE_CHARS = 4000
+
+# /compile-sql default: "sequential" (analyze, then optimize) or "combined" (one LLM call)
+COMPILE_MODE = os.getenv('COMPILE_MODE', 'sequential')
+
+# Rate limits for the LLM routes: token bucket per client and route (0 disables),
+# with per-route overrides like "/compile-sql=20,/explain=60" (requests per minute)
+RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', '30'))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '10'))
+RATE_LIMIT_ROUTES = os.getenv('RATE_LIMIT_ROUTES', '')
+# Use the first X-Forwarded-For address as the client (only behind a trusted proxy)
+RATE_LIMIT_TRUST_PROXY = os.getenv('RATE_LIMIT_TRUST_PROXY', '0') == '1'
+# Admission for LLM requests: concurrent requests, waiting requests, max wait in seconds
+LLM_MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', '8'))
+LLM_MAX_QUEUED = int(os.getenv('LLM_MAX_QUEUED', '32'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '30'))
+LLM_ROUTES = ('/analyze', '/optimize', '/explain', '/compile-sql', '/compile-sql/stream', '/workload/slowlog')
+
+# Traffic recorder (off unless TRAFFIC_LOG is set): JSONL file, size before rotating,
+# rotated files kept, and whether to mask quoted string literals in recorded SQL
+TRAFFIC_LOG = os.getenv('TRAFFIC_LOG', '')
+TRAFFIC_LOG_MAX_MB = int(os.getenv('TRAFFIC_LOG_MAX_MB', '50'))
+TRAFFIC_LOG_BACKUPS = int(os.getenv('TRAFFIC_LOG_BACKUPS', '5'))
+TRAFFIC_REDACT_LITERALS = os.getenv('TRAFFIC_REDACT_LITERALS', '0') == '1'
+TRAFFIC_ROUTES = ('/compile-sql', '/analyze', '/optimize', '/execute-question', '/playground/')
+# Request headers kept in the recording (they change the response encoding)
+TRAFFIC_HEADERS = ('Accept', 'Accept-Encoding', 'X-Result-Format')
+
+# Response bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+# A text column is dictionary-encoded when distinct values / rows is at most this
+COLUMNAR_DICT_MAX_RATIO = 0.5
 
 # Optional: configure external SQL question APIs here
 EXTERNAL_SQL_SOURCES = {
@@ -20,6 +210,19 @@ EXTERNAL_SQL_SOURCES = {
     # "leetcode": "https://your-leetcode-sql-api-endpoint",
     # "some_source": "https://another-sql-api-endpoint"
 }
+# ... or in .env as EXTERNAL_SQL_SOURCES=name=url,other=url
+EXTERNAL_SQL_SOURCES.update(
+    pair.strip().split('=', 1) for pair in os.getenv('EXTERNAL_SQL_SOURCES', '').split(',') if '=' in pair
+)
+# External questions: age before a background refresh, wait after a failed fetch,
+# upstream timeout, how long a first (cold) request waits, time allowed for one
+# question's setup SQL, and questions kept per source
+EXTERNAL_REFRESH_SECONDS = int(os.getenv('EXTERNAL_REFRESH_SECONDS', '3600'))
+EXTERNAL_RETRY_SECONDS = int(os.getenv('EXTERNAL_RETRY_SECONDS', '60'))
+EXTERNAL_FETCH_TIMEOUT = float(os.getenv('EXTERNAL_FETCH_TIMEOUT', '10'))
+EXTERNAL_FIRST_FETCH_WAIT = float(os.getenv('EXTERNAL_FIRST_FETCH_WAIT', '2'))
+EXTERNAL_SETUP_TIMEOUT = float(os.getenv('EXTERNAL_SETUP_TIMEOUT', '10'))
+EXTERNAL_MAX_QUESTIONS = 500
 
 # System prompts
 ANALYZE_SYSTEM_PROMPT = """
@@ -35,28 +238,569 @@ Generate ONE best optimized version of the given query that balances performance
 Return STRICT JSON only, no markdown, no code blocks, just pure JSON.
 """
 
+COMBINED_SYSTEM_PROMPT = """
+You are an expert SQL query reviewer and optimizer.
+In a single answer, analyze the query for syntax, logical and performance issues and,
+if it needs optimization, give ONE best optimized version that keeps the same results.
+Use the schema (DDL) when given to reason about keys and indexes.
+Return STRICT JSON only, no markdown, no code blocks, just pure JSON.
+"""
+
+TOURNAMENT_SYSTEM_PROMPT = """
+You are an expert SQL optimizer.
+Generate several DIFFERENT optimized versions of the given query, each using a distinct strategy
+(e.g. join rewrite, window function, EXISTS instead of IN, pre-aggregation, CTE restructuring).
+Every version must return exactly the same rows as the original. The versions will be benchmarked.
+Return STRICT JSON only, no markdown, no code blocks, just pure JSON.
+"""
+
 EXPLAIN_SYSTEM_PROMPT = """
 You are a senior backend engineer and SQL instructor.
 Explain SQL queries in simple language using markdown format.
 """
 
-def call_groq(system_prompt, user_prompt, response_format="json"):
-    """Helper function to call Groq API"""
+# ================== METRICS ==================
+
+metrics_lock = threading.Lock()
+METRIC_COUNTERS = defaultdict(int)
+
+def metrics_incr(name, value=1):
+    """Increment a named counter shown by GET /metrics."""
+    with metrics_lock:
+        METRIC_COUNTERS[name] += value
+
+# ================== TRAFFIC RECORDER ==================
+
+SECRET_FIELD_RE = re.compile(r'(api[_-]?key|token|secret|password|authorization|cookie)', re.IGNORECASE)
+SQL_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+
+def sanitize_traffic_value(value, key=''):
+    """Copy of a request body with secret-looking fields dropped (and string literals masked if configured)."""
+    if key and SECRET_FIELD_RE.search(key):
+        return '[redacted]'
+    if isinstance(value, dict):
+        return {k: sanitize_traffic_value(v, str(k)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize_traffic_value(v) for v in value]
+    if isinstance(value, str) and TRAFFIC_REDACT_LITERALS:
+        return SQL_STRING_LITERAL_RE.sub(lambda m: "'" + 'x' * (len(m.group()) - 2) + "'", value)
+    return value
+
+def prompt_digest(messages):
+    """sha256 of a chat prompt, the key a replay (benchmarks/fake_groq.py) finds the recorded reply by."""
+    return hashlib.sha256('\n'.join(m['content'] for m in messages).encode('utf-8')).hexdigest()
+
+class TrafficRecorder:
+    """
+    Appends one JSON line per request to TRAFFIC_LOG, rotating it at
+    TRAFFIC_LOG_MAX_MB into .1 ... .N (oldest dropped). Each line has the
+    sanitized body, status, timing and the LLM replies the request got,
+    which is what benchmarks/replay.py needs to replay it deterministically.
+    """
+
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{index}'):
+                os.replace(f'{self.path}.{index}', f'{self.path}.{index + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    def write(self, record):
+        line = json.dumps(record, default=json_default, ensure_ascii=False) + '\n'
+        with self.lock:
+            try:
+                if os.path.getsize(self.path) + len(line) > self.max_bytes:
+                    self.rotate()
+            except OSError:
+                pass
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+traffic_recorder = TrafficRecorder(TRAFFIC_LOG, TRAFFIC_LOG_MAX_MB * 1024 * 1024, TRAFFIC_LOG_BACKUPS) if TRAFFIC_LOG else None
+
+def is_recorded_route(path):
+    return any(path == route or path.startswith(route.rstrip('/') + '/') for route in TRAFFIC_ROUTES)
+
+@app.before_request
+def start_traffic_record():
+    """Registered before admission control so rate-limited (429) requests are recorded too."""
+    if traffic_recorder is not None and request.method != 'GET' and is_recorded_route(request.path):
+        g.traffic_arrived = time.time()
+        g.traffic_started = time.perf_counter()
+        g.traffic_llm = []
+
+@app.after_request
+def record_traffic(response):
+    """
+    Write the request's traffic record. Streamed responses are written when
+    they close, so the record holds the LLM replies the generator got and
+    the full duration. Non-JSON requests record their query string and
+    form fields; uploaded files and raw bodies are not kept, so such
+    records are marked "replayable": false.
+    """
+    started = g.pop('traffic_started', None)
+    if started is None:
+        return response
     try:
-        if response_format == "json":
-            user_prompt = user_prompt + "\n\nIMPORTANT: Return ONLY valid JSON. No markdown, no code blocks, no extra text."
+        body = request.get_json(silent=True)
+        record = {
+            'ts': round(g.pop('traffic_arrived'), 3),
+            'method': request.method,
+            'path': request.path,
+            'client': hashlib.sha256(client_id().encode('utf-8')).hexdigest()[:12],
+            'headers': {name: request.headers[name] for name in TRAFFIC_HEADERS if name in request.headers},
+            'body': sanitize_traffic_value(body),
+            'status': response.status_code,
+            'response_bytes': None if response.is_streamed else response.content_length,
+            # The same list call_groq appends to, also while a streamed response is generated
+            'llm': g.get('traffic_llm', [])
+        }
+        if request.args:
+            record['query'] = sanitize_traffic_value(request.args.to_dict())
+        if body is None:
+            if request.form:
+                record['form'] = sanitize_traffic_value(request.form.to_dict())
+            if request.files:
+                record['files'] = [{'field': field, 'filename': upload.filename, 'content_type': upload.content_type}
+                                   for field, upload in request.files.items()]
+            if request.files or (request.content_length and not request.form):
+                record['replayable'] = False
+        if request.path == '/playground/sessions' and not response.is_streamed:
+            # Lets the replay map this session id to the one the replayed build creates
+            record['session_id'] = (response.get_json(silent=True) or {}).get('session_id')
+    except Exception as e:
+        print(f"Traffic recorder error: {str(e)}")
+        return response
+
+    def write():
+        try:
+            record['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            traffic_recorder.write(record)
+        except Exception as e:
+            print(f"Traffic recorder error: {str(e)}")
+
+    if response.is_streamed:
+        response.call_on_close(write)
+    else:
+        write()
+    return response
+
+# ================== ADMISSION CONTROL ==================
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Consume one token; returns 0 on success, else the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def idle(self):
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+class RateLimiter:
+    """Token buckets per (client, route); routes without a positive limit are not limited."""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self, per_minute, burst, route_overrides=''):
+        self.burst = burst
+        self.limits = {route: per_minute for route in LLM_ROUTES}
+        for item in route_overrides.split(','):
+            if '=' in item:
+                route, value = item.split('=', 1)
+                self.limits[route.strip()] = float(value)
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def check(self, client, route):
+        per_minute = self.limits.get(route, 0)
+        if per_minute <= 0:
+            return 0
+        with self.lock:
+            bucket = self.buckets.get((client, route))
+            if bucket is None:
+                if len(self.buckets) >= self.MAX_BUCKETS:
+                    self.buckets = {key: b for key, b in self.buckets.items() if not b.idle()}
+                bucket = self.buckets[(client, route)] = TokenBucket(per_minute / 60.0, self.burst)
+            return bucket.take()
+
+class FairAdmission:
+    """
+    At most max_in_flight admitted requests; up to max_queued more wait.
+    A freed slot goes to the clients with waiters in round-robin order, so
+    one busy client cannot starve the others. Returns False (reject) when
+    the queue is full or the wait exceeds the timeout.
+    """
+
+    def __init__(self, max_in_flight, max_queued, timeout):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.waiting = OrderedDict()  # client -> deque of Events, in round-robin order
+
+    def acquire(self, client):
+        with self.lock:
+            if self.in_flight < self.max_in_flight and not self.queued:
+                self.in_flight += 1
+                return True
+            if self.queued >= self.max_queued:
+                return False
+            event = threading.Event()
+            self.waiting.setdefault(client, deque()).append(event)
+            self.queued += 1
+
+        if event.wait(self.timeout):
+            return True
+        with self.lock:
+            if event.is_set():
+                return True  # granted while timing out
+            waiters = self.waiting[client]
+            waiters.remove(event)
+            if not waiters:
+                del self.waiting[client]
+            self.queued -= 1
+            metrics_incr('llm_admission_timeouts')
+            return False
+
+    def release(self):
+        with self.lock:
+            if not self.waiting:
+                self.in_flight -= 1
+                return
+            client, waiters = next(iter(self.waiting.items()))
+            event = waiters.popleft()
+            if waiters:
+                self.waiting.move_to_end(client)
+            else:
+                del self.waiting[client]
+            self.queued -= 1
+            event.set()  # the slot passes straight to the waiter
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'max_in_flight': self.max_in_flight,
+                'max_queued': self.max_queued,
+                'waiting_clients': len(self.waiting)
+            }
+
+rate_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST, RATE_LIMIT_ROUTES)
+llm_admission = FairAdmission(LLM_MAX_IN_FLIGHT, LLM_MAX_QUEUED, LLM_QUEUE_TIMEOUT)
+
+def client_id():
+    if RATE_LIMIT_TRUST_PROXY and request.headers.get('X-Forwarded-For'):
+        return request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+def too_many_requests(message, retry_after):
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.before_request
+def admit_llm_request():
+    """Rate-limit and admit requests to the LLM routes; the slot is released in teardown."""
+    if request.method != 'POST' or request.path not in LLM_ROUTES:
+        return None
+    if request.path == '/optimize' and (request.get_json(silent=True) or {}).get('mode') == 'rules':
+        return None  # local rewrite rules only, no LLM call
+    client = client_id()
+    wait_seconds = rate_limiter.check(client, request.path)
+    if wait_seconds:
+        metrics_incr('rate_limited')
+        return too_many_requests('Rate limit exceeded', max(1, int(wait_seconds + 0.999)))
+    if not llm_admission.acquire(client):
+        metrics_incr('llm_admission_rejected')
+        return too_many_requests('Too many LLM requests in progress, try again shortly', 1)
+    g.llm_admitted = True
+    metrics_incr('llm_admitted')
+    return None
+
+@app.teardown_request
+def release_llm_slot(exc):
+    if g.pop('llm_admitted', False):
+        llm_admission.release()
+
+# ================== LLM PROVIDERS ==================
+
+class LLMReply:
+    """Text of a chat completion plus the provider that produced it."""
+
+    def __init__(self, text, provider, usage=None):
+        self.text = text
+        self.provider = provider
+        self.usage = usage or {}
+
+class LLMProvider(ABC):
+    """Base class: one model behind one chat-completions API."""
+
+    kind = 'base'
+    supports_json_mode = False
+
+    def __init__(self, model):
+        self.model = model
+        self.name = f"{self.kind}/{model}"
+
+    @abstractmethod
+    def complete(self, messages, temperature=0.3, max_tokens=4000, json_mode=False):
+        """json_mode asks for a JSON object reply when the provider supports it (ignored otherwise)."""
+
+class GroqProvider(LLMProvider):
+    kind = 'groq'
+    supports_json_mode = LLM_JSON_MODE
+
+    def __init__(self, model, api_key):
+        super().__init__(model)
+        self.client = Groq(api_key=api_key, timeout=LLM_TIMEOUT_SECONDS)
+
+    def complete(self, messages, temperature=0.3, max_tokens=4000, json_mode=False):
+        options = {}
+        if json_mode and self.supports_json_mode:
+            options['response_format'] = {'type': 'json_object'}
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **options
+        )
+        usage = {}
+        if completion.usage is not None:
+            usage = {
+                'prompt_tokens': completion.usage.prompt_tokens,
+                'completion_tokens': completion.usage.completion_tokens
+            }
+        return LLMReply(completion.choices[0].message.content, self.name, usage)
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Any server implementing POST {base_url}/chat/completions (vLLM, llama.cpp, Ollama, ...)."""
 
-        completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3,
-            max_tokens=4000
+    kind = 'local'
+    supports_json_mode = LOCAL_LLM_JSON_MODE
+
+    def __init__(self, model, base_url, api_key=''):
+        super().__init__(model)
+        headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+        self.client = httpx.Client(base_url=base_url.rstrip('/'), headers=headers, timeout=LLM_TIMEOUT_SECONDS)
+
+    def complete(self, messages, temperature=0.3, max_tokens=4000, json_mode=False):
+        body = {
+            'model': self.model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        }
+        if json_mode and self.supports_json_mode:
+            body['response_format'] = {'type': 'json_object'}
+        resp = self.client.post('/chat/completions', json=body)
+        resp.raise_for_status()
+        body = resp.json()
+        usage = body.get('usage') or {}
+        return LLMReply(
+            body['choices'][0]['message']['content'],
+            self.name,
+            {k: usage[k] for k in ('prompt_tokens', 'completion_tokens') if k in usage}
         )
 
-        response = completion.choices[0].message.content
+class LatencyStats:
+    """Rolling window of call latencies and outcomes for one provider."""
+
+    def __init__(self, window=200):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True = success
+        self.calls = 0
+        self.errors = 0
+        self.hedges_won = 0
+
+    def record(self, seconds, ok):
+        with self.lock:
+            self.calls += 1
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(seconds)
+            else:
+                self.errors += 1
+
+    def percentile(self, pct):
+        with self.lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return None
+        rank = max(1, int(round(pct / 100.0 * len(ordered))))
+        return ordered[min(rank, len(ordered)) - 1]
+
+    def error_rate(self):
+        with self.lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def samples(self):
+        with self.lock:
+            return len(self.latencies)
+
+    def snapshot(self):
+        p50, p90, p99 = self.percentile(50), self.percentile(90), self.percentile(99)
+        to_ms = lambda v: round(v * 1000, 1) if v is not None else None
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'recent_error_rate': round(self.error_rate(), 3),
+            'hedges_won': self.hedges_won,
+            'samples': self.samples(),
+            'p50_ms': to_ms(p50),
+            'p90_ms': to_ms(p90),
+            'p99_ms': to_ms(p99)
+        }
+
+class LLMRouter:
+    """
+    Sends each completion to the provider with the best observed latency
+    (penalized by its recent error rate), failing over to the next one on
+    errors. With hedging enabled, a second request goes to the runner-up
+    when the first has not answered by the primary's p90, and whichever
+    finishes first wins.
+    """
+
+    def __init__(self, providers, hedge=False):
+        self.providers = providers
+        self.hedge = hedge
+        self.stats = {p.name: LatencyStats() for p in providers}
+        self.executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='llm')
+
+    def ranked(self):
+        def score(provider):
+            stats = self.stats[provider.name]
+            samples = stats.samples()
+            if samples < LLM_MIN_SAMPLES:
+                return (0, samples)
+            return (1, stats.percentile(50) * (1 + 4 * stats.error_rate()))
+        return sorted(self.providers, key=score)
+
+    def _call(self, provider, messages, temperature, max_tokens, json_mode=False):
+        start = time.perf_counter()
+        try:
+            reply = provider.complete(messages, temperature, max_tokens, json_mode)
+        except Exception:
+            self.stats[provider.name].record(time.perf_counter() - start, False)
+            raise
+        self.stats[provider.name].record(time.perf_counter() - start, True)
+        return reply
+
+    def _call_with_failover(self, order, messages, temperature, max_tokens, json_mode=False):
+        last_error = None
+        for provider in order:
+            try:
+                return self._call(provider, messages, temperature, max_tokens, json_mode)
+            except Exception as e:
+                print(f"LLM provider {provider.name} failed: {str(e)}")
+                last_error = e
+        raise last_error
+
+    def complete(self, messages, temperature=0.3, max_tokens=4000, json_mode=False):
+        if not self.providers:
+            raise RuntimeError('No LLM provider configured: set GROQ_API_KEY or LOCAL_LLM_URL')
+
+        order = self.ranked()
+        if not self.hedge or len(order) < 2:
+            return self._call_with_failover(order, messages, temperature, max_tokens, json_mode)
+
+        primary, backup = order[0], order[1]
+        deadline = self.stats[primary.name].percentile(90) or LLM_HEDGE_DEFAULT_DEADLINE
+        first = self.executor.submit(self._call, primary, messages, temperature, max_tokens, json_mode)
+        done, _ = wait([first], timeout=deadline)
+        if done and first.exception() is None:
+            return first.result()
+        if done:
+            # Primary failed outright: fall back to the remaining providers
+            return self._call_with_failover(order[1:], messages, temperature, max_tokens, json_mode)
+
+        metrics_incr('llm_hedges_fired')
+        second = self.executor.submit(self._call, backup, messages, temperature, max_tokens, json_mode)
+        pending = {first: primary, second: backup}
+        last_error = None
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                if future.exception() is None:
+                    if provider is backup:
+                        with self.stats[backup.name].lock:
+                            self.stats[backup.name].hedges_won += 1
+                    return future.result()
+                last_error = future.exception()
+        raise last_error
+
+    def snapshot(self):
+        return {
+            'hedging': self.hedge,
+            'order': [p.name for p in self.ranked()],
+            'providers': {name: stats.snapshot() for name, stats in self.stats.items()}
+        }
+
+def build_llm_router():
+    providers = []
+    groq_api_key = os.getenv('GROQ_API_KEY')
+    if groq_api_key:
+        providers.append(GroqProvider(GROQ_MODEL, groq_api_key))
+        if GROQ_HEDGE_MODEL:
+            providers.append(GroqProvider(GROQ_HEDGE_MODEL, groq_api_key))
+    if LOCAL_LLM_URL:
+        providers.append(OpenAICompatibleProvider(LOCAL_LLM_MODEL, LOCAL_LLM_URL, LOCAL_LLM_API_KEY))
+    return LLMRouter(providers, hedge=LLM_HEDGE)
+
+llm_router = build_llm_router()
+
+def call_groq(system_prompt, user_prompt, response_format="json", temperature=0.3):
+    """Helper function to call the configured LLM providers (Groq by default)"""
+    try:
+        if response_format == "json":
+            user_prompt = user_prompt + "\n\nIMPORTANT: Return ONLY valid JSON. No markdown, no code blocks, no extra text."
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        start = time.perf_counter()
+        reply = llm_router.complete(messages, temperature=temperature, max_tokens=4000,
+                                    json_mode=response_format == "json")
+        record_llm_usage(reply, time.perf_counter() - start)
+        if has_request_context() and 'traffic_llm' in g:
+            g.traffic_llm.append({
+                'prompt_sha256': prompt_digest(messages),
+                'reply': reply.text,
+                'latency_ms': round((time.perf_counter() - start) * 1000, 1)
+            })
+
+        response = reply.text
 
         if response_format == "json":
             response = response.strip()
@@ -70,9 +814,528 @@ def call_groq(system_prompt, user_prompt, response_format="json"):
 
         return response
     except Exception as e:
-        print(f"Groq API Error: {str(e)}")
+        print(f"LLM API Error: {str(e)}")
         raise e
 
+# ---------- Structured (JSON) replies ----------
+
+# Expected reply shapes: field -> (type, required, default). A type given as a
+# string refers to another schema; None in a tuple of types allows null.
+LLM_REPLY_SCHEMAS = {
+    'analysis': {
+        'syntax_issues': (list, False, []),
+        'logical_issues': (list, False, []),
+        'performance_issues': (list, False, []),
+        'needs_optimization': (bool, True, None),
+        'overall_assessment': (str, False, ''),
+        'hints_for_improvement': (list, False, [])
+    },
+    'optimization': {
+        'optimized_query': (str, True, None),
+        'changes_made': (list, False, []),
+        'performance_gain': (str, False, '')
+    },
+    'combined': {
+        'analysis': ('analysis', True, None),
+        'optimized': (('optimization', None), False, None)
+    },
+    'tournament': {
+        'candidates': (list, True, None)
+    }
+}
+
+class LLMOutputError(ValueError):
+    """The LLM reply could not be turned into the expected JSON, even after repair and a retry."""
+
+def conform_reply(value, schema_name, path=''):
+    """
+    Check a parsed reply against LLM_REPLY_SCHEMAS[schema_name], filling
+    defaults and coercing harmless mismatches (a string where a list is
+    expected, "true" for true). Returns (value, errors).
+    """
+    if not isinstance(value, dict):
+        return value, [f'{path or "reply"} must be a JSON object']
+    errors = []
+    for field, (expected, required, default) in LLM_REPLY_SCHEMAS[schema_name].items():
+        where = f'{path}{field}'
+        if value.get(field) is None:
+            if required:
+                errors.append(f'{where} is required')
+            elif field not in value or default is not None:
+                value[field] = list(default) if isinstance(default, list) else default
+            continue
+        choices = expected if isinstance(expected, tuple) else (expected,)
+        item = value[field]
+        if any(isinstance(choice, str) for choice in choices):
+            nested = next(choice for choice in choices if isinstance(choice, str))
+            value[field], nested_errors = conform_reply(item, nested, f'{where}.')
+            errors += nested_errors
+        elif list in choices and isinstance(item, str):
+            value[field] = [item]
+        elif bool in choices and isinstance(item, str) and item.lower() in ('true', 'false'):
+            value[field] = item.lower() == 'true'
+        elif str in choices and isinstance(item, (int, float)) and not isinstance(item, bool):
+            value[field] = str(item)
+        elif not isinstance(item, tuple(c for c in choices if c is not None)):
+            errors.append(f'{where} must be {" or ".join(c.__name__ for c in choices if c is not None)}')
+    return value, errors
+
+def repair_json(text):
+    """
+    Cheap local fixes for the usual ways a model breaks JSON: prose or code
+    fences around the object, trailing commas, unescaped quotes and raw
+    newlines inside strings, and truncation (the last incomplete member is
+    dropped and open strings / brackets are closed). Returns the parsed
+    value or raises ValueError.
+    """
+    start = text.find('{')
+    if start < 0:
+        raise ValueError('no JSON object in reply')
+    text = text[start:]
+    end = text.rfind('}')
+
+    out = []
+    stack = []
+    cuts = []  # (length of out, open brackets) after each complete member
+    in_string = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if ch == '\\' and i + 1 < len(text):
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch == '"':
+                rest = text[i + 1:].lstrip()
+                if not rest or rest[0] in ',:}]':
+                    in_string = False
+                    out.append(ch)
+                else:
+                    out.append('\\"')  # quote inside a string value
+            elif ch == '\n':
+                out.append('\\n')
+            else:
+                out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            while out and out[-1].strip() in ('', ','):
+                out.pop()  # trailing comma
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+        elif ch == ',':
+            cuts.append((len(out), list(stack)))
+            out.append(ch)
+        else:
+            out.append(ch)
+        i += 1
+
+    if not stack and not in_string:
+        return json.loads(''.join(out))
+    # Truncated: try closing as is, then drop members from the end until it parses
+    attempts = [(''.join(out) + ('"' if in_string else ''), stack)] + [
+        (''.join(out[:length]), open_brackets) for length, open_brackets in reversed(cuts)
+    ]
+    for prefix, open_brackets in attempts[:50]:
+        try:
+            return json.loads(prefix.rstrip().rstrip(',') + ''.join(reversed(open_brackets)))
+        except ValueError:
+            continue
+    raise ValueError(f'could not repair JSON (reply ended at position {end})')
+
+def parse_reply(text, schema_name):
+    """Strict parse, then local repair. Returns (value, errors, repaired)."""
+    try:
+        value, repaired = json.loads(text), False
+    except ValueError:
+        metrics_incr(f'llm_json_{schema_name}_parse_failures')
+        try:
+            value, repaired = repair_json(text), True
+        except ValueError as e:
+            return None, [f'invalid JSON: {str(e)}'], False
+    value, errors = conform_reply(value, schema_name)
+    return value, errors, repaired
+
+def schema_skeleton(schema_name):
+    skeleton = {}
+    for field, (expected, required, _) in LLM_REPLY_SCHEMAS[schema_name].items():
+        choices = expected if isinstance(expected, tuple) else (expected,)
+        nested = next((c for c in choices if isinstance(c, str)), None)
+        if nested:
+            skeleton[field] = schema_skeleton(nested)
+        else:
+            skeleton[field] = ' or '.join(c.__name__ if c is not None else 'null' for c in choices)
+    return skeleton
+
+def call_llm_json(system_prompt, user_prompt, schema_name):
+    """
+    JSON-mode LLM call whose reply is validated against LLM_REPLY_SCHEMAS.
+    Malformed replies get a local repair pass and then one retry that
+    lists the problems and the exact shape; raises LLMOutputError if that
+    also fails. Counters: llm_json_<schema>_replies / _parse_failures /
+    _repaired / _retries / _failures.
+    """
+    metrics_incr(f'llm_json_{schema_name}_replies')
+    text = call_groq(system_prompt, user_prompt, "json")
+    value, errors, repaired = parse_reply(text, schema_name)
+    if not errors:
+        if repaired:
+            metrics_incr(f'llm_json_{schema_name}_repaired')
+        return value
+
+    metrics_incr(f'llm_json_{schema_name}_retries')
+    retry_prompt = (
+        f"{user_prompt}\n\nYour previous reply was rejected: {'; '.join(errors)}.\n"
+        f"Reply with ONE JSON object of exactly this shape and nothing else:\n"
+        f"{compact_json(schema_skeleton(schema_name))}"
+    )
+    text = call_groq(system_prompt, retry_prompt, "json", temperature=0)
+    value, errors, _ = parse_reply(text, schema_name)
+    if errors:
+        metrics_incr(f'llm_json_{schema_name}_failures')
+        raise LLMOutputError('; '.join(errors))
+    return value
+
+def record_llm_usage(reply, seconds):
+    """Log token counts for one LLM call and add them to the metrics and the current request's totals."""
+    prompt_tokens = reply.usage.get('prompt_tokens', 0)
+    completion_tokens = reply.usage.get('completion_tokens', 0)
+    print(f"LLM call provider={reply.provider} prompt_tokens={prompt_tokens} "
+          f"completion_tokens={completion_tokens} latency_ms={seconds * 1000:.0f}")
+
+    metrics_incr('llm_calls')
+    metrics_incr('llm_prompt_tokens', prompt_tokens)
+    metrics_incr('llm_completion_tokens', completion_tokens)
+
+    if has_request_context():
+        usage = g.setdefault('llm_usage', {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'latency_ms': 0})
+        usage['calls'] += 1
+        usage['prompt_tokens'] += prompt_tokens
+        usage['completion_tokens'] += completion_tokens
+        usage['latency_ms'] += round(seconds * 1000)
+
+def request_llm_usage():
+    """Token/latency totals of the LLM calls made while handling this request."""
+    return g.get('llm_usage')
+
+def compact_json(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+def schema_section(schema_ddl):
+    return f"\nSchema (DDL):\n{schema_ddl}\n" if schema_ddl else ""
+
+def build_analyze_prompt(query, dialect, schema_ddl=None):
+    return f"""
+You must respond ONLY with valid JSON.
+Dialect: "{dialect}"
+{schema_section(schema_ddl)}
+SQL query:
+{query}
+
+Return JSON in this exact format:
+{{
+  "syntax_issues": ["issue1", "issue2"],
+  "logical_issues": ["issue1"],
+  "performance_issues": ["issue1"],
+  "needs_optimization": true,
+  "overall_assessment": "brief assessment",
+  "hints_for_improvement": ["hint1", "hint2"]
+}}
+"""
+
+def build_optimize_prompt(query, analysis, schema_ddl=None):
+    return f"""
+You must respond ONLY with valid JSON.
+{schema_section(schema_ddl)}
+Original SQL:
+{query}
+
+Detected issues:
+{compact_json(analysis)}
+
+Generate ONE optimized version in this exact format:
+{{
+  "original": "{query[:100]}...",
+  "optimized_query": "SELECT ...",
+  "changes_made": ["change1", "change2", "change3"],
+  "performance_gain": "Expected improvement description"
+}}
+"""
+
+def build_combined_prompt(query, dialect, schema_ddl=None):
+    return f"""
+You must respond ONLY with valid JSON.
+Dialect: "{dialect}"
+{schema_section(schema_ddl)}
+SQL query:
+{query}
+
+Return JSON in this exact format. Set "optimized" to null when "needs_optimization" is false:
+{{
+  "analysis": {{
+    "syntax_issues": ["issue1"],
+    "logical_issues": ["issue1"],
+    "performance_issues": ["issue1"],
+    "needs_optimization": true,
+    "overall_assessment": "brief assessment",
+    "hints_for_improvement": ["hint1"]
+  }},
+  "optimized": {{
+    "optimized_query": "SELECT ...",
+    "changes_made": ["change1"],
+    "performance_gain": "Expected improvement description"
+  }}
+}}
+"""
+
+def build_tournament_prompt(query, analysis, k, schema_ddl=None):
+    return f"""
+You must respond ONLY with valid JSON.
+Dialect: "SQLite"
+{schema_section(schema_ddl)}
+Original SQL:
+{query}
+
+Detected issues:
+{compact_json(analysis or {})}
+
+Generate {k} different optimized versions in this exact format:
+{{
+  "candidates": [
+    {{
+      "strategy": "short name of the approach",
+      "optimized_query": "SELECT ...",
+      "changes_made": ["change1", "change2"]
+    }}
+  ]
+}}
+"""
+
+def analyze_and_optimize(query, dialect, schema_ddl=None):
+    """One LLM round trip returning (analysis, optimized-or-None)."""
+    combined = call_llm_json(COMBINED_SYSTEM_PROMPT, build_combined_prompt(query, dialect, schema_ddl), 'combined')
+    analysis = combined.get('analysis') or {}
+    optimized = combined.get('optimized')
+    if not analysis.get('needs_optimization', False) or not optimized:
+        return analysis, None
+    optimized.setdefault('original', f"{query[:100]}...")
+    return analysis, optimized
+
+# ================== PRACTICE QUESTIONS ==================
+
+PRACTICE_QUESTIONS = [
+    {
+        "id": 1,
+        "difficulty": "Easy",
+        "title": "Employees Earning More Than Their Managers",
+        "description": "Find the employees who earn more than their managers.",
+        "tables": ["Employee (id, name, salary, managerId)"],
+        "example_output": "name\nJoe",
+        "hint": "Use a self-join to compare employee salary with their manager's salary.",
+        "solution": "SELECT e1.name FROM Employee e1 JOIN Employee e2 ON e1.managerId = e2.id WHERE e1.salary > e2.salary"
+    },
+    {
+        "id": 2,
+        "difficulty": "Easy",
+        "title": "Duplicate Emails",
+        "description": "Report all the duplicate emails.",
+        "tables": ["Person (id, email)"],
+        "example_output": "email\njohn@example.com",
+        "hint": "Use GROUP BY and HAVING COUNT(*) > 1.",
+        "solution": "SELECT email FROM Person GROUP BY email HAVING COUNT(*) > 1"
+    },
+    {
+        "id": 3,
+        "difficulty": "Easy",
+        "title": "Customers Who Never Order",
+        "description": "Find all customers who never order anything.",
+        "tables": ["Customers (id, name)", "Orders (id, customerId)"],
+        "example_output": "Customers\nHenry\nMax",
+        "hint": "Use LEFT JOIN or NOT IN to find customers without orders.",
+        "solution": "SELECT name AS Customers FROM Customers WHERE id NOT IN (SELECT customerId FROM Orders)"
+    },
+    {
+        "id": 4,
+        "difficulty": "Medium",
+        "title": "Second Highest Salary",
+        "description": "Find the second highest salary from the Employee table. If there is no second highest salary, return null.",
+        "tables": ["Employee (id, salary)"],
+        "example_output": "SecondHighestSalary\n200",
+        "hint": "Use DISTINCT, ORDER BY DESC, LIMIT with OFFSET.",
+        "solution": "SELECT (SELECT DISTINCT salary FROM Employee ORDER BY salary DESC LIMIT 1 OFFSET 1) AS SecondHighestSalary"
+    },
+    {
+        "id": 5,
+        "difficulty": "Medium",
+        "title": "Department Highest Salary",
+        "description": "Find employees who have the highest salary in each department.",
+        "tables": ["Employee (id, name, salary, departmentId)", "Department (id, name)"],
+        "example_output": "Department | Employee | Salary\nIT | Max | 90000\nIT | Joe | 85000\nSales | Henry | 80000",
+        "hint": "Use JOIN with a subquery to find max salary per department.",
+        "solution": "SELECT d.name AS Department, e.name AS Employee, e.salary AS Salary FROM Employee e JOIN Department d ON e.departmentId = d.id WHERE (e.departmentId, e.salary) IN (SELECT departmentId, MAX(salary) FROM Employee GROUP BY departmentId)"
+    },
+    {
+        "id": 6,
+        "difficulty": "Medium",
+        "title": "Rising Temperature",
+        "description": "Find the ids for days where the temperature is higher compared to the previous day.",
+        "tables": ["Weather (id, recordDate, temperature)"],
+        "example_output": "id\n2\n4",
+        "hint": "Self-join the table on recordDate-1 day and compare temperatures.",
+        "solution": "SELECT w1.id FROM Weather w1 JOIN Weather w2 ON DATE(w1.recordDate) = DATE(w2.recordDate, '+1 day') WHERE w1.temperature > w2.temperature"
+    },
+    {
+        "id": 7,
+        "difficulty": "Easy",
+        "title": "Delete Duplicate Emails (Identify)",
+        "description": "Identify duplicate emails. Keep only the row with the smallest id.",
+        "tables": ["Person (id, email)"],
+        "example_output": "email | id\njohn@example.com | 3",
+        "hint": "Use MIN(id) GROUP BY email to find which ones to keep.",
+        "solution": "SELECT p1.email, p1.id FROM Person p1 WHERE p1.id NOT IN (SELECT MIN(id) FROM Person GROUP BY email)"
+    },
+    {
+        "id": 8,
+        "difficulty": "Hard",
+        "title": "Rank Scores",
+        "description": "Rank scores from highest to lowest. Ties share the same rank, and the next rank is the next integer.",
+        "tables": ["Scores (id, score)"],
+        "example_output": "score | rank\n4.00 | 1\n4.00 | 1\n3.85 | 2",
+        "hint": "Use DENSE_RANK() or count distinct scores >= current.",
+        "solution": "SELECT score, (SELECT COUNT(DISTINCT score) FROM Scores s2 WHERE s2.score >= s1.score) AS rank FROM Scores s1 ORDER BY score DESC"
+    },
+    {
+        "id": 9,
+        "difficulty": "Medium",
+        "title": "Customers With Multiple Orders Per Month",
+        "description": "Find customers who placed at least 2 orders in the same calendar month.",
+        "tables": ["Customers (id, name)", "Orders (id, customer_id, order_date, amount)"],
+        "example_output": "name | order_month | order_count\nAlice | 2023-01 | 2\nBob | 2023-01 | 2",
+        "hint": "Group by customer and month (use strftime).",
+        "solution": "SELECT c.name, strftime('%Y-%m', o.order_date) AS order_month, COUNT(*) AS order_count FROM Customers c JOIN Orders o ON c.id = o.customer_id GROUP BY c.id, order_month HAVING COUNT(*) >= 2 ORDER BY c.name, order_month"
+    },
+    {
+        "id": 10,
+        "difficulty": "Medium",
+        "title": "Monthly Revenue by Product Category",
+        "description": "Compute total revenue per category per month. Revenue = quantity * price_per_unit.",
+        "tables": ["Products (id, name, category)", "Orders (id, product_id, order_date, quantity, price_per_unit)"],
+        "example_output": "category | month | revenue\nElectronics | 2023-01 | ...",
+        "hint": "Join Orders with Products, group by category and month.",
+        "solution": "SELECT p.category, strftime('%Y-%m', o.order_date) AS month, SUM(o.quantity * o.price_per_unit) AS revenue FROM Products p JOIN Orders o ON p.id = o.product_id GROUP BY p.category, month ORDER BY month, p.category"
+    },
+    {
+        "id": 11,
+        "difficulty": "Hard",
+        "title": "Top 3 Products by Revenue Per Category",
+        "description": "For each category, find up to 3 products with the highest total revenue.",
+        "tables": ["Products (id, name, category)", "OrderItems (id, product_id, quantity, price)"],
+        "example_output": "category | name | revenue | rank\nElectronics | MacBook | ... | 1",
+        "hint": "Aggregate revenue per product and use ROW_NUMBER() over each category.",
+        "solution": "SELECT category, name, revenue, rn AS rank FROM ( SELECT p.category, p.name, SUM(oi.quantity * oi.price) AS revenue, ROW_NUMBER() OVER(PARTITION BY p.category ORDER BY SUM(oi.quantity * oi.price) DESC) AS rn FROM Products p JOIN OrderItems oi ON p.id = oi.product_id GROUP BY p.category, p.name ) t WHERE rn <= 3 ORDER BY category, revenue DESC"
+    },
+    {
+        "id": 12,
+        "difficulty": "Medium",
+        "title": "Churned Users (No Activity in Last 30 Days)",
+        "description": "Assume today is 2023-03-31. Find users who have no events in the last 30 days but had at least one event before that.",
+        "tables": ["Users (id, name, signup_date)", "Events (id, user_id, event_time, event_type)"],
+        "example_output": "name\nBob",
+        "hint": "Find last event date per user and filter by date.",
+        "solution": "WITH last_event AS ( SELECT u.id, u.name, MAX(e.event_time) AS last_time FROM Users u LEFT JOIN Events e ON u.id = e.user_id GROUP BY u.id, u.name ) SELECT name FROM last_event WHERE last_time IS NOT NULL AND last_time < '2023-03-02'"
+    },
+    {
+        "id": 13,
+        "difficulty": "Medium",
+        "title": "Second Highest Salary Per Department",
+        "description": "For each department, find the second highest distinct salary. If it does not exist, return NULL.",
+        "tables": ["Department (id, name)", "Employee (id, name, salary, department_id)"],
+        "example_output": "department | second_highest_salary\nEngineering | 100000\nSales | 75000",
+        "hint": "Use subquery with DISTINCT salary ordered by DESC and OFFSET 1.",
+        "solution": "SELECT d.name AS department, ( SELECT DISTINCT salary FROM Employee e2 WHERE e2.department_id = d.id ORDER BY salary DESC LIMIT 1 OFFSET 1 ) AS second_highest_salary FROM Department d"
+    },
+    {
+        "id": 14,
+        "difficulty": "Medium",
+        "title": "Running Total of Revenue Per User",
+        "description": "For each user and order, compute the running total of revenue ordered by order_date.",
+        "tables": ["Users (id, name)", "Orders (id, user_id, order_date, amount)"],
+        "example_output": "name | order_date | amount | running_total\nAlice | 2023-01-01 | 50 | 50\nAlice | 2023-01-10 | 100 | 150",
+        "hint": "Use SUM(amount) OVER(PARTITION BY user_id ORDER BY order_date).",
+        "solution": "SELECT u.name, o.order_date, o.amount, SUM(o.amount) OVER(PARTITION BY o.user_id ORDER BY o.order_date) AS running_total FROM Users u JOIN Orders o ON u.id = o.user_id ORDER BY u.name, o.order_date"
+    },
+    {
+        "id": 15,
+        "difficulty": "Easy",
+        "title": "Most Recent Order Per Customer",
+        "description": "For each customer, find their most recent order date and amount.",
+        "tables": ["Customers (id, name)", "Orders (id, customer_id, order_date, amount)"],
+        "example_output": "name | order_date | amount\nAlice | 2023-03-01 | 70.0",
+        "hint": "Use ROW_NUMBER() over each customer ordered by date DESC.",
+        "solution": "SELECT name, order_date, amount FROM ( SELECT c.name, o.order_date, o.amount, ROW_NUMBER() OVER(PARTITION BY c.id ORDER BY o.order_date DESC) AS rn FROM Customers c JOIN Orders o ON c.id = o.customer_id ) t WHERE rn = 1 ORDER BY name"
+    },
+    {
+        "id": 16,
+        "difficulty": "Easy",
+        "title": "Daily Active Users (DAU)",
+        "description": "Count distinct active users per day based on Events.",
+        "tables": ["Users (id, name)", "Events (id, user_id, event_date, event_type)"],
+        "example_output": "event_date | dau\n2023-03-01 | 2\n2023-03-02 | 2",
+        "hint": "Count DISTINCT user_id per event_date.",
+        "solution": "SELECT event_date, COUNT(DISTINCT user_id) AS dau FROM Events GROUP BY event_date ORDER BY event_date"
+    },
+    {
+        "id": 17,
+        "difficulty": "Medium",
+        "title": "Conversion from View to Purchase",
+        "description": "Compute the number of users who viewed and also purchased, and the overall conversion rate.",
+        "tables": ["Events (id, user_id, event_time, event_type)"],
+        "example_output": "view_users | purchase_users | converted_users | conversion_rate",
+        "hint": "Find users with view, users with purchase, and their intersection.",
+        "solution": "WITH view_users AS (SELECT DISTINCT user_id FROM Events WHERE event_type = 'view'), purchase_users AS (SELECT DISTINCT user_id FROM Events WHERE event_type = 'purchase'), converted AS (SELECT v.user_id FROM view_users v INNER JOIN purchase_users p ON v.user_id = p.user_id) SELECT (SELECT COUNT(*) FROM view_users) AS view_users, (SELECT COUNT(*) FROM purchase_users) AS purchase_users, (SELECT COUNT(*) FROM converted) AS converted_users, 1.0 * (SELECT COUNT(*) FROM converted) / NULLIF((SELECT COUNT(*) FROM view_users), 0) AS conversion_rate"
+    },
+    {
+        "id": 18,
+        "difficulty": "Hard",
+        "title": "Users with 3 Consecutive Login Days",
+        "description": "Find users who logged in for at least 3 consecutive days.",
+        "tables": ["Logins (id, user_id, login_date)"],
+        "example_output": "user_id\n1\n3",
+        "hint": "Use LAG/LEAD or date difference tricks to detect streaks.",
+        "solution": "WITH ordered AS ( SELECT user_id, login_date, ROW_NUMBER() OVER(PARTITION BY user_id ORDER BY login_date) AS rn FROM Logins ), grouped AS ( SELECT user_id, DATE(login_date, '-' || rn || ' day') AS grp_key FROM ordered ) SELECT DISTINCT user_id FROM grouped GROUP BY user_id, grp_key HAVING COUNT(*) >= 3"
+    },
+    {
+        "id": 19,
+        "difficulty": "Medium",
+        "title": "Average Order Value per User Segment",
+        "description": "Compute average order value per user segment.",
+        "tables": ["Users (id, name, segment)", "Orders (id, user_id, amount)"],
+        "example_output": "segment | avg_order_value\nA | ...\nB | ...",
+        "hint": "Join Users and Orders, group by segment.",
+        "solution": "SELECT u.segment, AVG(o.amount) AS avg_order_value FROM Users u JOIN Orders o ON u.id = o.user_id GROUP BY u.segment"
+    },
+    {
+        "id": 20,
+        "difficulty": "Medium",
+        "title": "First Purchase Date Per Marketing Channel",
+        "description": "For each acquisition channel, find the earliest purchase date among its users.",
+        "tables": ["Users (id, name, channel)", "Orders (id, user_id, order_date, amount)"],
+        "example_output": "channel | first_purchase_date\nAds | 2023-01-10\nOrganic | 2023-01-05",
+        "hint": "Join Users and Orders, group by channel and take MIN(order_date).",
+        "solution": "SELECT u.channel, MIN(o.order_date) AS first_purchase_date FROM Users u JOIN Orders o ON u.id = o.user_id GROUP BY u.channel ORDER BY u.channel"
+    }
+]
+
+PRACTICE_QUESTIONS_BY_ID = {q["id"]: q for q in PRACTICE_QUESTIONS}
+
 # ================== QUESTION DATABASE INITIALIZATION ==================
 
 def init_question_db(question_id):
@@ -247,7 +1510,7 @@ def init_question_db(question_id):
             (5, 2, '2023-01-20', 80.0),
             (6, 3, '2023-03-01', 120.0)
         ]
-        cursor.executemany('INSERT INTO Customers VALUES (?, ?, ?)', customers)
+        cursor.executemany('INSERT INTO Customers VALUES (?, ?)', customers)
         cursor.executemany('INSERT INTO Orders VALUES (?, ?, ?, ?)', orders)
 
     elif question_id == 10:
@@ -443,7 +1706,7 @@ def init_question_db(question_id):
             (4, 3, '2023-01-15', 30.0),
             (5, 3, '2023-04-01', 90.0)
         ]
-        cursor.executemany('INSERT INTO Customers VALUES (?, ?, ?)', customers)
+        cursor.executemany('INSERT INTO Customers VALUES (?, ?)', customers)
         cursor.executemany('INSERT INTO Orders VALUES (?, ?, ?, ?)', orders)
 
     elif question_id == 16:
@@ -475,7 +1738,7 @@ def init_question_db(question_id):
             (5, 3, '2023-03-02', 'login'),
             (6, 1, '2023-03-03', 'login')
         ]
-        cursor.executemany('INSERT INTO Users VALUES (?, ?, ?)', users)
+        cursor.executemany('INSERT INTO Users VALUES (?, ?)', users)
         cursor.executemany('INSERT INTO Events VALUES (?, ?, ?, ?)', events)
 
     elif question_id == 17:
@@ -588,95 +1851,3910 @@ def init_question_db(question_id):
     conn.commit()
     return conn
 
-# ================== ROUTES ==================
-
-@app.route('/')
-def index():
-    return render_template('index.html')
+def question_db_path(question_id):
+    return os.path.join(QUESTION_DB_DIR, f'q{int(question_id)}.db')
 
-# ---------- ANALYZE / OPTIMIZE / EXPLAIN ----------
+def open_question_db(question_id):
+    """
+    Open the prebuilt database for a question if the build step has
+    written one: read-only, immutable (no locking or change detection) and
+    memory-mapped, so every worker process shares a single page-cache copy
+    of the data. Falls back to building it in memory with init_question_db.
+    External question ids ("source:id") open the database the refresher
+    built, and raise ValueError while it does not exist.
+    """
+    if isinstance(question_id, str) and EXTERNAL_QUESTION_ID_RE.match(question_id):
+        path = external_question_db_path(question_id)
+        if not os.path.exists(path):
+            raise ValueError(f'Unknown question "{question_id}"')
+        return sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+    try:
+        path = question_db_path(question_id)
+    except (TypeError, ValueError):
+        return init_question_db(question_id)
+    if not os.path.exists(path):
+        return init_question_db(question_id)
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+    conn.execute(f'PRAGMA mmap_size={QUESTION_DB_MMAP_BYTES}')
+    return conn
 
-@app.route('/analyze', methods=['POST'])
-def analyze_query():
+def write_immutable_db(source_conn, path):
+    """
+    Copy a database to `path` atomically (write to a temp file, then
+    rename), so readers that opened the old file with immutable=1 never see
+    it change underneath them.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    target = sqlite3.connect(tmp_path)
     try:
-        data = request.json
-        query = data.get('query', '')
-        dialect = data.get('dialect', 'PostgreSQL')
+        source_conn.backup(target)
+        target.execute('PRAGMA journal_mode=DELETE')
+        target.execute('VACUUM')
+    finally:
+        target.close()
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+@app.cli.command('build-datasets')
+@click.option('--scale', is_flag=True, help='Also build the large databases used by scale grading.')
+def build_datasets_command(scale):
+    """Write every practice question's database to DATA_DIR/questions for read-only mmap serving."""
+    for question_id in PRACTICE_QUESTION_IDS:
+        conn = init_question_db(question_id)
+        try:
+            size = write_immutable_db(conn, question_db_path(question_id))
+        finally:
+            conn.close()
+        click.echo(f'question {question_id}: {question_db_path(question_id)} ({size} bytes)')
+        if scale:
+            counts, size = build_scale_question_db(question_id)
+            rows = ', '.join(f'{table} {count}' for table, count in counts.items())
+            click.echo(f'question {question_id}: {scale_question_db_path(question_id)} ({rows}; {size} bytes)')
+
+# ================== EXTERNAL QUESTION SOURCES ==================
+
+EXTERNAL_QUESTION_ID_RE = re.compile(r'^([A-Za-z0-9_-]{1,40}):([A-Za-z0-9_.-]{1,64})$')
+EXTERNAL_DIFFICULTIES = {'easy': 'Easy', 'medium': 'Medium', 'hard': 'Hard', '1': 'Easy', '2': 'Medium', '3': 'Hard'}
+
+def external_question_db_path(question_id):
+    source, key = EXTERNAL_QUESTION_ID_RE.match(question_id).groups()
+    return os.path.join(EXTERNAL_QUESTION_DIR, source, f'{key}.db')
+
+def first_field(raw, *names):
+    return next((raw[name] for name in names if raw.get(name) not in (None, '', [])), None)
+
+def external_question_items(payload):
+    """The list of question objects in an upstream response (a bare list, or under questions / data / items)."""
+    if isinstance(payload, dict):
+        payload = first_field(payload, 'questions', 'data', 'items', 'results') or []
+        if isinstance(payload, dict):
+            payload = first_field(payload, 'questions', 'items') or []
+    if not isinstance(payload, list):
+        raise ValueError('Upstream response has no list of questions')
+    return payload
+
+def normalize_external_question(source, raw):
+    """
+    Map one upstream question onto the /get-practice-questions shape plus
+    its setup_sql. Accepts common field spellings (title / questionTitle,
+    description / content, setup_sql / schema / sqlSchema as text or a
+    list of statements, solution / answer, hint / hints, difficulty / level
+    as a word or 1-3). Raises ValueError when a required field is missing.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError('question is not an object')
+    external_id = first_field(raw, 'id', 'questionId', 'question_id', 'slug', 'titleSlug')
+    title = first_field(raw, 'title', 'questionTitle', 'name')
+    setup_sql = first_field(raw, 'setup_sql', 'schema', 'sqlSchema', 'setup', 'ddl')
+    solution = first_field(raw, 'solution', 'answer', 'reference_solution', 'referenceSolution')
+    if external_id is None or not title or not setup_sql or not solution:
+        raise ValueError('id, title, setup SQL and solution are required')
+    if isinstance(setup_sql, list):
+        setup_sql = ';\n'.join(str(statement).strip().rstrip(';') for statement in setup_sql) + ';'
+    hint = first_field(raw, 'hint', 'hints')
+    if isinstance(hint, list):
+        hint = ' '.join(str(h) for h in hint)
+    key = re.sub(r'[^A-Za-z0-9_.-]', '-', str(external_id))[:64]
+    return {
+        'id': f'{source}:{key}',
+        'source': source,
+        'difficulty': EXTERNAL_DIFFICULTIES.get(str(first_field(raw, 'difficulty', 'level') or '').lower(), 'Medium'),
+        'title': str(title),
+        'description': str(first_field(raw, 'description', 'content', 'question', 'prompt') or ''),
+        'example_output': str(first_field(raw, 'example_output', 'exampleOutput', 'expected_output') or ''),
+        'hint': str(hint or ''),
+        'solution': str(solution).strip(),
+        'setup_sql': str(setup_sql)
+    }
+
+def deny_attach(action, *args):
+    """sqlite3 authorizer for upstream SQL: no ATTACH / DETACH (they could touch files)."""
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+def build_external_question_db(question):
+    """
+    Build a question's database from its setup SQL, check that the
+    reference solution runs on it, fill in "tables" like the built-in
+    questions and write it next to the cache (write_immutable_db).
+    Raises sqlite3.Error / QueryTimeout for bad SQL; the upstream's setup
+    SQL is interrupted after EXTERNAL_SETUP_TIMEOUT seconds.
+    """
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.set_authorizer(deny_attach)
+        deadline = time.perf_counter() + EXTERNAL_SETUP_TIMEOUT
+        conn.set_progress_handler(lambda: 1 if time.perf_counter() > deadline else 0, 10000)
+        try:
+            conn.executescript(question['setup_sql'])
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                raise QueryTimeout(f'Setup SQL exceeded {EXTERNAL_SETUP_TIMEOUT:g}s')
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+        conn.set_authorizer(None)
+        run_with_timeout(conn, question['solution'])
+        question['tables'] = [
+            f"{table} ({', '.join(c[1] for c in conn.execute(f'PRAGMA table_info({quote_ident(table)})'))})"
+            for (table,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid")
+        ]
+        write_immutable_db(conn, external_question_db_path(question['id']))
+    finally:
+        conn.close()
 
-        if not query.strip():
-            return jsonify({'error': 'Query cannot be empty'}), 400
+def question_digest(question):
+    return hashlib.sha256(f"{question['setup_sql']}\0{question['solution']}".encode('utf-8')).hexdigest()[:16]
 
-        analyze_prompt = f"""
-You must respond ONLY with valid JSON.
-Dialect: "{dialect}"
+class ExternalQuestionCache:
+    """
+    Stale-while-revalidate cache of external question sources.
+
+    Reads never wait on the upstream (except a short EXTERNAL_FIRST_FETCH_WAIT
+    on a cold start): a stale entry is served as-is while a background
+    worker refetches it. A refresh maps the response with
+    normalize_external_question, prebuilds each question's database (only
+    when its setup SQL or solution changed) and stores the normalized list
+    in EXTERNAL_QUESTION_DIR/<source>.json, so a restart serves the last
+    good copy immediately. Failed fetches keep the previous questions and
+    are retried after EXTERNAL_RETRY_SECONDS. A daemon thread also
+    refreshes every source once they are in use.
+    """
 
-SQL query:
-{query}
+    def __init__(self, sources, directory, max_age, retry_after):
+        self.sources = sources
+        self.directory = directory
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='external-questions')
+        self.refresher = None
+
+    def cache_path(self, source):
+        return os.path.join(self.directory, f'{source}.json')
+
+    def _entry(self, source):
+        """The in-memory entry for a source, loading the on-disk copy the first time (lock held)."""
+        if source not in self.entries:
+            entry = {'questions': [], 'fetched_at': None, 'etag': None, 'digests': {},
+                     'error': None, 'attempted_at': None, 'rejected': []}
+            try:
+                with open(self.cache_path(source)) as f:
+                    entry.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+            self.entries[source] = entry
+        return self.entries[source]
+
+    def get(self, source, wait=0):
+        """(entry, refreshing) for a source, scheduling a background refresh when it is stale."""
+        self.start()
+        with self.lock:
+            entry = self._entry(source)
+            now = time.time()
+            stale = entry['fetched_at'] is None or now - entry['fetched_at'] > self.max_age
+            backing_off = entry['error'] and entry['attempted_at'] and now - entry['attempted_at'] < self.retry_after
+            future = self._schedule(source) if stale and not backing_off else self.pending.get(source)
+        if future is not None and entry['fetched_at'] is None and wait > 0:
+            try:
+                future.result(timeout=wait)
+            except Exception:
+                pass
+        with self.lock:
+            future = self.pending.get(source)
+            return dict(self.entries[source]), future is not None and not future.done()
+
+    def _schedule(self, source):
+        future = self.pending.get(source)
+        if future is None or future.done():
+            future = self.executor.submit(self.refresh, source)
+            self.pending[source] = future
+        return future
+
+    def refresh(self, source):
+        """Fetch, normalize, prebuild and store one source (runs on the executor)."""
+        with self.lock:
+            entry = dict(self._entry(source))
+        started = time.time()
+        try:
+            headers = {'If-None-Match': entry['etag']} if entry['etag'] and entry['questions'] else {}
+            resp = requests.get(self.sources[source], timeout=EXTERNAL_FETCH_TIMEOUT, headers=headers)
+            if resp.status_code == 304:
+                update = {'fetched_at': started, 'error': None, 'attempted_at': started}
+            else:
+                resp.raise_for_status()
+                update = self._rebuild(source, external_question_items(resp.json()), entry['digests'])
+                update.update({'fetched_at': started, 'etag': resp.headers.get('ETag'),
+                               'error': None, 'attempted_at': started})
+            metrics_incr('external_refreshes')
+        except Exception as e:
+            print(f"External questions refresh failed for {source}: {e}")
+            metrics_incr('external_refresh_errors')
+            update = {'error': str(e), 'attempted_at': started}
+        with self.lock:
+            self.entries[source].update(update)
+            snapshot = dict(self.entries[source])
+        if 'questions' in update:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f'{self.cache_path(source)}.tmp-{os.getpid()}'
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.cache_path(source))
+
+    def _rebuild(self, source, items, digests):
+        questions, rejected, new_digests = [], [], {}
+        seen = set()
+        for raw in items[:EXTERNAL_MAX_QUESTIONS]:
+            try:
+                question = normalize_external_question(source, raw)
+                if question['id'] in seen:
+                    raise ValueError('duplicate id')
+                seen.add(question['id'])
+                digest = question_digest(question)
+                if digests.get(question['id'], {}).get('digest') == digest \
+                        and os.path.exists(external_question_db_path(question['id'])):
+                    question['tables'] = digests[question['id']]['tables']
+                else:
+                    build_external_question_db(question)
+                new_digests[question['id']] = {'digest': digest, 'tables': question['tables']}
+                questions.append(question)
+            except (ValueError, sqlite3.Error, QueryTimeout) as e:
+                rejected.append({'id': raw.get('id') if isinstance(raw, dict) else None, 'error': str(e)})
+        if rejected:
+            print(f"External questions from {source}: {len(rejected)} rejected")
+        return {'questions': questions, 'digests': new_digests, 'rejected': rejected}
+
+    def start(self):
+        """Start the periodic refresher thread (once, on first use)."""
+        if self.refresher is not None or not self.sources:
+            return
+        with self.lock:
+            if self.refresher is not None:
+                return
+            self.refresher = threading.Thread(target=self._refresh_loop, name='external-questions-refresher', daemon=True)
+            self.refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(max(1, self.max_age))
+            for source in list(self.entries):
+                self.get(source)
+
+    def snapshot(self):
+        with self.lock:
+            return {source: {'questions': len(entry['questions']), 'fetched_at': entry['fetched_at'],
+                             'error': entry['error'], 'rejected': len(entry['rejected'])}
+                    for source, entry in self.entries.items()}
+
+external_questions = ExternalQuestionCache(
+    EXTERNAL_SQL_SOURCES, EXTERNAL_QUESTION_DIR, EXTERNAL_REFRESH_SECONDS, EXTERNAL_RETRY_SECONDS
+)
+
+@app.cli.command('refresh-external-questions')
+def refresh_external_questions_command():
+    """Fetch every configured external source now and prebuild its question databases."""
+    for source in EXTERNAL_SQL_SOURCES:
+        external_questions.refresh(source)
+        entry, _ = external_questions.get(source)
+        status = f"error: {entry['error']}" if entry['error'] else 'ok'
+        click.echo(f"{source}: {len(entry['questions'])} questions, {len(entry['rejected'])} rejected ({status})")
+
+# ================== RESULT ENCODING ==================
+
+def wants_msgpack():
+    """True when the client prefers MessagePack and the encoder is installed."""
+    if msgpack is None:
+        return False
+    best = request.accept_mimetypes.best_match(['application/json', 'application/msgpack'])
+    return best == 'application/msgpack'
+
+def wants_columnar():
+    """
+    Clients opt in to the compact columnar result format with the
+    `X-Result-Format: columnar` header (or `?format=columnar`).
+    MessagePack responses always use it.
+    """
+    fmt = request.headers.get('X-Result-Format') or request.args.get('format') or ''
+    return fmt.lower() == 'columnar' or wants_msgpack()
 
-Return JSON in this exact format:
-{{
-  "syntax_issues": ["issue1", "issue2"],
-  "logical_issues": ["issue1"],
-  "performance_issues": ["issue1"],
-  "needs_optimization": true,
-  "overall_assessment": "brief assessment",
-  "hints_for_improvement": ["hint1", "hint2"]
-}}
-"""
+def encode_column(values):
+    """
+    Dictionary-encode a column when it is all text (or NULL) and repetitive:
+    {"dict": [distinct values], "codes": [index or null per row]}.
+    Otherwise the plain list of values is returned.
+    """
+    if not values:
+        return list(values)
+
+    lookup = {}
+    codes = []
+    for value in values:
+        if value is None:
+            codes.append(None)
+        elif isinstance(value, str):
+            codes.append(lookup.setdefault(value, len(lookup)))
+        else:
+            return list(values)
 
-        analysis_response = call_groq(ANALYZE_SYSTEM_PROMPT, analyze_prompt, "json")
-        analysis = json.loads(analysis_response)
+    if not lookup or len(lookup) > len(values) * COLUMNAR_DICT_MAX_RATIO:
+        return list(values)
+    return {'dict': list(lookup), 'codes': codes}
 
-        return jsonify({
-            'success': True,
-            'analysis': analysis
-        })
+def encode_rows(columns, rows):
+    """
+    Encode a result set for the response. Default is the classic
+    {"columns": [...], "rows": [[...], ...]} shape; when the client asked
+    for columnar results it becomes
+    {"encoding": "columnar", "columns": [...], "length": n, "data": [column, ...]}.
+    """
+    if not wants_columnar():
+        return {'columns': columns, 'rows': rows}
+
+    if rows:
+        data = [encode_column(col) for col in zip(*rows)]
+    else:
+        data = [[] for _ in columns]
+
+    return {
+        'encoding': 'columnar',
+        'columns': columns,
+        'length': len(rows),
+        'data': data
+    }
+
+def json_default(value):
+    """JSON fallback for database values: BLOBs as hex strings, dates / decimals (DuckDB) as text."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID, datetime.timedelta)):
+        return str(value)
+    raise TypeError(f'Type is not JSON serializable: {type(value).__name__}')
+
+def payload_response(payload, status=200):
+    """
+    Serialize a response payload using the negotiated format (MessagePack or
+    JSON, through orjson when available) and compress large bodies with
+    brotli or gzip according to Accept-Encoding.
+    """
+    if wants_msgpack():
+        body = msgpack.packb(payload, use_bin_type=True, default=json_default)
+        mimetype = 'application/msgpack'
+    elif orjson is not None:
+        body = orjson.dumps(payload, default=json_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        mimetype = 'application/json'
+    else:
+        body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=json_default).encode('utf-8')
+        mimetype = 'application/json'
+
+    content_encoding = None
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            body = brotli.compress(body, quality=5)
+            content_encoding = 'br'
+        elif accepted['gzip']:
+            body = gzip.compress(body, compresslevel=6)
+            content_encoding = 'gzip'
+
+    response = app.response_class(body, status=status, mimetype=mimetype)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding, X-Result-Format'
+    return response
+
+def ndjson_line(payload):
+    """One newline-terminated JSON document for streamed (NDJSON) responses."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=json_default, option=orjson.OPT_PASSTHROUGH_DATETIME) + b'\n'
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=json_default).encode('utf-8') + b'\n'
+
+def fetch_result(cursor):
+    """(encoded result set, None) after a query that returns rows, else (None, affected row count)."""
+    if cursor.description is not None:
+        cols = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+        return encode_rows(cols, rows), None
+    return None, cursor.rowcount
+
+def quote_ident(name):
+    """Quote an identifier for safe interpolation into SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+def snapshot_tables(cursor):
+    """Return {table_name: encoded rows} for every user table in the database."""
+    cursor.execute(f"SELECT name FROM {schema_objects(cursor.connection)} WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+    tables = {}
+    for (table_name,) in cursor.fetchall():
+        cursor.execute(f"PRAGMA table_info({quote_ident(table_name)})")
+        cols_meta = cursor.fetchall()
+        col_names = [c[1] for c in cols_meta]  # name
+        cursor.execute(f"SELECT * FROM {quote_ident(table_name)}")
+        rows = cursor.fetchall()
+        tables[table_name] = encode_rows(col_names, rows)
+    return tables
+
+# ================== SQL HELPERS ==================
+
+SQL_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+  | (?P<param>[?][0-9]*|[$][0-9]+|[:@$][A-Za-z_][A-Za-z0-9_]*)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op><>|!=|<=|>=|==|\|\||<<|>>|[-+*/%=<>(),.;~&|])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+def sql_token_spans(sql):
+    """Like sql_tokens, but (kind, text, start, end) so callers can edit the original text."""
+    spans = []
+    for match in SQL_TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind in ('space', 'comment'):
+            continue
+        spans.append((kind, match.group(), match.start(), match.end()))
+    return spans
+
+def sql_tokens(sql):
+    """
+    Split SQL into (kind, text) tokens, dropping whitespace and comments.
+    Kinds: string, quoted, number, param, ident, op, other.
+    """
+    return [(kind, text) for kind, text, _, _ in sql_token_spans(sql)]
 
-    except json.JSONDecodeError as e:
-        return jsonify({'error': f'Failed to parse analysis response: {str(e)}'}), 500
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+def statement_keywords(sql):
+    """
+    Leading keyword of every statement in `sql`, upper-cased, skipping
+    comments. Statements end at a ';' that completes them according to
+    sqlite3.complete_statement, so trigger bodies are not split.
+    """
+    keywords = []
+    start = 0
+    at_start = True
+    for kind, text, _, end in sql_token_spans(sql):
+        if at_start:
+            keywords.append(text.upper())
+            at_start = False
+        if kind == 'op' and text == ';' and sqlite3.complete_statement(sql[start:end]):
+            start = end
+            at_start = True
+    return keywords
+
+def is_read_query(sql):
+    """True for SELECT / WITH / VALUES statements."""
+    tokens = sql_tokens(sql)
+    return bool(tokens) and tokens[0][1].upper() in ('SELECT', 'WITH', 'VALUES')
+
+def identifier_name(kind, text):
+    """Bare, lower-cased name for ident / quoted tokens, else None."""
+    if kind == 'ident':
+        return text.lower()
+    if kind == 'quoted':
+        return text[1:-1].lower()
+    return None
+
+def minify_sql(sql):
+    """Drop comments and collapse whitespace, keeping a space only between word-like tokens."""
+    out = []
+    prev_word = False
+    for kind, text in sql_tokens(sql):
+        word = kind not in ('op', 'other')
+        if out and word and prev_word:
+            out.append(' ')
+        out.append(text)
+        prev_word = word
+    return ''.join(out)
+
+def referenced_tables(cursor, query):
+    """Names of tables and views in the database that the query mentions."""
+    names = {identifier_name(kind, text) for kind, text in sql_tokens(query)}
+    cursor.execute(f"SELECT name FROM {schema_objects(cursor.connection)} "
+                   f"WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'")
+    return [name for (name,) in cursor.fetchall() if name.lower() in names]
+
+def underlying_tables(conn, query):
+    """Tables the query reads: the ones it references, plus those behind the views it references."""
+    cursor = conn.cursor()
+    tables, seen, pending = [], set(), [query]
+    while pending:
+        for name in referenced_tables(cursor, pending.pop()):
+            if name.lower() in seen:
+                continue
+            seen.add(name.lower())
+            kind, sql = conn.execute(f"SELECT type, sql FROM {schema_objects(conn)} WHERE name = ?", (name,)).fetchone()
+            if kind == 'view':
+                pending.append(sql)
+            else:
+                tables.append(name)
+    return tables
+
+def schema_ddl_for_query(cursor, query):
+    """Minified CREATE statements (tables, views and their indexes) for only the objects the query references."""
+    tables = referenced_tables(cursor, query)
+    if not tables:
+        return None
+    placeholders = ','.join('?' * len(tables))
+    cursor.execute(
+        f"SELECT sql FROM {schema_objects(cursor.connection)} WHERE sql IS NOT NULL AND tbl_name IN ({placeholders}) "
+        f"ORDER BY type = 'index', name",
+        tables
+    )
+    return '\n'.join(minify_sql(sql) + ';' for (sql,) in cursor.fetchall())
+
+def schema_ddl_from_setup(setup_sql, query, statistics=False):
+    """
+    Build a scratch database from setup SQL and return the pruned DDL for
+    the query (None on failure), followed by the condensed table statistics
+    when `statistics` is set.
+    """
+    if not setup_sql:
+        return None
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.executescript(setup_sql)
+        schema_ddl = schema_ddl_for_query(conn.cursor(), query)
+        if schema_ddl and statistics:
+            schema_ddl += statistics_section(conn, query)
+        return schema_ddl
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
 
-@app.route('/optimize', methods=['POST'])
-def optimize_query():
+# ================== TABLE STATISTICS ==================
+
+def read_varint(blob, pos):
+    """SQLite varint starting at `pos`: (value, next position)."""
+    value = 0
+    for i in range(9):
+        byte = blob[pos + i]
+        if i == 8:
+            return (value << 8) | byte, pos + 9
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, pos + i + 1
+
+def decode_record(blob):
+    """Values of an SQLite record, the format of sqlite_stat4.sample."""
+    header_size, pos = read_varint(blob, 0)
+    serial_types = []
+    while pos < header_size:
+        serial_type, pos = read_varint(blob, pos)
+        serial_types.append(serial_type)
+    values = []
+    pos = header_size
+    for serial_type in serial_types:
+        if serial_type == 0:
+            values.append(None)
+        elif serial_type in (8, 9):
+            values.append(serial_type - 8)
+        elif serial_type <= 6:
+            size = (1, 2, 3, 4, 6, 8)[serial_type - 1]
+            values.append(int.from_bytes(blob[pos:pos + size], 'big', signed=True))
+            pos += size
+        elif serial_type == 7:
+            values.append(struct.unpack('>d', blob[pos:pos + 8])[0])
+            pos += 8
+        else:
+            size = (serial_type - 12) // 2
+            chunk = bytes(blob[pos:pos + size])
+            values.append(chunk.decode('utf-8', 'replace') if serial_type % 2 else chunk)
+            pos += size
+    return values
+
+def stat_value(value):
+    """A column value as shown in statistics: BLOBs as short hex, long text cut."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return 'x' + bytes(value)[:8].hex()
+    if isinstance(value, str) and len(value) > 40:
+        return value[:37] + '...'
+    return value
+
+def column_histogram(conn, table, column, non_null, stat4_samples=None):
+    """
+    Quantile samples and most common values of one column. Samples come
+    from sqlite_stat4 when the library collected them, else they are read
+    through the index at evenly spaced offsets.
+    """
+    t, c = quote_ident(table), quote_ident(column)
+    if stat4_samples:
+        step = max(1, len(stat4_samples) // STATS_QUANTILES)
+        samples = stat4_samples[::step][:STATS_QUANTILES]
+    else:
+        offsets = sorted({round(i * (non_null - 1) / (STATS_QUANTILES - 1)) for i in range(STATS_QUANTILES)}) if non_null else []
+        samples = [conn.execute(f"SELECT {c} FROM {t} WHERE {c} IS NOT NULL ORDER BY {c} LIMIT 1 OFFSET ?",
+                                (offset,)).fetchone()[0] for offset in offsets]
+    top = conn.execute(
+        f"SELECT {c}, COUNT(*) AS n FROM {t} WHERE {c} IS NOT NULL GROUP BY {c} HAVING n > 1 ORDER BY n DESC LIMIT ?",
+        (STATS_TOP_VALUES,)
+    ).fetchall()
+    return {
+        'samples': [stat_value(v) for v in samples],
+        'top_values': [[stat_value(v), n] for v, n in top],
+        'source': 'sqlite_stat4' if stat4_samples else 'index'
+    }
+
+def collect_statistics(conn, tables=None):
+    """
+    Run ANALYZE and gather compact statistics for `tables` (default: every
+    table): {table: {"rows", "columns", "indexes", "histograms"}}. Columns
+    get distinct and NULL counts; indexes their columns, uniqueness and
+    the sqlite_stat1 estimate of rows per key prefix; the leading column of
+    each index gets a histogram (column_histogram). ANALYZE writes, so
+    tables of an attached base image are copied into main first.
+    """
+    copy_image_tables(conn, tables)
+    conn.execute('ANALYZE main')
+    existing = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    tables = existing if tables is None else [t for t in tables if t in existing]
+
+    stat1 = {}
+    for tbl, idx, stat in conn.execute('SELECT tbl, idx, stat FROM sqlite_stat1'):
+        stat1[(tbl, idx)] = [int(n) for n in (stat or '').split() if n.isdigit()]
+    stat4 = defaultdict(list)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat4'").fetchone():
+        for idx, sample in conn.execute('SELECT idx, sample FROM sqlite_stat4'):
+            stat4[idx].append(decode_record(sample)[0])
+
+    statistics = {}
+    for table in tables:
+        columns = table_columns(conn, table)
+        rows = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table)}").fetchone()[0]
+        counts = conn.execute(
+            f"SELECT {', '.join(f'COUNT(DISTINCT {quote_ident(c)}), SUM({quote_ident(c)} IS NULL)' for c in columns)} "
+            f"FROM {quote_ident(table)}"
+        ).fetchone() if columns else ()
+        column_stats = {c: {'distinct': counts[2 * i], 'nulls': counts[2 * i + 1] or 0} for i, c in enumerate(columns)}
+
+        indexes, histograms = [], {}
+        for _, name, unique, _, _ in conn.execute(f"PRAGMA index_list({quote_ident(table)})"):
+            index_columns = [c[2] for c in conn.execute(f"PRAGMA index_info({quote_ident(name)})")]
+            if not index_columns or None in index_columns:
+                continue  # expression index
+            indexes.append({'name': name, 'columns': index_columns, 'unique': bool(unique),
+                            'rows_per_key': stat1.get((table, name), [])[1:]})
+            leading = index_columns[0]
+            non_null = rows - column_stats[leading]['nulls']
+            if leading not in histograms and non_null:
+                histograms[leading] = column_histogram(conn, table, leading, non_null, stat4.get(name))
+        statistics[table] = {'rows': rows, 'columns': column_stats, 'indexes': indexes, 'histograms': histograms}
+    return statistics
+
+def condensed_statistics(statistics, max_chars=STATS_PROMPT_MAX_CHARS):
+    """One line per table for an LLM prompt, cut to whole lines within max_chars."""
+    lines = []
+    for table, stats in statistics.items():
+        rows = stats['rows']
+        columns = []
+        for name, col in stats['columns'].items():
+            text = f"{name} {col['distinct']}"
+            if col['nulls']:
+                text += f" ({round(100 * col['nulls'] / rows)}% null)"
+            columns.append(text)
+        parts = [f"{table}: {rows} rows", f"distinct values: {', '.join(columns)}"]
+        for index in stats['indexes']:
+            per_key = f", ~{index['rows_per_key'][0]} rows per {index['columns'][0]}" if index['rows_per_key'] else ''
+            parts.append(f"{'unique ' if index['unique'] else ''}index {index['name']}({', '.join(index['columns'])}){per_key}")
+        for column, histogram in stats['histograms'].items():
+            text = f"{column} samples {', '.join(map(str, histogram['samples']))}"
+            if histogram['top_values']:
+                text += f"; most common {', '.join(f'{v} ({n} rows)' for v, n in histogram['top_values'])}"
+            parts.append(text)
+        lines.append('; '.join(parts))
+    text = ''
+    for line in lines:
+        if len(text) + len(line) + 1 > max_chars:
+            break
+        text += line + '\n'
+    return text.rstrip('\n')
+
+def statistics_requested(data):
+    """The request's "statistics" flag (true / "true" / 1), PROMPT_STATISTICS when it is absent."""
+    return str(data.get('statistics', PROMPT_STATISTICS)).lower() in ('1', 'true')
+
+def statistics_section(conn, query):
+    """Condensed statistics of the tables `query` references, as a prompt section ("" when there are none)."""
+    tables = referenced_tables(conn.cursor(), query)
+    condensed = condensed_statistics(collect_statistics(conn, tables)) if tables else ''
+    return f"\n\nTable statistics (from ANALYZE):\n{condensed}" if condensed else ''
+
+# ================== BULK IMPORT / BASE IMAGES ==================
+
+IMAGE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+IMPORT_FORMATS = {'csv', 'tsv', 'jsonl'}
+# Schema name of a base image attached by open_database
+IMAGE_SCHEMA = 'image'
+# Statements that never write an attached image, and those a per-table copy cannot
+# cover (a dropped or renamed copy would uncover the image's table behind it)
+IMAGE_READ_STATEMENTS = {'SELECT', 'VALUES', 'EXPLAIN'}
+IMAGE_FULL_COPY_STATEMENTS = {'DROP', 'ALTER', 'ANALYZE', 'REINDEX', 'VACUUM'}
+
+# Serializes imports, which replace the image file they add a table to
+image_write_lock = threading.Lock()
+
+def image_path(image_id):
+    if not IMAGE_ID_RE.match(image_id or ''):
+        raise ValueError('Invalid base image id')
+    return os.path.join(IMPORT_DIR, f'{image_id}.db')
+
+def image_attached(conn):
+    """True when `conn` reads a base image through ATTACH (open_database without copy)."""
+    return any(row[1] == IMAGE_SCHEMA for row in conn.execute('PRAGMA database_list'))
+
+def schema_objects(conn):
+    """
+    Subquery listing the schema as (layer, seq, type, name, tbl_name, sql):
+    main's sqlite_master (layer 1) plus, with an attached base image, the
+    image's objects whose table main does not shadow (layer 0).
+    """
+    main = "SELECT 1 AS layer, rowid AS seq, type, name, tbl_name, sql FROM main.sqlite_master"
+    if not image_attached(conn):
+        return f"({main})"
+    return (f"(SELECT 0 AS layer, rowid AS seq, type, name, tbl_name, sql FROM {IMAGE_SCHEMA}.sqlite_master "
+            f"WHERE lower(tbl_name) NOT IN (SELECT lower(name) FROM main.sqlite_master WHERE type = 'table') "
+            f"UNION ALL {main})")
+
+def copy_image_tables(conn, tables=None):
+    """
+    Copy `tables` (default: every table) of an attached base image, with
+    their indexes, into main, where they shadow the read-only originals.
+    Tables already in main are skipped.
+    """
+    if not image_attached(conn):
+        return
+    wanted = None if tables is None else {name.lower() for name in tables}
+    in_main = {name.lower() for (name,) in conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'")}
+    in_transaction = conn.in_transaction
+    for name, sql in conn.execute(f"SELECT name, sql FROM {IMAGE_SCHEMA}.sqlite_master "
+                                  f"WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid").fetchall():
+        if name.lower() in in_main or (wanted is not None and name.lower() not in wanted):
+            continue
+        conn.execute(sql)
+        columns = ', '.join(quote_ident(c[1]) for c in conn.execute(
+            f"PRAGMA {IMAGE_SCHEMA}.table_info({quote_ident(name)})"))
+        conn.execute(f"INSERT INTO main.{quote_ident(name)} ({columns}) "
+                     f"SELECT {columns} FROM {IMAGE_SCHEMA}.{quote_ident(name)}")
+        for (index_sql,) in conn.execute(f"SELECT sql FROM {IMAGE_SCHEMA}.sqlite_master "
+                                         f"WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (name,)).fetchall():
+            conn.execute(index_sql)
+    if conn.in_transaction and not in_transaction:
+        conn.commit()
+
+def copy_on_write(conn, sql):
+    """
+    Get an attached base image ready for SQL that may write: copy the
+    image tables it mentions into main. Statements that a per-table copy
+    cannot cover (IMAGE_FULL_COPY_STATEMENTS) copy every table and detach
+    the image. Read-only statements copy nothing.
+    """
+    if not image_attached(conn):
+        return
+    keywords = set(statement_keywords(sql))
+    if keywords <= IMAGE_READ_STATEMENTS:
+        return
+    if keywords & IMAGE_FULL_COPY_STATEMENTS:
+        copy_image_tables(conn)
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute(f'DETACH DATABASE {IMAGE_SCHEMA}')
+        return
+    copy_image_tables(conn, {identifier_name(kind, text) for kind, text in sql_tokens(sql)} - {None})
+
+def open_database(setup_sql='', base_image=None, copy=False, **connect_kwargs):
+    """
+    New in-memory database with setup_sql applied, optionally on top of an
+    imported base image. The image is attached read-only and immutable, so
+    requests share its pages instead of each copying it; its tables are
+    copied into the private main schema only when something writes them
+    (copy_on_write, which setup_sql goes through here). With `copy` the
+    whole image is copied up front instead, for playground connections
+    whose steps write freely and track changes through main's schema.
+    Raises ValueError for an unknown image and sqlite3.Error for bad setup SQL.
+    """
+    conn = sqlite3.connect(':memory:', uri=True, **connect_kwargs)
     try:
-        data = request.json
-        query = data.get('query', '')
-        analysis = data.get('analysis', {})
+        if base_image:
+            path = image_path(base_image)
+            if not os.path.exists(path):
+                raise ValueError(f'Base image "{base_image}" not found')
+            uri = f'file:{path}?mode=ro&immutable=1'
+            if copy:
+                source = sqlite3.connect(uri, uri=True)
+                try:
+                    source.backup(conn)
+                finally:
+                    source.close()
+            else:
+                conn.execute(f'ATTACH DATABASE ? AS {IMAGE_SCHEMA}', (uri,))
+                conn.execute(f'PRAGMA {IMAGE_SCHEMA}.mmap_size={QUESTION_DB_MMAP_BYTES}')
+                if setup_sql:
+                    copy_on_write(conn, setup_sql)
+        if setup_sql:
+            conn.executescript(setup_sql)
+    except Exception:
+        conn.close()
+        raise
+    return conn
 
-        if not query.strip():
-            return jsonify({'error': 'Query cannot be empty'}), 400
+def clean_column_names(names):
+    """Strip header names, fill blanks and de-duplicate them."""
+    cleaned = []
+    seen = set()
+    for i, name in enumerate(names):
+        name = (name or '').strip() or f'col{i + 1}'
+        base, n = name, 2
+        while name.lower() in seen:
+            name = f'{base}_{n}'
+            n += 1
+        seen.add(name.lower())
+        cleaned.append(name)
+    return cleaned
+
+def infer_sqlite_type(values):
+    """Narrowest of INTEGER / REAL / TEXT that fits every non-empty sample value."""
+    rank = {'INTEGER': 0, 'REAL': 1, 'TEXT': 2}
+    best = None
+    for value in values:
+        if value is None or value == '':
+            continue
+        if isinstance(value, (bool, int)):
+            kind = 'INTEGER'
+        elif isinstance(value, float):
+            kind = 'REAL'
+        elif isinstance(value, str):
+            try:
+                int(value)
+                kind = 'INTEGER'
+            except ValueError:
+                try:
+                    float(value)
+                    kind = 'REAL'
+                except ValueError:
+                    kind = 'TEXT'
+        else:
+            kind = 'TEXT'
+        if best is None or rank[kind] > rank[best]:
+            best = kind
+            if best == 'TEXT':
+                break
+    return best or 'TEXT'
+
+def read_import_rows(stream, fmt, has_header=True, dropped_keys=None):
+    """
+    Lazily parse a binary stream into (columns, sample rows, remaining rows).
+    Empty CSV fields become NULL; JSON objects / arrays are stored as JSON text.
+    JSONL columns are the keys seen in the first IMPORT_SAMPLE_ROWS lines;
+    keys that only appear later are not imported and are added to the
+    `dropped_keys` set when one is given. A line that is not a JSON object
+    raises ValueError naming it.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='', errors='replace')
+
+    if fmt in ('csv', 'tsv'):
+        reader = csv.reader(text, delimiter='\t' if fmt == 'tsv' else ',')
+        first = next(reader, None)
+        if first is None:
+            return [], [], iter(())
+        if has_header:
+            columns = clean_column_names(first)
+        else:
+            columns = clean_column_names([''] * len(first))
+            reader = itertools.chain([first], reader)
+        width = len(columns)
+
+        def normalize(row):
+            row = [v if v != '' else None for v in row[:width]]
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+            return row
+
+        rows = (normalize(row) for row in reader)
+        sample = list(itertools.islice(rows, IMPORT_SAMPLE_ROWS))
+        return columns, sample, rows
+
+    def parse(lines):
+        for number, line in lines:
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f'Line {number}: invalid JSON ({str(e)})')
+            if not isinstance(obj, dict):
+                raise ValueError(f'Line {number}: expected a JSON object, got {type(obj).__name__}')
+            yield obj
+
+    objects = parse(enumerate(text, 1))
+    sample_objects = list(itertools.islice(objects, IMPORT_SAMPLE_ROWS))
+    keys = []
+    for obj in sample_objects:
+        for key in obj:
+            if key not in keys:
+                keys.append(key)
+    columns = clean_column_names(keys)
+    known = set(keys)
+
+    def to_row(obj):
+        if dropped_keys is not None and not known.issuperset(obj):
+            dropped_keys.update(key for key in obj if key not in known)
+        row = []
+        for key in keys:
+            value = obj.get(key)
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value)
+            row.append(value)
+        return row
+
+    return columns, [to_row(o) for o in sample_objects], (to_row(o) for o in objects)
+
+def import_stream(stream, table, fmt, image_id=None, has_header=True, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Load a CSV / TSV / JSONL stream into `table` of a base image (a new one
+    unless image_id is given). Rows go in through batched executemany()
+    calls inside a single transaction with fsync and the journal turned
+    off. Requests attach images as immutable files, so an image is never
+    changed in place: the import writes a private file (a copy of the
+    existing image, if any) that replaces the image once it succeeds and is
+    deleted if it fails. Imports into an existing image are serialized by
+    image_write_lock. Column types are inferred from the
+    first IMPORT_SAMPLE_ROWS rows; later values are coerced by SQLite's
+    column affinity. JSONL keys first seen after the sample are reported
+    as dropped_keys.
+    """
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    new_image = image_id is None
+    image_id = image_id or uuid.uuid4().hex
+    path = image_path(image_id)
+    if not new_image and not os.path.exists(path):
+        raise ValueError(f'Base image "{image_id}" not found')
+
+    start = time.perf_counter()
+    dropped_keys = set()
+    columns, sample, rest = read_import_rows(stream, fmt, has_header, dropped_keys)
+    if not columns:
+        raise ValueError('The uploaded file is empty')
+    types = [infer_sqlite_type([row[i] for row in sample]) for i in range(len(columns))]
+
+    with image_write_lock if not new_image else contextlib.nullcontext():
+        work_path = f'{path}.tmp-{uuid.uuid4().hex}'
+        try:
+            if not new_image:
+                source = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+                target = sqlite3.connect(work_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                    source.close()
+            total = write_import_rows(work_path, table, columns, types, itertools.chain(sample, rest), batch_size)
+        except Exception:
+            if os.path.exists(work_path):
+                os.remove(work_path)
+            raise
+        os.replace(work_path, path)
+
+    seconds = time.perf_counter() - start
+    return {
+        'image_id': image_id,
+        'table': table,
+        'columns': [{'name': c, 'type': t} for c, t in zip(columns, types)],
+        'rows': total,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(total / seconds) if seconds else None,
+        'image_bytes': os.path.getsize(path),
+        'dropped_keys': sorted(dropped_keys)
+    }
+
+def write_import_rows(path, table, columns, types, rows, batch_size):
+    """Create `table` in the database file at `path` and insert `rows`, in batches; returns the row count."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA cache_size=-65536')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('BEGIN')
+        column_defs = ', '.join(f'{quote_ident(c)} {t}' for c, t in zip(columns, types))
+        conn.execute(f'CREATE TABLE {quote_ident(table)} ({column_defs})')
+        insert = f"INSERT INTO {quote_ident(table)} VALUES ({', '.join('?' * len(columns))})"
+
+        total = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            conn.executemany(insert, batch)
+            total += len(batch)
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return total
 
-        optimize_prompt = f"""
-You must respond ONLY with valid JSON.
-Original SQL:
-{query}
+def describe_image(image_id):
+    path = image_path(image_id)
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        tables = {}
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"):
+            tables[name] = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(name)}").fetchone()[0]
+    finally:
+        conn.close()
+    return {'image_id': image_id, 'bytes': os.path.getsize(path), 'tables': tables}
 
-Detected issues:
-{json.dumps(analysis, indent=2)}
+# ================== SLOW-QUERY LOGS / WORKLOAD ==================
 
-Generate ONE optimized version in this exact format:
-{{
-  "original": "{query[:100]}...",
-  "optimized_query": "SELECT ...",
-  "changes_made": ["change1", "change2", "change3"],
-  "performance_gain": "Expected improvement description"
-}}
+SLOWLOG_FORMATS = {'postgres', 'mysql'}
+SLOWLOG_DIALECTS = {'postgres': 'PostgreSQL', 'mysql': 'MySQL'}
+
+# PostgreSQL log_min_duration_statement lines (parse/bind durations would double count)
+PG_DURATION_RE = re.compile(r'duration: ([0-9.]+) ms\s+(?:statement|execute [^:]*):\s?(.*)$')
+MYSQL_QUERY_TIME_RE = re.compile(r'^# Query_time: ([0-9.]+)(?:.*?Rows_examined: (\d+))?')
+MYSQL_SERVER_HEADER_RE = re.compile(r'^(?:\S+, Version: |Tcp port: |Time\s+Id\s+Command)')
+
+def literal_shape_token(text):
+    """A string literal as ?, with the LIKE wildcards it starts or ends with kept ('%?', '?%', '%?%')."""
+    body = text[1:-1]
+    lead = '%' if body.startswith(('%', '_')) else ''
+    trail = '%' if body.endswith('%') else ''
+    return f"'{lead}?{trail}'" if lead or trail else '?'
+
+def query_fingerprint(sql, keep_shape=False):
+    """
+    Normalize a statement so that executions differing only in literals
+    group together: literals and parameters become ?, IN (...) / VALUES
+    lists collapse to one element, unquoted names are lower-cased and
+    comments / whitespace are dropped. With keep_shape, literals that
+    change how a query can run are kept: leading / trailing LIKE wildcards
+    of strings and LIMIT / OFFSET counts.
+    """
+    parts = []
+    for kind, text in sql_tokens(sql):
+        if kind == 'string' and keep_shape:
+            text = literal_shape_token(text)
+        elif kind == 'number' and keep_shape and parts and (
+                parts[-1] in ('limit', 'offset') or (len(parts) >= 3 and parts[-1] == ',' and parts[-3] == 'limit')):
+            pass
+        elif kind in ('string', 'number', 'param'):
+            text = '?'
+        elif kind == 'ident':
+            text = text.lower()
+        if text == '?' and len(parts) >= 2 and parts[-1] == '-' and parts[-2] in ('(', ',', '=', '<', '>', '<=', '>=', '<>', '!='):
+            parts.pop()  # negative literal
+        parts.append(text)
+        # ( ?, ?, ... ) -> ( ?+ )
+        if text == ')' and len(parts) >= 3 and parts[-2] in ('?', '?+') and parts[-3] in ('(', ','):
+            i = len(parts) - 2
+            while i >= 2 and parts[i - 1] == ',' and parts[i - 2] in ('?', '?+'):
+                i -= 2
+            if parts[i - 1] == '(':
+                parts[i - 1:] = ['(', '?+', ')']
+        # VALUES (...), (...) -> VALUES (...)
+        if parts[-7:] == ['(', '?+', ')', ',', '(', '?+', ')']:
+            del parts[-4:]
+    while parts and parts[-1] == ';':
+        parts.pop()
+    return ' '.join(parts)
+
+def fingerprint_id(fingerprint):
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+def open_log_text(stream, filename=''):
+    """Text view over a binary log stream; .gz files are decompressed on the fly."""
+    if filename.endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=stream)
+    return io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+
+def detect_slowlog_format(lines):
+    """Look at the first lines to tell PostgreSQL from MySQL. Returns (format, lines)."""
+    head = list(itertools.islice(lines, 200))
+    fmt = None
+    for line in head:
+        if line.startswith('# Query_time:') or MYSQL_SERVER_HEADER_RE.match(line):
+            fmt = 'mysql'
+            break
+        if 'duration: ' in line:
+            fmt = 'postgres'
+            break
+    return fmt, itertools.chain(head, lines)
+
+def parse_postgres_log(lines):
+    """
+    Yield (statement, duration_ms, rows_examined) from a PostgreSQL stderr
+    log with log_min_duration_statement. Continuation lines of multi-line
+    statements start with a tab. Rows examined is not logged (None).
+    """
+    current = None
+    for line in lines:
+        if line.startswith('\t'):
+            if current is not None and len(current[0]) < SLOWLOG_MAX_STATEMENT_CHARS:
+                current[0].append(line[1:].rstrip('\n'))
+            continue
+        if current is not None:
+            yield '\n'.join(current[0])[:SLOWLOG_MAX_STATEMENT_CHARS], current[1], None
+            current = None
+        match = PG_DURATION_RE.search(line)
+        if match:
+            current = ([match.group(2).rstrip('\n')], float(match.group(1)))
+    if current is not None:
+        yield '\n'.join(current[0])[:SLOWLOG_MAX_STATEMENT_CHARS], current[1], None
+
+def parse_mysql_slow_log(lines):
+    """
+    Yield (statement, duration_ms, rows_examined) from a MySQL slow query
+    log. Each entry is a block of "# ..." headers (Query_time carries the
+    duration and Rows_examined) followed by the statement text; the
+    "use db;" and "SET timestamp=...;" bookkeeping lines are skipped.
+    """
+    duration = rows_examined = None
+    statement = []
+    size = 0
+
+    def flush():
+        text = ''.join(statement).strip()
+        if duration is not None and text:
+            return text[:SLOWLOG_MAX_STATEMENT_CHARS], duration, rows_examined
+        return None
+
+    for line in lines:
+        if line.startswith('#') or MYSQL_SERVER_HEADER_RE.match(line):
+            if statement:
+                entry = flush()
+                if entry:
+                    yield entry
+                statement, size = [], 0
+                duration = rows_examined = None
+            match = MYSQL_QUERY_TIME_RE.match(line)
+            if match:
+                duration = float(match.group(1)) * 1000
+                rows_examined = int(match.group(2)) if match.group(2) else None
+            continue
+        if not statement:
+            lowered = line.strip().lower()
+            if lowered.startswith('set timestamp=') or (lowered.startswith('use ') and lowered.endswith(';')):
+                continue
+        if size < SLOWLOG_MAX_STATEMENT_CHARS:
+            statement.append(line)
+            size += len(line)
+    entry = flush()
+    if entry:
+        yield entry
+
+SLOWLOG_PARSERS = {'postgres': parse_postgres_log, 'mysql': parse_mysql_slow_log}
+
+class WorkloadAggregate:
+    """
+    Per-fingerprint totals over a stream of (statement, duration_ms, rows_examined).
+    Memory is bounded by max_fingerprints: when it is exceeded, the 10% of
+    fingerprints with the least total time are dropped (and counted under
+    "evicted"), so the heavy hitters survive arbitrarily long logs.
+    """
+
+    def __init__(self, max_fingerprints=SLOWLOG_MAX_FINGERPRINTS):
+        self.max_fingerprints = max_fingerprints
+        self.entries = {}
+        self.statements = 0
+        self.total_ms = 0.0
+        self.evicted = {'fingerprints': 0, 'statements': 0, 'total_ms': 0.0}
+
+    def add(self, statement, duration_ms, rows_examined=None):
+        fingerprint = query_fingerprint(statement)
+        if not fingerprint:
+            return
+        key = fingerprint_id(fingerprint)
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= self.max_fingerprints:
+                self.evict()
+            entry = self.entries[key] = {
+                'id': key,
+                'fingerprint': fingerprint[:SLOWLOG_EXAMPLE_CHARS],
+                'example': statement[:SLOWLOG_EXAMPLE_CHARS],
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'rows_examined': None
+            }
+        entry['count'] += 1
+        entry['total_ms'] += duration_ms
+        if duration_ms > entry['max_ms']:
+            entry['max_ms'] = duration_ms
+            entry['example'] = statement[:SLOWLOG_EXAMPLE_CHARS]
+        if rows_examined is not None:
+            entry['rows_examined'] = (entry['rows_examined'] or 0) + rows_examined
+        self.statements += 1
+        self.total_ms += duration_ms
+
+    def evict(self):
+        keep = max(1, self.max_fingerprints * 9 // 10)
+        ranked = sorted(self.entries.values(), key=lambda e: e['total_ms'], reverse=True)
+        for entry in ranked[keep:]:
+            self.evicted['fingerprints'] += 1
+            self.evicted['statements'] += entry['count']
+            self.evicted['total_ms'] += entry['total_ms']
+        self.entries = {entry['id']: entry for entry in ranked[:keep]}
+
+    def top(self, n):
+        """The n fingerprints with the largest total time, with averages and share of the total."""
+        ranked = sorted(self.entries.values(), key=lambda e: e['total_ms'], reverse=True)[:n]
+        report = []
+        for entry in ranked:
+            rows = entry['rows_examined']
+            report.append({
+                **entry,
+                'total_ms': round(entry['total_ms'], 3),
+                'max_ms': round(entry['max_ms'], 3),
+                'avg_ms': round(entry['total_ms'] / entry['count'], 3),
+                'avg_rows_examined': round(rows / entry['count'], 1) if rows is not None else None,
+                'share': round(entry['total_ms'] / self.total_ms, 4) if self.total_ms else 0
+            })
+        return report
+
+    def summary(self):
+        return {
+            'statements': self.statements,
+            'fingerprints': len(self.entries),
+            'total_ms': round(self.total_ms, 3),
+            'evicted': {**self.evicted, 'total_ms': round(self.evicted['total_ms'], 3)}
+        }
+
+def aggregate_slowlog(lines, fmt='auto', max_fingerprints=SLOWLOG_MAX_FINGERPRINTS):
+    """Parse and aggregate a log line by line. Returns (format, WorkloadAggregate); raises ValueError."""
+    if fmt == 'auto':
+        fmt, lines = detect_slowlog_format(iter(lines))
+        if fmt is None:
+            raise ValueError('Could not detect the log format (use format=postgres or format=mysql)')
+    if fmt not in SLOWLOG_PARSERS:
+        raise ValueError(f'Unsupported log format "{fmt}" (use postgres, mysql or auto)')
+    workload = WorkloadAggregate(max_fingerprints)
+    for statement, duration_ms, rows_examined in SLOWLOG_PARSERS[fmt](lines):
+        workload.add(statement, duration_ms, rows_examined)
+    metrics_incr('slowlog_statements', workload.statements)
+    return fmt, workload
+
+def analyze_workload(top, dialect, limit):
+    """Send the `limit` heaviest fingerprints' example statements through analyze + optimize (one LLM call each)."""
+    for entry in top[:limit]:
+        try:
+            entry['analysis'], entry['optimized'] = analyze_and_optimize(entry['example'], dialect)
+        except Exception as e:
+            entry['analysis_error'] = str(e)
+    return top
+
+# ================== SIMILARITY CACHE ==================
+
+MINHASH_PRIME = (1 << 61) - 1
+SHINGLE_SIZE = 3
+
+def resolve_aliases(words):
+    """
+    Fingerprint words with table aliases replaced by the table name and
+    the alias declarations dropped, so "orders o ... o.id" and
+    "orders AS ord ... ord.id" read the same.
+    """
+    aliases = {}
+    skip = set()
+    for i, word in enumerate(words[:-1]):
+        if word not in ('from', 'join'):
+            continue
+        j = i + 2
+        if j < len(words) and words[j] == 'as':
+            j += 1
+        if j < len(words) and re.match(r'^[a-z_][a-z0-9_$]*$|^"', words[j]) and words[j].upper() not in NOT_ALIAS_WORDS:
+            aliases[words[j]] = words[i + 1]
+            skip.update(range(i + 2, j + 1))
+    return [
+        aliases.get(word, word) if i + 1 < len(words) and words[i + 1] == '.' else word
+        for i, word in enumerate(words) if i not in skip
+    ]
+
+SELECT_LIST_END_WORDS = {'from', 'where', 'group', 'having', 'window', 'order', 'limit', 'offset',
+                         'union', 'intersect', 'except', ')', ';'}
+
+def sort_select_lists(words):
+    """Fingerprint words with the items of every SELECT list in sorted order, so column order does not count."""
+    words = list(words)
+    # Innermost (rightmost) lists first; sorting one keeps the positions of the enclosing ones
+    for start in reversed([i for i, word in enumerate(words) if word == 'select']):
+        i = start + 1
+        if i < len(words) and words[i] in ('distinct', 'all'):
+            i += 1
+        items, item, depth, end = [], [], 0, i
+        for end in range(i, len(words) + 1):
+            word = words[end] if end < len(words) else ';'
+            if depth == 0 and (word in SELECT_LIST_END_WORDS or word == ','):
+                items.append(item)
+                item = []
+                if word != ',':
+                    break
+                continue
+            depth += {'(': 1, ')': -1}.get(word, 0)
+            item.append(word)
+        if len(items) > 1:
+            ordered = []
+            for item in sorted(items, key=' '.join):
+                ordered.extend(([','] if ordered else []) + item)
+            words[i:end] = ordered
+    return words
+
+def similarity_words(sql):
+    """Words the similarity cache compares: shape-keeping fingerprint, aliases resolved, SELECT lists sorted."""
+    return sort_select_lists(resolve_aliases(query_fingerprint(sql, keep_shape=True).split(' ')))
+
+def literal_shape(sql):
+    """The literals of a query that change its plan (wildcards, LIMIT / OFFSET, NULL), in order."""
+    words = similarity_words(sql)
+    return [word for i, word in enumerate(words)
+            if word.startswith("'") or word == 'null' or (i and words[i - 1] in ('limit', 'offset'))
+            or (i >= 3 and words[i - 1] == ',' and words[i - 3] == 'limit')]
+
+def query_shingles(sql):
+    """Token 3-grams of similarity_words plus every name it mentions."""
+    words = similarity_words(sql)
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    shingles.update('#' + word for word in words if re.match(r'^[a-z_"]', word))
+    return shingles
+
+class SimilarityIndex:
+    """
+    MinHash signatures with LSH banding over query shingles. Lookups only
+    compare against entries sharing at least one band (in the same scope,
+    e.g. dialect + schema) and rank them by exact Jaccard similarity.
+    Holds at most max_entries, dropping the least recently used.
+    """
+
+    def __init__(self, max_entries, num_perm=64, bands=16, seed=1):
+        rng = random.Random(seed)
+        self.perms = [(rng.randrange(1, MINHASH_PRIME), rng.randrange(MINHASH_PRIME)) for _ in range(num_perm)]
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.buckets = defaultdict(set)
+        self.ids = itertools.count()
+
+    def signature(self, shingles):
+        hashed = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingles]
+        return [min((a * h + b) % MINHASH_PRIME for h in hashed) for a, b in self.perms]
+
+    def band_keys(self, scope, signature):
+        return [(scope, band, tuple(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def add(self, scope, query, value):
+        shingles = query_shingles(query)
+        if not shingles:
+            return
+        keys = self.band_keys(scope, self.signature(shingles))
+        with self.lock:
+            entry_id = next(self.ids)
+            self.entries[entry_id] = {'query': query, 'shingles': shingles, 'keys': keys, 'value': value}
+            for key in keys:
+                self.buckets[key].add(entry_id)
+            while len(self.entries) > self.max_entries:
+                old_id, old = self.entries.popitem(last=False)
+                for key in old['keys']:
+                    self.buckets[key].discard(old_id)
+                    if not self.buckets[key]:
+                        del self.buckets[key]
+
+    def lookup(self, scope, query):
+        """(similarity, cached query, value) of the closest entry, or None."""
+        shingles = query_shingles(query)
+        if not shingles:
+            return None
+        keys = self.band_keys(scope, self.signature(shingles))
+        with self.lock:
+            candidates = set().union(*(self.buckets.get(key, ()) for key in keys))
+            best = None
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                similarity = len(shingles & entry['shingles']) / len(shingles | entry['shingles'])
+                if best is None or similarity > best[0]:
+                    best = (similarity, entry_id)
+            if best is None:
+                return None
+            self.entries.move_to_end(best[1])
+            entry = self.entries[best[1]]
+            return round(best[0], 3), entry['query'], entry['value']
+
+    def snapshot(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'buckets': len(self.buckets)}
+
+analysis_index = SimilarityIndex(SIMILARITY_CACHE_SIZE)
+
+def analysis_scope(dialect, schema_ddl):
+    """Cached analyses are only reused for the same dialect and schema."""
+    return (dialect, hashlib.sha1((schema_ddl or '').encode('utf-8')).hexdigest())
+
+def similar_analysis_hint(cached_query, analysis):
+    return f"""
+A very similar query was analyzed before:
+{cached_query}
+Its analysis: {compact_json(analysis)}
+Reuse whatever still applies and only change what differs for the query above. Keep the answer brief.
 """
 
-        optimize_response = call_groq(OPTIMIZE_SYSTEM_PROMPT, optimize_prompt, "json")
-        optimized = json.loads(optimize_response)
+# ================== CHANGE CAPTURE ==================
+
+# Statements that may invalidate the capture triggers
+SCHEMA_CHANGING_STATEMENTS = {'ALTER', 'DROP'}
+
+class ChangeCapture:
+    """
+    Records which rows each step inserted, updated or deleted, using TEMP
+    triggers that log (table, op, rowid, old values) into a temp table.
+    Cost and payload scale with the number of changed rows, not table size.
+    WITHOUT ROWID tables are not tracked; schema changes are reported by
+    comparing sqlite_master before and after the step.
+    """
+
+    LOG = 'temp._step_changes'
+    # Trigger bodies may not use schema-qualified names
+    LOG_NAME = '_step_changes'
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.columns = {}
+        self.schema_before = {}
+
+    def schema(self):
+        return dict(self.conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        ).fetchall())
+
+    def remove_triggers(self):
+        names = self.conn.execute(
+            "SELECT name FROM sqlite_temp_master WHERE type='trigger' AND name LIKE '\\_capture\\_%' ESCAPE '\\'"
+        ).fetchall()
+        for (name,) in names:
+            self.conn.execute(f"DROP TRIGGER temp.{quote_ident(name)}")
+        self.columns = {}
+
+    def install(self):
+        """Create the log table and triggers for tables that lack them (or whose columns changed)."""
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self.LOG} (tbl TEXT, op TEXT, rid INTEGER, old TEXT)")
+        existing = {name for (name,) in self.conn.execute(
+            "SELECT name FROM sqlite_temp_master WHERE type='trigger'"
+        )}
+        for table, sql in self.schema().items():
+            if 'WITHOUT ROWID' in (sql or '').upper():
+                continue
+            cols = [c[1] for c in self.conn.execute(f"PRAGMA table_info({quote_ident(table)})")]
+            names = [f'_capture_{op}_{table}' for op in ('ins', 'upd', 'del')]
+            if self.columns.get(table) == cols and all(n in existing for n in names):
+                continue
+            for name in names:
+                if name in existing:
+                    self.conn.execute(f"DROP TRIGGER temp.{quote_ident(name)}")
+            self._create_triggers(table, cols, names)
+            self.columns[table] = cols
+
+    def _create_triggers(self, table, cols, names):
+        target = f"main.{quote_ident(table)}"
+        literal = "'" + table.replace("'", "''") + "'"
+        # BLOBs cannot go into JSON, so they are logged as hex text
+        old_values = 'json_array(' + ', '.join(
+            f"CASE WHEN typeof(OLD.{quote_ident(c)}) = 'blob' THEN lower(hex(OLD.{quote_ident(c)})) ELSE OLD.{quote_ident(c)} END"
+            for c in cols
+        ) + ')'
+        ins, upd, dele = (quote_ident(n) for n in names)
+        self.conn.execute(f"""
+            CREATE TEMP TRIGGER {ins} AFTER INSERT ON {target} BEGIN
+                INSERT INTO {self.LOG_NAME} VALUES ({literal}, 'I', NEW.rowid, NULL);
+            END""")
+        self.conn.execute(f"""
+            CREATE TEMP TRIGGER {upd} AFTER UPDATE ON {target} BEGIN
+                INSERT INTO {self.LOG_NAME} SELECT {literal}, 'U', NEW.rowid, {old_values} WHERE NEW.rowid = OLD.rowid;
+                INSERT INTO {self.LOG_NAME} SELECT {literal}, 'D', OLD.rowid, {old_values} WHERE NEW.rowid <> OLD.rowid;
+                INSERT INTO {self.LOG_NAME} SELECT {literal}, 'I', NEW.rowid, NULL WHERE NEW.rowid <> OLD.rowid;
+            END""")
+        self.conn.execute(f"""
+            CREATE TEMP TRIGGER {dele} AFTER DELETE ON {target} BEGIN
+                INSERT INTO {self.LOG_NAME} VALUES ({literal}, 'D', OLD.rowid, {old_values});
+            END""")
+
+    def begin_step(self, query):
+        """Call before running a statement."""
+        if SCHEMA_CHANGING_STATEMENTS.intersection(statement_keywords(query)):
+            self.remove_triggers()
+        else:
+            self.install()
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self.LOG} (tbl TEXT, op TEXT, rid INTEGER, old TEXT)")
+        self.conn.execute(f"DELETE FROM {self.LOG}")
+        self.schema_before = self.schema()
+
+    def collect(self):
+        """
+        Return (changes, schema_changes) for the statement run since begin_step.
+        changes: {table: {"columns", "inserted", "updated", "updated_before", "deleted"}},
+                 listing only the non-empty kinds
+        schema_changes: {"created_or_altered": {table: snapshot}, "dropped": [names]} or None
+        """
+        net = defaultdict(dict)  # table -> rowid -> (kind, old values)
+        for table, op, rid, old in self.conn.execute(f"SELECT tbl, op, rid, old FROM {self.LOG} ORDER BY rowid"):
+            rows = net[table]
+            prev = rows.get(rid)
+            if op == 'I':
+                # delete + insert of the same rowid within one step is an update
+                rows[rid] = ('update', prev[1]) if prev and prev[0] == 'delete' else ('insert', None)
+            elif op == 'U':
+                if prev is None:
+                    rows[rid] = ('update', old)
+            elif prev and prev[0] == 'insert':
+                del rows[rid]
+            else:
+                rows[rid] = ('delete', prev[1] if prev else old)
+
+        changes = {}
+        for table, rows in net.items():
+            if not rows:
+                continue
+            cols = self.columns.get(table) or [c[1] for c in self.conn.execute(f"PRAGMA table_info({quote_ident(table)})")]
+            current = self._fetch_rows(table, [rid for rid, (kind, _) in rows.items() if kind != 'delete'])
+            inserted, updated, before, deleted = [], [], [], []
+            for rid, (kind, old) in rows.items():
+                if kind == 'insert' and rid in current:
+                    inserted.append(current[rid])
+                elif kind == 'update' and rid in current:
+                    updated.append(current[rid])
+                    before.append(json.loads(old))
+                elif kind == 'delete':
+                    deleted.append(json.loads(old))
+            delta = {'columns': cols}
+            for key, delta_rows in (('inserted', inserted), ('updated', updated),
+                                    ('updated_before', before), ('deleted', deleted)):
+                if delta_rows:
+                    delta[key] = encode_rows(cols, delta_rows)
+            changes[table] = delta
+
+        schema_after = self.schema()
+        altered = [t for t, sql in schema_after.items() if self.schema_before.get(t) != sql]
+        dropped = [t for t in self.schema_before if t not in schema_after]
+        schema_changes = None
+        if altered or dropped:
+            snapshot = snapshot_tables(self.conn.cursor())
+            schema_changes = {
+                'created_or_altered': {t: snapshot[t] for t in altered if t in snapshot},
+                'dropped': dropped
+            }
+        return changes, schema_changes
+
+    def _fetch_rows(self, table, rowids):
+        found = {}
+        for i in range(0, len(rowids), 500):
+            chunk = rowids[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in self.conn.execute(
+                f"SELECT rowid, * FROM {quote_ident(table)} WHERE rowid IN ({placeholders})", chunk
+            ):
+                found[row[0]] = list(row[1:])
+        return found
+
+# ================== QUERY MEASUREMENT ==================
+
+def query_plan(conn, sql):
+    """EXPLAIN QUERY PLAN as a list of indented detail lines."""
+    rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+class QueryTimeout(Exception):
+    pass
+
+def run_with_timeout(conn, sql, timeout=QUERY_TIMEOUT_SECONDS):
+    """
+    Execute and fetch all rows, aborting (QueryTimeout) when it runs past
+    `timeout` seconds. Runs with PRAGMA query_only, so a statement that
+    passed is_read_query but writes (WITH ... DELETE) fails instead of
+    changing the data later measurements run on.
+    """
+    deadline = time.perf_counter() + timeout
+    query_only = conn.execute('PRAGMA query_only').fetchone()[0]
+    conn.execute('PRAGMA query_only=1')
+    conn.set_progress_handler(lambda: 1 if time.perf_counter() > deadline else 0, 10000)
+    try:
+        return conn.execute(sql).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'interrupted' in str(e):
+            raise QueryTimeout(f'Query exceeded {timeout:g}s')
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+        conn.execute(f'PRAGMA query_only={query_only}')
+
+def query_timeout(deadline, timeout=QUERY_TIMEOUT_SECONDS):
+    """
+    Timeout for the next query of a request with a deadline (a perf_counter
+    value, None for none): `timeout`, or less when the deadline is closer.
+    Raises QueryTimeout once the deadline has passed.
+    """
+    if deadline is None:
+        return timeout
+    left = deadline - time.perf_counter()
+    if left <= 0:
+        raise QueryTimeout('Request time budget used up')
+    return min(timeout, left)
+
+def time_query(conn, sql, runs=3, timeout=QUERY_TIMEOUT_SECONDS, deadline=None):
+    """Median wall time in milliseconds over `runs` executions (fetching every row), each within query_timeout."""
+    timings = []
+    for _ in range(runs):
+        run_timeout = query_timeout(deadline, timeout)
+        start = time.perf_counter()
+        run_with_timeout(conn, sql, run_timeout)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return round(timings[len(timings) // 2], 3)
+
+def normalized_rows(rows, ordered=False):
+    """Rows as a list of tuples with floats rounded, sorted (for order-insensitive comparison) unless `ordered`."""
+    def norm(value):
+        return round(value, 9) if isinstance(value, float) else value
+    rows = [tuple(norm(v) for v in row) for row in rows]
+    return rows if ordered else sorted(rows, key=repr)
+
+def top_level_order_by(sql):
+    """True when the statement's result is ordered: an ORDER BY outside every parenthesis."""
+    tokens = sql_tokens(sql)
+    depth = 0
+    for i, (kind, text) in enumerate(tokens):
+        if kind == 'op' and text == '(':
+            depth += 1
+        elif kind == 'op' and text == ')':
+            depth -= 1
+        elif (depth == 0 and kind == 'ident' and text.upper() == 'ORDER'
+              and i + 1 < len(tokens) and tokens[i + 1][1].upper() == 'BY'):
+            return True
+    return False
+
+def results_equivalent(conn, original_sql, candidate_sql, expected=None, timeout=QUERY_TIMEOUT_SECONDS):
+    """
+    True when both queries return the same rows on this data: the same
+    multiset, or the same sequence when the original has a top-level ORDER
+    BY (so rows tied on the sort key must come back in the same order too).
+    Pass `expected` (normalized_rows of the original, ordered per
+    top_level_order_by) to avoid re-running it.
+    """
+    ordered = top_level_order_by(original_sql)
+    if expected is None:
+        expected = normalized_rows(run_with_timeout(conn, original_sql, timeout), ordered)
+    return normalized_rows(run_with_timeout(conn, candidate_sql, timeout), ordered) == expected
+
+def is_id_column(name, declared_type, pk, foreign_keys):
+    if name in foreign_keys:
+        return True
+    if pk and 'INT' in (declared_type or '').upper():
+        return True
+    return name.lower() == 'id' or name.lower().endswith('_id') or name.endswith('Id')
+
+def scale_database(conn, factor, max_rows=TOURNAMENT_MAX_ROWS, tables=None):
+    """
+    Grow every table (or only `tables`) to about `factor` times its rows
+    by appending shifted copies. Copy k adds k * stride to every key-like
+    integer column (primary keys, *_id / *Id columns, foreign keys), so
+    each copy is an isomorphic, disjoint replica and joins stay aligned.
+    Text columns under a UNIQUE index get a "#k" suffix. The factor is
+    reduced to stay under max_rows. Tables whose copies still violate a
+    constraint keep their original size. Tables of an attached base image
+    are copied into main first.
+    Returns {"factor": used factor, "rows": {table: row count}}.
+    """
+    copy_image_tables(conn, tables)
+    wanted = None if tables is None else {name.lower() for name in tables}
+    tables = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+    ) if wanted is None or name.lower() in wanted]
+    counts = {t: conn.execute(f"SELECT COUNT(*) FROM {quote_ident(t)}").fetchone()[0] for t in tables}
+    total = sum(counts.values())
+    if total and factor * total > max_rows:
+        factor = max(1, max_rows // total)
+
+    layouts = {}
+    stride = 1
+    for table in tables:
+        foreign_keys = {fk[3] for fk in conn.execute(f"PRAGMA foreign_key_list({quote_ident(table)})")}
+        unique_cols = set()
+        for index in conn.execute(f"PRAGMA index_list({quote_ident(table)})"):
+            if index[2]:
+                unique_cols.update(c[2] for c in conn.execute(f"PRAGMA index_info({quote_ident(index[1])})"))
+        layout = []
+        for _, name, declared_type, _, _, pk in conn.execute(f"PRAGMA table_info({quote_ident(table)})"):
+            if is_id_column(name, declared_type, pk, foreign_keys):
+                layout.append((name, 'id'))
+                max_value = conn.execute(
+                    f"SELECT MAX({quote_ident(name)}) FROM {quote_ident(table)} WHERE typeof({quote_ident(name)}) = 'integer'"
+                ).fetchone()[0]
+                stride = max(stride, (max_value or 0) + 1)
+            elif name in unique_cols:
+                layout.append((name, 'unique'))
+            else:
+                layout.append((name, 'plain'))
+        layouts[table] = layout
+
+    for table, layout in layouts.items():
+        if not counts[table] or factor <= 1:
+            continue
+        max_rowid = conn.execute(f"SELECT MAX(rowid) FROM {quote_ident(table)}").fetchone()[0]
+        columns = ', '.join(quote_ident(name) for name, _ in layout)
+        for k in range(1, factor):
+            exprs = []
+            for name, kind in layout:
+                col = quote_ident(name)
+                if kind == 'id':
+                    exprs.append(f"CASE WHEN typeof({col}) = 'integer' THEN {col} + {k * stride} ELSE {col} END")
+                elif kind == 'unique':
+                    exprs.append(f"CASE WHEN {col} IS NULL THEN NULL ELSE {col} || '#{k}' END")
+                else:
+                    exprs.append(col)
+            try:
+                conn.execute(
+                    f"INSERT INTO {quote_ident(table)} ({columns}) "
+                    f"SELECT {', '.join(exprs)} FROM {quote_ident(table)} WHERE rowid <= {max_rowid}"
+                )
+            except sqlite3.IntegrityError:
+                break
+        counts[table] = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table)}").fetchone()[0]
+    conn.commit()
+    return {'factor': factor, 'rows': counts}
+
+DATE_VALUE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}(:\d{2})?)?$')
+
+def referenced_table(column, tables, own_table):
+    """
+    The table a key-like column (customer_id, managerId, ...) points to,
+    matched by name; own_table for unmatched ones (self references such as
+    managerId), None for columns that are not keys.
+    """
+    lower = column.lower()
+    if lower == 'id' or not lower.endswith('id'):
+        return None
+    stem = re.sub(r'_?id$', '', lower)
+    if not stem:
+        return None
+    for table in tables:
+        name = table.lower()
+        if name in (stem, stem + 's', stem + 'es') or name.rstrip('s') == stem:
+            return table
+    return own_table
+
+def synthetic_value(rng, seed_values, column, index, rows):
+    """One value shaped like a column's seed data: dates in its range, numbers in its span, categories from it."""
+    if not seed_values:
+        return None
+    sample = seed_values[0]
+    if isinstance(sample, str) and DATE_VALUE_RE.match(sample):
+        first = time.mktime(time.strptime(min(seed_values)[:10], '%Y-%m-%d'))
+        last = time.mktime(time.strptime(max(seed_values)[:10], '%Y-%m-%d'))
+        day = time.localtime(first + rng.randint(-30, int((last - first) / 86400) + 30) * 86400)
+        if len(sample) > 10:
+            return time.strftime('%Y-%m-%d', day) + f' {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00'
+        return time.strftime('%Y-%m-%d', day)
+    if isinstance(sample, (int, float)) and not isinstance(sample, bool):
+        low, high = min(seed_values), max(seed_values)
+        if high <= low:
+            high = low * 2 + 1
+        if all(isinstance(v, int) for v in seed_values):
+            return rng.randint(int(low), int(high))
+        return round(rng.uniform(low, high), 2)
+    if any('@' in str(v) for v in seed_values):
+        # Reuse addresses so duplicate-detection queries have work to do
+        return f'user{rng.randint(1, max(1, rows * 4 // 5))}@example.com'
+    distinct = sorted(set(map(str, seed_values)))
+    if len(distinct) <= 6 and 'name' not in column.lower():
+        return rng.choice(distinct)
+    return f'{rng.choice(distinct)}_{index}'
+
+def populate_synthetic(conn, rows, seed=0):
+    """
+    Deterministically add rows to every table, shaped like its seed data:
+    sequential ids, key-like columns spread over the referenced table's
+    ids (tables referenced by others get a tenth of the rows), and dates,
+    numbers and categories drawn from the ranges of the existing values
+    (NULLs at the seed's rate). Returns {table: row count}.
+    """
+    rng = random.Random(seed)
+    tables = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+    layouts = {t: [(c[1], c[5]) for c in conn.execute(f"PRAGMA table_info({quote_ident(t)})")] for t in tables}
+    parents = {
+        referenced_table(column, tables, table)
+        for table, layout in layouts.items() for column, _ in layout
+    } - {None}
+    parents -= {t for t in parents if any(referenced_table(c, tables, t) == t for c, _ in layouts[t])}
+    targets = {t: max(1, rows // 10) if t in parents else rows for t in tables}
+
+    counts = {}
+    for table in tables:
+        layout = layouts[table]
+        names = [quote_ident(column) for column, _ in layout]
+        seed_rows = conn.execute(f"SELECT {', '.join(names)} FROM {quote_ident(table)}").fetchall()
+        next_id = (conn.execute(f"SELECT MAX(rowid) FROM {quote_ident(table)}").fetchone()[0] or 0) + 1
+        columns = []
+        for position, (column, pk) in enumerate(layout):
+            values = [row[position] for row in seed_rows]
+            present = [v for v in values if v is not None]
+            columns.append((column, pk, present, (len(values) - len(present)) / len(values) if values else 0))
+
+        new_rows = []
+        for index in range(next_id, next_id + max(0, targets[table] - len(seed_rows))):
+            row = []
+            for column, pk, present, null_rate in columns:
+                target = referenced_table(column, tables, table)
+                if pk or column.lower() == 'id':
+                    row.append(index)
+                elif null_rate and rng.random() < null_rate:
+                    row.append(None)
+                elif target is not None:
+                    row.append(rng.randint(1, targets[target]))
+                else:
+                    row.append(synthetic_value(rng, present, column, index, targets[table]))
+            new_rows.append(row)
+        conn.executemany(
+            f"INSERT INTO {quote_ident(table)} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            new_rows
+        )
+        counts[table] = len(seed_rows) + len(new_rows)
+    conn.commit()
+    return counts
+
+# ---------- Execution statistics ----------
+
+# VM instructions between progress-handler calls when counting steps
+STATS_PROGRESS_INTERVAL = 100
+
+PLAN_ACCESS_RE = re.compile(r'^(SCAN|SEARCH) (\S+)(?: AS \S+)?(?: USING (?:(?:COVERING )?INDEX (\S+)|(INTEGER PRIMARY KEY)|(AUTOMATIC)))?')
+
+def plan_work(conn, sql):
+    """Full scans, index searches, temp B-trees (sorts / DISTINCT / GROUP BY) and automatic indexes in the plan."""
+    try:
+        lines = [line.strip() for line in query_plan(conn, sql)]
+    except sqlite3.Error:
+        return None, None
+    tables = {name.lower(): name for (name,) in conn.execute(
+        f"SELECT name FROM {schema_objects(conn)} WHERE type = 'table'")}
+    summary = {
+        'full_scans': 0,
+        'searches': 0,
+        'temp_btrees': sum('USE TEMP B-TREE' in line for line in lines),
+        'automatic_indexes': sum('AUTOMATIC' in line for line in lines)
+    }
+    access = {}
+    for line in lines:
+        match = PLAN_ACCESS_RE.match(line)
+        if not match or match.group(2).lower() not in tables:
+            continue
+        table = tables[match.group(2).lower()]
+        entry = {'access': match.group(1).lower(), 'index': match.group(3) or match.group(4) or match.group(5)}
+        if match.group(1) == 'SCAN':
+            summary['full_scans'] += 1
+            # A full scan reads every row once per loop; the table size is the per-loop count
+            entry['rows_in_table'] = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table)}").fetchone()[0]
+        else:
+            summary['searches'] += 1
+        access.setdefault(table, []).append(entry)
+    return summary, access
+
+class ExecutionStats:
+    """
+    Work done by one statement, collected around its execute + fetch:
+
+        with ExecutionStats(conn, sql) as stats:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+        stats.report
+
+    The VM step count is approximate: a progress handler counts every
+    STATS_PROGRESS_INTERVAL instructions. Plan-level work (scans, temp
+    B-trees, automatic indexes, per-table access) comes from EXPLAIN QUERY
+    PLAN before the statement runs. The stdlib sqlite3 module exposes no
+    per-statement or page-cache counters, so full-scan steps, sorts, cache
+    hits / misses and peak memory are not reported at all.
+    """
+
+    def __init__(self, conn, sql):
+        self.conn = conn
+        self.sql = sql
+        self.progress_calls = 0
+        self.report = None
+
+    def _count_progress(self):
+        self.progress_calls += 1
+        return 0
+
+    def __enter__(self):
+        self.plan, self.tables = plan_work(self.conn, self.sql)
+        self.conn.set_progress_handler(self._count_progress, STATS_PROGRESS_INTERVAL)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ms = round((time.perf_counter() - self.started) * 1000, 3)
+        self.conn.set_progress_handler(None, 0)
+        self.report = {
+            'elapsed_ms': elapsed_ms,
+            'vm_steps': self.progress_calls * STATS_PROGRESS_INTERVAL,
+            'source': 'progress_handler',
+            'plan': self.plan,
+            'tables': self.tables
+        }
+        return False
+
+# ================== EXECUTION ENGINES ==================
+
+class ExecutionEngine(ABC):
+    """
+    Base class: where user queries run. Databases are always built with
+    SQLite (setup SQL, base images and the practice questions are SQLite),
+    then handed to the engine with adopt().
+    """
+
+    name = 'base'
+    errors = ()
+
+    @abstractmethod
+    def adopt(self, source):
+        """An engine connection with the data of the SQLite connection `source` (which the engine now owns)."""
+
+    def open(self, setup_sql='', base_image=None, copy=False):
+        return self.adopt(open_database(setup_sql, base_image, copy=copy))
+
+    def open_question(self, question_id):
+        return self.adopt(open_question_db(question_id))
+
+    @abstractmethod
+    def execute(self, conn, sql):
+        """Run one statement: (columns, rows, None) when it returns rows, else (None, None, affected rows)."""
+
+    @abstractmethod
+    def run(self, conn, sql, timeout=QUERY_TIMEOUT_SECONDS):
+        """All rows of a query, raising QueryTimeout past `timeout` seconds."""
+
+    @abstractmethod
+    def snapshot(self, conn):
+        """{table_name: encoded rows} for every table, like snapshot_tables."""
+
+    @abstractmethod
+    def stats(self, conn, sql):
+        """Context manager collecting execution statistics for one statement (its .report)."""
+
+class SQLiteEngine(ExecutionEngine):
+    """Row-oriented in-memory sqlite3 databases; the default."""
+
+    name = 'sqlite'
+    errors = (sqlite3.Error,)
+
+    def adopt(self, source):
+        return source
+
+    def execute(self, conn, sql):
+        cursor = conn.execute(sql)
+        if cursor.description is not None:
+            return [d[0] for d in cursor.description], cursor.fetchall(), None
+        return None, None, cursor.rowcount
+
+    def run(self, conn, sql, timeout=QUERY_TIMEOUT_SECONDS):
+        return run_with_timeout(conn, sql, timeout)
+
+    def snapshot(self, conn):
+        return snapshot_tables(conn.cursor())
+
+    def stats(self, conn, sql):
+        return ExecutionStats(conn, sql)
+
+def duckdb_column_type(declared, kinds, dated):
+    """DuckDB type for a SQLite column from the Python types of its values (declared type when empty)."""
+    declared = (declared or '').upper()
+    if not kinds:
+        kinds = {int} if 'INT' in declared else {float} if any(t in declared for t in ('REAL', 'FLOA', 'DOUB')) else {str}
+    if kinds == {int}:
+        return 'BIGINT'
+    if kinds <= {int, float}:
+        return 'DOUBLE'
+    if kinds == {str} and dated and ('DATE' in declared or 'TIME' in declared):
+        return 'TIMESTAMP' if 'timestamp' in dated else 'DATE'
+    return 'VARCHAR'
+
+def copy_to_duckdb(source, target):
+    """
+    Copy every table (then every view that DuckDB can parse) from a SQLite
+    connection into a DuckDB one. Rows are streamed to a temporary CSV file
+    and bulk-loaded with COPY, which is orders of magnitude faster than
+    parameterized inserts; column types come from the values actually
+    stored, since SQLite's declared types are only affinities. BLOBs are
+    copied as hex text, like json_default sends them.
+    """
+    tables = [name for (name,) in source.execute(
+        f"SELECT name FROM {schema_objects(source)} WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY layer, seq"
+    )]
+    for table in tables:
+        layout = [(c[1], c[2]) for c in source.execute(f"PRAGMA table_info({quote_ident(table)})")]
+        kinds = [set() for _ in layout]
+        dated = [{'date'} for _ in layout]
+        fd, path = tempfile.mkstemp(suffix='.csv', prefix='engine-')
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                cursor = source.execute(f"SELECT {', '.join(quote_ident(c) for c, _ in layout)} FROM {quote_ident(table)}")
+                while True:
+                    batch = cursor.fetchmany(IMPORT_BATCH_SIZE)
+                    if not batch:
+                        break
+                    out = []
+                    for row in batch:
+                        values = []
+                        for i, value in enumerate(row):
+                            if value is None:
+                                values.append('\\N')
+                                continue
+                            if isinstance(value, bytes):
+                                value = value.hex()
+                            kinds[i].add(type(value))
+                            if dated[i] and isinstance(value, str):
+                                match = DATE_VALUE_RE.match(value)
+                                if not match:
+                                    dated[i] = None
+                                elif match.group(1):
+                                    dated[i].add('timestamp')
+                            values.append(value)
+                        out.append(values)
+                    writer.writerows(out)
+            columns = ', '.join(
+                f"{quote_ident(column)} {duckdb_column_type(declared, kinds[i], dated[i])}"
+                for i, (column, declared) in enumerate(layout)
+            )
+            target.execute(f"CREATE TABLE {quote_ident(table)} ({columns})")
+            target.execute(f"COPY {quote_ident(table)} FROM '{path}' (FORMAT csv, HEADER false, NULLSTR '\\N')")
+        finally:
+            os.remove(path)
+
+    for name, sql in source.execute(f"SELECT name, sql FROM {schema_objects(source)} WHERE type='view' ORDER BY layer, seq"):
+        try:
+            target.execute(sql)
+        except duckdb.Error as e:
+            print(f"View {name} not copied to DuckDB: {e}")
+
+class DuckDBStats:
+    """Elapsed time and DuckDB's physical plan (EXPLAIN) for one statement; the report shape of ExecutionStats."""
+
+    def __init__(self, conn, sql):
+        self.conn = conn
+        self.sql = sql
+        self.report = None
+
+    def __enter__(self):
+        self.plan = []
+        if is_read_query(self.sql):
+            for _, text in self.conn.execute(f'EXPLAIN {self.sql}').fetchall():
+                self.plan.extend(line for line in text.splitlines() if line.strip())
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.report = {
+            'elapsed_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'source': 'duckdb',
+            'plan': self.plan
+        }
+        return False
+
+# Statements that reach outside the in-memory database (files, other databases, extensions)
+DUCKDB_FORBIDDEN_STATEMENTS = {'ATTACH', 'DETACH', 'COPY', 'EXPORT', 'IMPORT', 'INSTALL', 'LOAD'}
+
+class DuckDBEngine(ExecutionEngine):
+    """
+    Embedded vectorized columnar engine (optional: pip install duckdb).
+    The SQLite database is copied into an in-memory DuckDB database, so
+    queries run with DuckDB's dialect and planner on the same data. Once
+    the data is loaded, file, network and extension access is switched off
+    and the configuration locked, so user SQL cannot read or write the
+    host's files (read_text, read_csv, COPY ... TO, ATTACH, INSTALL).
+    """
+
+    name = 'duckdb'
+    errors = (duckdb.Error,) if duckdb is not None else ()
+
+    def adopt(self, source):
+        target = duckdb.connect(':memory:')
+        try:
+            copy_to_duckdb(source, target)
+            # The bulk load reads a temporary CSV; nothing after it may touch files
+            target.execute('SET enable_external_access=false')
+            target.execute('SET lock_configuration=true')
+        except Exception:
+            target.close()
+            raise
+        finally:
+            source.close()
+        return target
+
+    def check(self, sql):
+        """Raise duckdb.PermissionException for statements in DUCKDB_FORBIDDEN_STATEMENTS."""
+        for keyword in statement_keywords(sql):
+            if keyword in DUCKDB_FORBIDDEN_STATEMENTS:
+                raise duckdb.PermissionException(f'{keyword} statements are not allowed')
+
+    def execute(self, conn, sql):
+        self.check(sql)
+        result = conn.execute(sql)
+        columns = [d[0] for d in result.description] if result.description else None
+        rows = result.fetchall() if columns else []
+        if columns == ['Count'] and not is_read_query(sql):
+            # DML / DDL report their row count as a one-column result
+            return None, None, rows[0][0] if rows else -1
+        return columns, rows, None
+
+    def run(self, conn, sql, timeout=QUERY_TIMEOUT_SECONDS):
+        self.check(sql)
+        timer = threading.Timer(timeout, conn.interrupt)
+        timer.start()
+        try:
+            return conn.execute(sql).fetchall()
+        except duckdb.InterruptException:
+            raise QueryTimeout(f'Query exceeded {timeout:g}s')
+        finally:
+            timer.cancel()
+
+    def snapshot(self, conn):
+        tables = {}
+        for (table_name,) in conn.execute(
+            "SELECT table_name FROM duckdb_tables() WHERE schema_name = 'main' ORDER BY table_oid"
+        ).fetchall():
+            result = conn.execute(f"SELECT * FROM {quote_ident(table_name)}")
+            columns = [d[0] for d in result.description]
+            tables[table_name] = encode_rows(columns, result.fetchall())
+        return tables
+
+    def stats(self, conn, sql):
+        return DuckDBStats(conn, sql)
+
+EXECUTION_ENGINES = {'sqlite': SQLiteEngine()}
+if duckdb is not None:
+    EXECUTION_ENGINES['duckdb'] = DuckDBEngine()
+
+ENGINE_ERRORS = tuple(error for engine in EXECUTION_ENGINES.values() for error in engine.errors)
+
+def get_engine(name=None):
+    """The engine called `name` (DEFAULT_ENGINE when empty); ValueError for unknown or uninstalled ones."""
+    name = (name or DEFAULT_ENGINE).lower()
+    if name not in EXECUTION_ENGINES:
+        if name == 'duckdb':
+            raise ValueError('Engine "duckdb" is not installed (pip install duckdb)')
+        raise ValueError(f'Unknown engine "{name}" (available: {", ".join(EXECUTION_ENGINES)})')
+    return EXECUTION_ENGINES[name]
+
+def comparable_rows(rows):
+    """normalized_rows across engines: numbers as rounded floats, dates / decimals as their text."""
+    def norm(value):
+        if isinstance(value, bool) or value is None or isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)):
+            return round(float(value), 9)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value).hex()
+        try:
+            return round(float(value), 9)
+        except (TypeError, ValueError):
+            return str(value)
+    return sorted((tuple(norm(v) for v in row) for row in rows), key=repr)
+
+# ================== REWRITE RULES ==================
+
+SQLGLOT_DIALECTS = {'postgresql': 'postgres', 'mysql': 'mysql', 'sqlite': 'sqlite',
+                    'sql server': 'tsql', 'oracle': 'oracle'}
+
+# Aggregates whose result depends on input order (ORDER BY in a subquery feeding them matters)
+ORDER_SENSITIVE_AGGREGATES = {'GROUP_CONCAT', 'STRING_AGG', 'ARRAY_AGG', 'JSON_GROUP_ARRAY', 'LISTAGG'}
+
+def sqlglot_dialect(dialect):
+    return SQLGLOT_DIALECTS.get((dialect or '').lower(), 'sqlite')
+
+def clause(node, name):
+    """A clause of a sqlglot node by its plain name ("from", "with", ...), across sqlglot versions."""
+    return node.args.get(f'{name}_', node.args.get(name))
+
+def set_clause(node, name, value):
+    node.set(f'{name}_' if f'{name}_' in node.arg_types else name, value)
+
+def select_sources(select):
+    """{alias or name: Table} for the tables in a SELECT's own FROM and JOINs ({} when any source is not a table)."""
+    from_ = clause(select, 'from')
+    items = ([from_.this] if from_ else []) + [join.this for join in select.args.get('joins') or []]
+    if not items or not all(isinstance(item, exp.Table) for item in items):
+        return {}
+    return {item.alias_or_name: item for item in items}
+
+def is_plain_select(select):
+    """A single SELECT without grouping, aggregates, windows or row limits."""
+    return (isinstance(select, exp.Select) and not select.args.get('group') and not select.args.get('having')
+            and not select.args.get('limit') and not select.args.get('offset')
+            and not any(e.find(exp.AggFunc, exp.Window) for e in select.expressions))
+
+def conjuncts(condition):
+    return list(condition.flatten()) if isinstance(condition, exp.And) else [condition]
+
+def in_filter_position(node):
+    """True when node sits in a WHERE clause under only AND / OR / parentheses (so NULL and FALSE filter alike)."""
+    parent = node.parent
+    while isinstance(parent, (exp.And, exp.Or, exp.Paren)):
+        parent = parent.parent
+    return isinstance(parent, exp.Where)
+
+def qualified_copy(expression, select):
+    """Copy of an outer expression with bare columns qualified by the only source of `select` (None when ambiguous)."""
+    sources = select_sources(select)
+    copy = expression.copy()
+    for column in copy.find_all(exp.Column):
+        if not column.table:
+            if len(sources) != 1:
+                return None
+            column.set('table', exp.to_identifier(next(iter(sources))))
+    return copy
+
+def semi_join_subquery(node):
+    """
+    EXISTS form of `x [NOT] IN (SELECT e FROM ... WHERE w)`: SELECT 1 FROM ... WHERE w AND e = x,
+    or None when the subquery or the outer expression does not allow it.
+    """
+    subquery = node.args.get('query')
+    inner = subquery.this if isinstance(subquery, exp.Subquery) else subquery
+    if not is_plain_select(inner) or len(inner.expressions) != 1 or not select_sources(inner):
+        return None
+    outer_select = node.find_ancestor(exp.Select)
+    outer = qualified_copy(node.this, outer_select) if outer_select else None
+    if outer is None or outer.find(exp.Select):
+        return None
+    inner_names = {name.lower() for name in select_sources(inner)}
+    if any(column.table.lower() in inner_names for column in outer.find_all(exp.Column)):
+        return None  # the outer qualifier would be captured by the subquery's own tables
+    projected = inner.expressions[0]
+    projected = projected.this if isinstance(projected, exp.Alias) else projected
+    match = exp.EQ(this=projected.copy(), expression=outer)
+    exists = inner.copy()
+    exists.set('expressions', [exp.Literal.number(1)])
+    exists.set('distinct', None)
+    exists.set('order', None)
+    where = exists.args.get('where')
+    exists.set('where', exp.Where(this=exp.and_(where.this, match) if where else match))
+    return exp.Exists(this=exists)
+
+def rule_in_to_exists(tree, conn=None):
+    notes = []
+    for node in list(tree.find_all(exp.In)):
+        if node.args.get('query') is None or isinstance(node.parent, exp.Not) or not in_filter_position(node):
+            continue
+        exists = semi_join_subquery(node)
+        if exists is not None:
+            node.replace(exists)
+            notes.append('IN (subquery) became a correlated EXISTS semi-join')
+    return notes
+
+def column_not_null(column, select, conn):
+    """True when `column` (of one of select's tables) is declared NOT NULL or is an INTEGER PRIMARY KEY in `conn`."""
+    if conn is None or not isinstance(column, exp.Column):
+        return False
+    sources = {name.lower(): table for name, table in select_sources(select).items()}
+    if column.table:
+        table = sources.get(column.table.lower())
+    else:
+        table = next(iter(sources.values())) if len(sources) == 1 else None
+    if table is None:
+        return False
+    layout = conn.execute(f'PRAGMA table_info({quote_ident(table.name)})').fetchall()
+    primary_key = [c for c in layout if c[5]]
+    for _, name, declared, notnull, _, pk in layout:
+        if name.lower() == column.name.lower():
+            return bool(notnull) or (pk and len(primary_key) == 1 and (declared or '').upper() == 'INTEGER')
+    return False
+
+def rule_not_in_to_not_exists(tree, conn=None):
+    """
+    NOT IN (subquery) -> NOT EXISTS, only when both sides are declared NOT
+    NULL in `conn` (NOT IN returns no rows once either side is NULL, NOT
+    EXISTS does not); never without a connection to check.
+    """
+    notes = []
+    for node in list(tree.find_all(exp.In)):
+        parent = node.parent
+        if node.args.get('query') is None or not isinstance(parent, exp.Not) or not in_filter_position(parent):
+            continue
+        subquery = node.args.get('query')
+        inner = subquery.this if isinstance(subquery, exp.Subquery) else subquery
+        if not isinstance(inner, exp.Select) or len(inner.expressions) != 1:
+            continue
+        projected = inner.expressions[0]
+        projected = projected.this if isinstance(projected, exp.Alias) else projected
+        outer_select = node.find_ancestor(exp.Select)
+        if outer_select is None or not column_not_null(node.this, outer_select, conn) \
+                or not column_not_null(projected, inner, conn):
+            continue
+        exists = semi_join_subquery(node)
+        if exists is not None:
+            parent.replace(exp.Not(this=exists))
+            notes.append(f'NOT IN became NOT EXISTS ({node.this.sql()} and the subquery value are NOT NULL, '
+                         f'so both return the same rows)')
+    return notes
+
+def rule_or_to_union_all(tree, conn=None):
+    """WHERE a OR b on different columns -> one branch per disjunct, later branches excluding earlier matches."""
+    if not isinstance(tree, exp.Select) or not is_plain_select(tree) or tree.args.get('distinct') \
+            or tree.args.get('order') or not tree.args.get('where'):
+        return []
+    condition = tree.args['where'].this
+    while isinstance(condition, exp.Paren):
+        condition = condition.this
+    if not isinstance(condition, exp.Or):
+        return []
+    disjuncts = list(condition.flatten())
+    columns = {column.name.lower() for d in disjuncts for column in d.find_all(exp.Column)}
+    if len(columns) < 2 or any(d.find(exp.Select) for d in disjuncts):
+        return []
+
+    with_ = clause(tree, 'with')
+    branches = []
+    for i, disjunct in enumerate(disjuncts):
+        branch = tree.copy()
+        set_clause(branch, 'with', None)
+        predicate = disjunct.copy()
+        for earlier in disjuncts[:i]:
+            predicate = exp.and_(predicate, exp.Not(this=exp.Is(this=exp.Paren(this=earlier.copy()),
+                                                                  expression=exp.true())))
+        branch.set('where', exp.Where(this=predicate))
+        branches.append(branch)
+    union = branches[0]
+    for branch in branches[1:]:
+        union = exp.union(union, branch, distinct=False)
+    if with_:
+        set_clause(union, 'with', with_.copy())
+    tree.replace(union)
+    return [f'OR of {len(disjuncts)} conditions became UNION ALL branches (each can use its own index)']
+
+def primary_key_columns(conn, table):
+    if conn is None:
+        return set()
+    try:
+        return {c[1].lower() for c in conn.execute(f"PRAGMA table_info({quote_ident(table)})") if c[5]}
+    except Exception:
+        return set()
+
+def rule_distinct_join_to_exists(tree, conn=None):
+    """SELECT DISTINCT a.* FROM a JOIN b ON ... -> SELECT DISTINCT a.* FROM a WHERE EXISTS (SELECT 1 FROM b ...)."""
+    notes = []
+    for select in list(tree.find_all(exp.Select)):
+        joins = select.args.get('joins') or []
+        distinct = select.args.get('distinct')
+        sources = select_sources(select)
+        if not distinct or distinct.args.get('on') or len(joins) != 1 or len(sources) != 2 \
+                or not is_plain_select(select):
+            continue
+        join = joins[0]
+        if join.side or (join.kind or 'INNER').upper() != 'INNER' or not join.args.get('on'):
+            continue
+        kept = clause(select, 'from').this.alias_or_name
+        dropped = join.this.alias_or_name
+        outputs = list(select.expressions) + [o for o in (select.args.get('order') or exp.Order()).expressions]
+        if not all(column.table == kept for e in outputs for column in e.find_all(exp.Column)) \
+                or any(isinstance(e, exp.Star) for e in select.expressions):
+            continue
+
+        correlated = conjuncts(join.args['on'].copy())
+        remaining = []
+        where = select.args.get('where')
+        for condition in conjuncts(where.this) if where else []:
+            if any(column.table == dropped for column in condition.find_all(exp.Column)):
+                correlated.append(condition.copy())
+            elif all(column.table == kept for column in condition.find_all(exp.Column)):
+                remaining.append(condition.copy())
+            else:
+                break
+        else:
+            semi = exp.select('1').from_(join.this.copy()).where(exp.and_(*correlated))
+            remaining.append(exp.Exists(this=semi))
+            select.set('joins', None)
+            select.set('where', exp.Where(this=exp.and_(*remaining)))
+            note = f'DISTINCT over a join became EXISTS on {dropped} (no join fan-out to deduplicate)'
+            key = primary_key_columns(conn, clause(select, 'from').this.name)
+            projected = {e.alias_or_name.lower() for e in select.expressions if isinstance(e, exp.Column)}
+            if key and key <= projected:
+                select.set('distinct', None)
+                note += '; DISTINCT dropped since the primary key is selected'
+            notes.append(note)
+    return notes
+
+def rule_cte_predicate_pushdown(tree, conn=None):
+    """Move outer WHERE filters on a single-use CTE's plain or grouping columns into the CTE body."""
+    with_ = clause(tree, 'with')
+    if not isinstance(tree, exp.Select) or not with_ or with_.args.get('recursive') or not tree.args.get('where'):
+        return []
+    notes = []
+    sources = select_sources(tree)
+    inner_joined = {clause(tree, 'from').this.alias_or_name} if clause(tree, 'from') else set()
+    inner_joined |= {j.this.alias_or_name for j in tree.args.get('joins') or []
+                     if not j.side and (j.kind or 'INNER').upper() == 'INNER'}
+    for cte in with_.expressions:
+        body = cte.this
+        name = cte.alias_or_name
+        references = [t for t in tree.find_all(exp.Table) if t.name == name]
+        alias = next((a for a, t in sources.items() if t.name == name), None)
+        if len(references) != 1 or alias is None or alias not in inner_joined or not isinstance(body, exp.Select) \
+                or body.args.get('limit') or body.args.get('offset') or body.find(exp.Window):
+            continue
+        group = body.args.get('group')
+        group_keys = {g.sql() for g in group.expressions} if group else set()
+        if not group and any(e.find(exp.AggFunc) for e in body.expressions):
+            continue
+        outputs = {}
+        for e in body.expressions:
+            value = e.this if isinstance(e, exp.Alias) else e
+            if isinstance(e, (exp.Alias, exp.Column)) and not value.find(exp.AggFunc, exp.Window, exp.Select):
+                if not group or value.sql() in group_keys:
+                    outputs[e.alias_or_name.lower()] = value
+
+        keep, pushed = [], []
+        for condition in conjuncts(tree.args['where'].this):
+            columns = list(condition.find_all(exp.Column))
+            if columns and not condition.find(exp.Select, exp.AggFunc, exp.Window) and all(
+                    (c.table == alias or (not c.table and len(sources) == 1)) and c.name.lower() in outputs
+                    for c in columns):
+                moved = condition.copy()
+                for column in list(moved.find_all(exp.Column)):
+                    column.replace(outputs[column.name.lower()].copy())
+                pushed.append(moved)
+            else:
+                keep.append(condition)
+        if not pushed:
+            continue
+        where = body.args.get('where')
+        body.set('where', exp.Where(this=exp.and_(*([where.this] if where else []), *pushed)))
+        tree.set('where', exp.Where(this=exp.and_(*keep)) if keep else None)
+        notes.append(f'{len(pushed)} filter(s) pushed into CTE {name}')
+    return notes
+
+def order_reaches_result(select, tree):
+    """
+    True when the row order of `select` can show in the result: an
+    enclosing query has LIMIT / OFFSET, or the outermost query has no
+    ORDER BY of its own and `select` is not inside a predicate.
+    """
+    ancestor = select.parent
+    while ancestor is not None:
+        if isinstance(ancestor, exp.Select) and (ancestor.args.get('limit') or ancestor.args.get('offset')):
+            return True
+        if isinstance(ancestor, (exp.Where, exp.Having, exp.In, exp.Exists)):
+            return False
+        ancestor = ancestor.parent
+    return not tree.args.get('order')
+
+def rule_drop_subquery_order_by(tree, conn=None):
+    """
+    ORDER BY without LIMIT inside a subquery or CTE does not define the
+    result; drop it. Skipped when the order can reach the result: order-
+    sensitive aggregates, window functions, or see order_reaches_result.
+    """
+    if any(isinstance(f, exp.Anonymous) and f.name.upper() in ORDER_SENSITIVE_AGGREGATES or
+           type(f).__name__.upper() in ('GROUPCONCAT', 'STRINGAGG', 'ARRAYAGG', 'LISTAGG')
+           for f in tree.find_all(exp.Func)) or tree.find(exp.Window):
+        return []
+    removed = 0
+    for select in list(tree.find_all(exp.Select)):
+        if select is tree or not select.args.get('order') or select.args.get('limit') or select.args.get('offset'):
+            continue
+        if isinstance(select.parent, exp.Union) and select.parent.find_ancestor(exp.Subquery, exp.CTE) is None:
+            continue
+        if order_reaches_result(select, tree):
+            continue
+        select.set('order', None)
+        removed += 1
+    if not removed:
+        return []
+    return [f'ORDER BY removed from {removed} subquer{"y" if removed == 1 else "ies"} without LIMIT '
+            f'(their order is not part of the result)']
+
+REWRITE_RULES = [
+    ('in_to_exists', 'IN subquery to EXISTS', rule_in_to_exists),
+    ('not_in_to_not_exists', 'NOT IN to NOT EXISTS', rule_not_in_to_not_exists),
+    ('or_to_union_all', 'OR to UNION ALL', rule_or_to_union_all),
+    ('distinct_join_to_exists', 'DISTINCT join to EXISTS', rule_distinct_join_to_exists),
+    ('cte_predicate_pushdown', 'Predicate pushdown into CTEs', rule_cte_predicate_pushdown),
+    ('drop_subquery_order_by', 'Drop ORDER BY in subqueries', rule_drop_subquery_order_by),
+]
+
+def run_rule(tree, rule_id, rule, conn=None):
+    """(rewritten copy, notes) for one rule; notes is [] when the rule does not apply."""
+    holder = exp.Paren(this=tree.copy())  # lets a rule replace the root node
+    try:
+        notes = rule(holder.this, conn)
+    except Exception as e:
+        print(f"Rewrite rule {rule_id} failed: {e}")
+        return tree, []
+    return holder.this, notes
+
+def rewrite_candidates(query, dialect='SQLite', conn=None):
+    """
+    Deterministic AST rewrites of a query: one candidate per rule that
+    applies, plus all of them chained when more than one does. `conn`
+    (optional) lets rules look up primary keys. Returns
+    [{'rule', 'strategy', 'optimized_query', 'notes'}]; [] when sqlglot is
+    not installed or the query does not parse.
+    """
+    if sqlglot is None:
+        return []
+    read = sqlglot_dialect(dialect)
+    try:
+        tree = sqlglot.parse_one(query, read=read)
+    except Exception:
+        return []
+
+    candidates = []
+    chained, chained_notes = tree, []
+    for rule_id, strategy, rule in REWRITE_RULES:
+        rewritten, notes = run_rule(tree, rule_id, rule, conn)
+        if notes:
+            candidates.append({'rule': rule_id, 'strategy': strategy,
+                               'optimized_query': rewritten.sql(read), 'notes': notes})
+        rewritten, notes = run_rule(chained, rule_id, rule, conn)
+        if notes:
+            chained, chained_notes = rewritten, chained_notes + notes
+    if len(candidates) > 1:
+        candidates.append({'rule': 'combined', 'strategy': 'All applicable rules',
+                           'optimized_query': chained.sql(read), 'notes': chained_notes})
+    return candidates
+
+def verified_rewrites(query, dialect='SQLite', setup_sql='', base_image=None):
+    """
+    rewrite_candidates checked on the user's data: each gets "equivalent"
+    (same rows as the original; None when there is no setup_sql /
+    base_image, the original does not run on SQLite or the rewrite does not
+    transpile to it) and "error" when the rewrite fails. Equivalent
+    rewrites come first.
+    """
+    if not setup_sql and not base_image:
+        candidates = rewrite_candidates(query, dialect)
+        for candidate in candidates:
+            candidate['equivalent'] = None
+        return candidates
+
+    conn = open_database(setup_sql, base_image)
+    try:
+        candidates = rewrite_candidates(query, dialect, conn)
+        if not candidates:
+            return []
+        read = sqlglot_dialect(dialect)
+        try:
+            expected = normalized_rows(run_with_timeout(conn, query), top_level_order_by(query))
+        except (sqlite3.Error, QueryTimeout) as e:
+            expected = None
+            print(f"Rewrites not verified, original query failed: {e}")
+        for candidate in candidates:
+            candidate['equivalent'] = None
+            if expected is None:
+                continue
+            sql = candidate['optimized_query']
+            if read != 'sqlite':
+                try:
+                    sql = sqlglot.transpile(sql, read=read, write='sqlite')[0]
+                except Exception as e:
+                    # Not checkable on SQLite; the rewrite itself may still be fine
+                    candidate['error'] = f'Could not transpile to SQLite: {str(e)}'
+                    continue
+            try:
+                candidate['equivalent'] = results_equivalent(conn, query, sql, expected)
+            except (sqlite3.Error, QueryTimeout) as e:
+                candidate['equivalent'] = False
+                candidate['error'] = str(e)
+    finally:
+        conn.close()
+    candidates.sort(key=lambda c: {True: 0, None: 1, False: 2}[c['equivalent']])
+    return candidates
+
+# ================== OPTIMIZATION TOURNAMENT ==================
+
+def matching_paren(spans, open_index):
+    """Index of the ')' token closing the '(' at spans[open_index]."""
+    depth = 0
+    for i in range(open_index, len(spans)):
+        if spans[i][1] == '(':
+            depth += 1
+        elif spans[i][1] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(spans) - 1
+
+def cte_body_positions(sql):
+    """Character offsets of the '(' opening each top-level CTE body, or [] when a hint is already present."""
+    spans = sql_token_spans(sql)
+    if not spans or spans[0][1].upper() != 'WITH':
+        return []
+    i = 1
+    if i < len(spans) and spans[i][1].upper() == 'RECURSIVE':
+        i += 1
+    positions = []
+    while i < len(spans):
+        i += 1  # CTE name
+        if i < len(spans) and spans[i][1] == '(':
+            i = matching_paren(spans, i) + 1  # column list
+        if i >= len(spans) or spans[i][1].upper() != 'AS':
+            return []
+        i += 1
+        if i >= len(spans) or spans[i][1] != '(':
+            return []  # already has [NOT] MATERIALIZED
+        positions.append(spans[i][2])
+        i = matching_paren(spans, i) + 1
+        if i < len(spans) and spans[i][1] == ',':
+            i += 1
+            continue
+        break
+    return positions
+
+def insert_at(sql, positions, text):
+    for pos in sorted(positions, reverse=True):
+        sql = sql[:pos] + text + sql[pos:]
+    return sql
+
+def local_variants(query):
+    """
+    Deterministic rewrites that keep the result set: CTE materialization
+    hints, dropping DISTINCT inside IN (SELECT DISTINCT ...) and the
+    REWRITE_RULES (when sqlglot is installed). Returns [(strategy, sql)].
+    """
+    variants = [(c['strategy'], c['optimized_query']) for c in rewrite_candidates(query)]
+    positions = cte_body_positions(query)
+    if positions:
+        variants.append(('CTEs as MATERIALIZED', insert_at(query, positions, 'MATERIALIZED ')))
+        variants.append(('CTEs as NOT MATERIALIZED', insert_at(query, positions, 'NOT MATERIALIZED ')))
+
+    spans = sql_token_spans(query)
+    drop = [
+        spans[i + 3] for i in range(len(spans) - 3)
+        if spans[i][1].upper() == 'IN' and spans[i + 1][1] == '('
+        and spans[i + 2][1].upper() == 'SELECT' and spans[i + 3][1].upper() == 'DISTINCT'
+    ]
+    if drop:
+        rewritten = query
+        for _, _, start, end in reversed(drop):
+            rewritten = rewritten[:start] + rewritten[end:].lstrip()
+        variants.append(('Drop DISTINCT inside IN subquery', rewritten))
+    return variants
+
+def run_tournament(query, analysis, setup_sql='', base_image=None, k=TOURNAMENT_DEFAULT_K,
+                   scale=TOURNAMENT_DEFAULT_SCALE, runs=3, statistics=False, timeout=TOURNAMENT_TIMEOUT_SECONDS):
+    """
+    Collect candidates (the original, K LLM rewrites from one structured
+    call and the deterministic local variants), check each for result
+    equivalence on the user's data (results_equivalent: in order when the
+    query has a top-level ORDER BY), then time them on a scaled-up copy
+    and rank the equivalent ones by median latency. With `statistics`, the
+    prompt gets table statistics from a separate copy (ANALYZE results on
+    this one would be stale once it is scaled). The whole run must finish
+    within `timeout` seconds: every query gets at most the time left, and
+    once it is used up the remaining candidates are skipped with an error
+    and the result has "timed_out".
+    """
+    deadline = time.perf_counter() + timeout
+    skipped = f'Skipped: the tournament used up its {timeout:g}s time limit'
+    conn = open_database(setup_sql, base_image)
+    try:
+        cursor = conn.cursor()
+        schema_ddl = schema_ddl_for_query(cursor, query)
+        if schema_ddl and statistics:
+            stats_conn = open_database(setup_sql, base_image)
+            try:
+                schema_ddl += statistics_section(stats_conn, query)
+            finally:
+                stats_conn.close()
+
+        candidates = [{'source': 'original', 'strategy': 'original', 'query': query, 'changes_made': []}]
+        for strategy, sql in local_variants(query):
+            candidates.append({'source': 'local', 'strategy': strategy, 'query': sql, 'changes_made': [strategy]})
+
+        llm_error = None
+        try:
+            reply = call_llm_json(TOURNAMENT_SYSTEM_PROMPT, build_tournament_prompt(query, analysis, k, schema_ddl), 'tournament')
+            for item in (reply.get('candidates') or [])[:k]:
+                sql = (item.get('optimized_query') or '').strip().rstrip(';')
+                if sql:
+                    candidates.append({
+                        'source': 'llm',
+                        'strategy': item.get('strategy') or 'LLM rewrite',
+                        'query': sql,
+                        'changes_made': item.get('changes_made') or []
+                    })
+        except Exception as e:
+            llm_error = str(e)
+
+        # Drop duplicates (same SQL modulo whitespace / comments)
+        seen = set()
+        unique = []
+        for candidate in candidates:
+            key = minify_sql(candidate['query']).lower()
+            if key not in seen:
+                seen.add(key)
+                unique.append(candidate)
+        candidates = unique
+
+        expected = normalized_rows(run_with_timeout(conn, query, query_timeout(deadline)), top_level_order_by(query))
+        timed_out = False
+        for candidate in candidates:
+            if candidate['source'] == 'original':
+                candidate['equivalent'] = True
+                continue
+            if not is_read_query(candidate['query']):
+                candidate['equivalent'] = False
+                candidate['error'] = 'Only SELECT / WITH candidates are benchmarked'
+                continue
+            try:
+                candidate['equivalent'] = results_equivalent(conn, query, candidate['query'], expected,
+                                                             query_timeout(deadline))
+            except (sqlite3.Error, QueryTimeout) as e:
+                timed_out = time.perf_counter() >= deadline
+                # Not checked in time: unknown rather than different
+                candidate['equivalent'] = None if timed_out else False
+                candidate['error'] = skipped if timed_out else str(e)
+
+        scaled = None
+        if not timed_out:
+            queries = ';\n'.join(candidate['query'] for candidate in candidates if candidate['equivalent'])
+            scaled = scale_database(conn, scale, tables=underlying_tables(conn, queries))
+
+        for candidate in candidates:
+            if not candidate['equivalent']:
+                continue
+            try:
+                candidate['plan'] = query_plan(conn, candidate['query'])
+                candidate['latency_ms'] = time_query(conn, candidate['query'], runs, deadline=deadline)
+            except (sqlite3.Error, QueryTimeout) as e:
+                timed_out = time.perf_counter() >= deadline
+                candidate['error'] = skipped if timed_out else str(e)
+    finally:
+        conn.close()
+
+    baseline = candidates[0].get('latency_ms')
+    for candidate in candidates:
+        latency = candidate.get('latency_ms')
+        candidate['speedup'] = round(baseline / latency, 2) if baseline and latency else None
+
+    ranked = sorted(candidates, key=lambda c: (
+        not c['equivalent'], c.get('latency_ms') is None, c.get('latency_ms') or 0
+    ))
+    for rank, candidate in enumerate(ranked, 1):
+        candidate['rank'] = rank
+
+    return {
+        'scale': scaled,
+        'runs': runs,
+        'candidates': ranked,
+        'winner': ranked[0] if ranked and ranked[0].get('latency_ms') is not None else None,
+        'llm_error': llm_error,
+        'timed_out': timed_out
+    }
+
+# ================== INDEX ADVISOR ==================
+
+# Words that can follow a table name in FROM / JOIN and are not an alias
+NOT_ALIAS_WORDS = {
+    'WHERE', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'NATURAL', 'OUTER', 'ON', 'USING',
+    'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'UNION', 'EXCEPT', 'INTERSECT', 'WINDOW', 'SET', 'VALUES',
+    'INDEXED', 'NOT', 'AS'
+}
+PREDICATE_OPS = {'=', '==', '<', '>', '<=', '>=', 'IN', 'BETWEEN', 'LIKE', 'GLOB', 'IS'}
+RANGE_OPS = {'<', '>', '<=', '>=', 'BETWEEN', 'LIKE', 'GLOB'}
+AUTOMATIC_INDEX_RE = re.compile(r'^\s*SEARCH (\S+)(?: AS \S+)? USING AUTOMATIC (?:COVERING |PARTIAL )*INDEX \(([^)]*)\)')
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote_ident(table)})")]
+
+def existing_index_columns(conn, table):
+    """Column lists of the indexes already on a table (including the implicit ones)."""
+    indexes = []
+    for index in conn.execute(f"PRAGMA index_list({quote_ident(table)})"):
+        indexes.append(tuple(c[2] for c in conn.execute(f"PRAGMA index_info({quote_ident(index[1])})")))
+    return indexes
+
+def column_usage(conn, query):
+    """
+    Where the query uses columns of the tables it references, from its tokens:
+    {table: {"eq": [...], "range": [...], "order": [...]}}. Equality / range
+    come from comparisons in WHERE / ON / HAVING, order from GROUP BY /
+    ORDER BY. Qualified names are resolved through the FROM / JOIN aliases,
+    bare names through the only referenced table having that column.
+    """
+    tables = referenced_tables(conn.cursor(), query)
+    columns = {t: {c.lower(): c for c in table_columns(conn, t)} for t in tables}
+    by_name = {t.lower(): t for t in tables}
+    tokens = sql_tokens(query)
+    words = [identifier_name(kind, text) if kind in ('ident', 'quoted') else text.lower() for kind, text in tokens]
+
+    aliases = dict(by_name)
+    for i, word in enumerate(words):
+        if word in by_name and i + 1 < len(tokens):
+            j = i + 2 if tokens[i + 1][1].upper() == 'AS' else i + 1
+            if j < len(tokens) and tokens[j][0] in ('ident', 'quoted') and tokens[j][1].upper() not in NOT_ALIAS_WORDS:
+                aliases[words[j]] = by_name[word]
+
+    usage = {t: {'eq': [], 'range': [], 'order': []} for t in tables}
+    clause = None
+    for i, (kind, text) in enumerate(tokens):
+        upper = text.upper()
+        if kind == 'ident' and upper in ('WHERE', 'ON', 'HAVING', 'SELECT', 'FROM', 'GROUP', 'ORDER', 'LIMIT', 'SET'):
+            clause = 'order' if upper in ('GROUP', 'ORDER') else upper
+            continue
+        if kind not in ('ident', 'quoted'):
+            continue
+        column = words[i]
+        table = None
+        if i >= 2 and tokens[i - 1][1] == '.':
+            table = aliases.get(words[i - 2])
+        elif i + 1 < len(tokens) and tokens[i + 1][1] == '.':
+            continue
+        else:
+            owners = [t for t in tables if column in columns[t]]
+            table = owners[0] if len(owners) == 1 else None
+        if table is None or column not in columns[table]:
+            continue
+        name = columns[table][column]
+
+        if clause == 'order':
+            kind_of_use = 'order'
+        elif clause in ('WHERE', 'ON', 'HAVING'):
+            before = tokens[i - 1][1].upper() if i else ''
+            after = tokens[i + 1][1].upper() if i + 1 < len(tokens) else ''
+            if after == 'NOT' and i + 2 < len(tokens):
+                after = tokens[i + 2][1].upper()
+            op = after if after in PREDICATE_OPS else before if before in PREDICATE_OPS else None
+            if op is None:
+                continue
+            kind_of_use = 'range' if op in RANGE_OPS else 'eq'
+        else:
+            continue
+        if name not in usage[table][kind_of_use]:
+            usage[table][kind_of_use].append(name)
+    return usage
+
+def candidate_indexes(conn, queries):
+    """
+    Candidate (table, columns) indexes for a workload: each equality,
+    range and ordering column alone, equality columns followed by one
+    range / ordering column, plus the automatic indexes SQLite builds at
+    run time for the queries. Candidates an existing index already covers
+    (as a prefix) are skipped.
+    """
+    candidates = []
+    for query in queries:
+        usage = column_usage(conn, query)
+        for table, used in usage.items():
+            eq = used['eq'][:3]
+            singles = [(c,) for c in used['eq'] + used['range'] + used['order']]
+            composites = [tuple(eq)] if len(eq) > 1 else []
+            composites += [tuple(eq) + (c,) for c in used['range'] + used['order'] if eq and c not in eq]
+            candidates += [(table, cols) for cols in singles + composites]
+        for line in query_plan(conn, query):
+            match = AUTOMATIC_INDEX_RE.match(line)
+            if match:
+                columns = tuple(part.split('=')[0].strip() for part in match.group(2).split(' AND ') if '=' in part)
+                table = next((t for t in usage if t.lower() == match.group(1).lower()), None)
+                if table and columns:
+                    candidates.append((table, columns))
+
+    unique = []
+    for table, cols in candidates:
+        covered = any(existing[:len(cols)] == cols for existing in existing_index_columns(conn, table))
+        if not covered and (table, cols) not in unique:
+            unique.append((table, cols))
+    return unique[:INDEX_ADVISOR_MAX_CANDIDATES]
+
+def index_ddl(conn, table, columns):
+    """
+    Name and CREATE INDEX statement for a candidate. Names join the table and
+    columns with "_", so a_b(c) and a(b_c) would both be idx_a_b_c; a name
+    already in the database gets a numeric suffix.
+    """
+    base = 'idx_' + '_'.join(re.sub(r'\W', '', part) for part in (table,) + columns).lower()
+    name, n = base, 2
+    while conn.execute("SELECT 1 FROM sqlite_master WHERE name = ? COLLATE NOCASE", (name,)).fetchone():
+        name = f'{base}_{n}'
+        n += 1
+    return name, f"CREATE INDEX {quote_ident(name)} ON {quote_ident(table)} ({', '.join(quote_ident(c) for c in columns)})"
+
+def index_bytes(conn, name):
+    """On-disk size of an index in bytes, or None when SQLite was built without dbstat."""
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return None
+
+class WorkloadCosts:
+    """
+    Measured cost of every workload query in the current index state; only
+    re-times queries whose plan changed. Timed runs stop at `deadline` (see
+    query_timeout).
+    """
+
+    def __init__(self, conn, workload, runs, deadline=None):
+        self.conn = conn
+        self.workload = workload
+        self.runs = runs
+        self.deadline = deadline
+        self.plans = {}
+        self.latency = {}
+        for i, item in enumerate(workload):
+            self.plans[i] = query_plan(conn, item['query'])
+            self.latency[i] = time_query(conn, item['query'], runs, deadline=deadline)
+
+    def measure(self):
+        """(weighted total ms, plans, latencies) for the indexes currently present."""
+        plans, latency = {}, {}
+        for i, item in enumerate(self.workload):
+            plans[i] = query_plan(self.conn, item['query'])
+            if plans[i] == self.plans[i]:
+                latency[i] = self.latency[i]
+            else:
+                latency[i] = time_query(self.conn, item['query'], self.runs, deadline=self.deadline)
+        return self.total(latency), plans, latency
+
+    def total(self, latency=None):
+        latency = latency or self.latency
+        return sum(item['weight'] * latency[i] for i, item in enumerate(self.workload))
+
+    def accept(self, plans, latency):
+        self.plans, self.latency = plans, latency
+
+def advise_indexes(workload, setup_sql='', base_image=None, max_indexes=INDEX_ADVISOR_DEFAULT_MAX_INDEXES,
+                   max_bytes=None, scale=TOURNAMENT_DEFAULT_SCALE, runs=3, timeout=INDEX_ADVISOR_TIMEOUT_SECONDS):
+    """
+    Greedy workload index selection. `workload` is a list of
+    {"query", "weight"}. On a scaled scratch copy of the data, every round
+    tries each remaining candidate on top of the indexes chosen so far and
+    keeps the one that lowers the weighted workload time the most, until
+    the count / byte budget is used up or no candidate gains at least
+    INDEX_ADVISOR_MIN_GAIN of the current total. Selection also stops
+    `timeout` seconds in: the set chosen so far is returned (plus the best
+    candidate of the unfinished round, if it gains enough) with
+    "timed_out". Raises QueryTimeout when even the baseline does not finish.
+    """
+    deadline = time.perf_counter() + timeout
+    conn = open_database(setup_sql, base_image)
+    try:
+        queries = [item['query'] for item in workload]
+        scaled = scale_database(conn, scale, tables=underlying_tables(conn, ';\n'.join(queries)))
+        candidates = candidate_indexes(conn, queries)
+        costs = WorkloadCosts(conn, workload, runs, deadline)
+        baseline_plans, baseline_latency = dict(costs.plans), dict(costs.latency)
+        baseline_total = costs.total()
+
+        evaluated = {}
+        chosen = []
+        used_bytes = 0
+        sizes_unknown = False
+        remaining = list(candidates)
+        timed_out = False
+        while remaining and len(chosen) < max_indexes and not timed_out:
+            current = costs.total()
+            best = None
+            for table, cols in remaining:
+                if time.perf_counter() >= deadline:
+                    timed_out = True
+                    break
+                name, ddl = index_ddl(conn, table, cols)
+                conn.execute(ddl)
+                try:
+                    size = index_bytes(conn, name)
+                    sizes_unknown = sizes_unknown or size is None
+                    total, plans, latency = costs.measure()
+                except QueryTimeout:
+                    if time.perf_counter() < deadline:
+                        raise
+                    # Out of time: settle this round with the candidates measured so far
+                    timed_out = True
+                    break
+                finally:
+                    conn.execute(f"DROP INDEX {quote_ident(name)}")
+                evaluated.setdefault((table, cols), {'table': table, 'columns': list(cols), 'ddl': ddl,
+                                                     'bytes': size, 'gain_alone_ms': round(current - total, 3)})
+                if max_bytes is not None and size is not None and used_bytes + size > max_bytes:
+                    continue
+                if best is None or total < best[0]:
+                    best = (total, (table, cols), name, ddl, size, plans, latency)
+            if best is None or current - best[0] < INDEX_ADVISOR_MIN_GAIN * current:
+                break
+            total, key, name, ddl, size, plans, latency = best
+            conn.execute(ddl)
+            costs.accept(plans, latency)
+            used_bytes += size or 0
+            remaining.remove(key)
+            chosen.append({'ddl': ddl, 'table': key[0], 'columns': list(key[1]), 'bytes': size,
+                           'gain_ms': round(current - total, 3)})
+    finally:
+        conn.close()
+
+    final_total = costs.total()
+    queries = []
+    for i, item in enumerate(workload):
+        before, after = baseline_latency[i], costs.latency[i]
+        queries.append({
+            'query': item['query'],
+            'weight': item['weight'],
+            'baseline_ms': before,
+            'final_ms': after,
+            'speedup': round(before / after, 2) if after else None,
+            'plan_before': baseline_plans[i],
+            'plan_after': costs.plans[i]
+        })
+    report = {
+        'scale': scaled,
+        'indexes': chosen,
+        'index_bytes': used_bytes,
+        'baseline_ms': round(baseline_total, 3),
+        'final_ms': round(final_total, 3),
+        'speedup': round(baseline_total / final_total, 2) if final_total else None,
+        'queries': queries,
+        'candidates': list(evaluated.values()),
+        'timed_out': timed_out
+    }
+    if max_bytes is not None and sizes_unknown:
+        report['warning'] = 'max_bytes was not enforced: index sizes need SQLite built with the dbstat table'
+    return report
+
+# ================== SCHEMA CHANGE IMPACT ==================
+
+# Lower is better: an automatic index is a search, but SQLite builds it on every run
+ACCESS_RANK = {'search': 0, 'automatic index': 1, 'scan': 2}
+VERDICT_ORDER = {'broken': 0, 'regressed': 1, 'failing': 2, 'improved': 3, 'unchanged': 4}
+
+def plan_accesses(plan):
+    """{table or alias: sorted access kinds} from query_plan lines."""
+    accesses = defaultdict(list)
+    for line in plan:
+        match = PLAN_ACCESS_RE.match(line.strip())
+        if match:
+            kind = 'scan' if match.group(1) == 'SCAN' else 'automatic index' if match.group(5) else 'search'
+            accesses[match.group(2)].append(kind)
+    return {name: sorted(kinds, key=ACCESS_RANK.get) for name, kinds in accesses.items()}
+
+def plan_changes(old_plan, new_plan):
+    """
+    (changes, regressed) between two plans of one query. A change reads
+    like "Employee: SEARCH -> SCAN"; it is a regression when a table that
+    is still read loses an index search, or when a new temp B-tree (sort)
+    appears.
+    """
+    old, new = plan_accesses(old_plan), plan_accesses(new_plan)
+    changes, regressed = [], False
+    for name in sorted(set(old) | set(new)):
+        before, after = old.get(name, []), new.get(name, [])
+        if before == after:
+            continue
+        changes.append(f"{name}: {', '.join(before).upper() or '-'} -> {', '.join(after).upper() or '-'}")
+        if before and after and sum(ACCESS_RANK[k] for k in after) > sum(ACCESS_RANK[k] for k in before):
+            regressed = True
+    old_sorts = sum('USE TEMP B-TREE' in line for line in old_plan)
+    new_sorts = sum('USE TEMP B-TREE' in line for line in new_plan)
+    if new_sorts > old_sorts:
+        changes.append(f'{new_sorts - old_sorts} more temp B-tree sort(s)')
+        regressed = True
+    return changes, regressed
+
+def measure_workload_query(conn, query, runs):
+    """Plan, median time, row count and a digest of the rows; 'error' is set when the query fails or times out."""
+    try:
+        plan = query_plan(conn, query)
+    except sqlite3.Error as e:
+        return {'error': f'SQL Error: {str(e)}'}
+    try:
+        rows = run_with_timeout(conn, query)
+        return {
+            'plan': plan,
+            'ms': time_query(conn, query, runs),
+            'row_count': len(rows),
+            'rows_digest': hashlib.sha256(repr(normalized_rows(rows)).encode('utf-8')).hexdigest()[:16]
+        }
+    except QueryTimeout as e:
+        return {'plan': plan, 'error': str(e)}
+    except sqlite3.Error as e:
+        return {'plan': plan, 'error': f'SQL Error: {str(e)}'}
+
+def schema_change_impact(workload, old_setup_sql, new_setup_sql, base_image=None, scale=1, runs=3,
+                         min_slowdown=SCHEMA_CHANGE_MIN_SLOWDOWN, min_delta_ms=SCHEMA_CHANGE_MIN_DELTA_MS):
+    """
+    Run a workload against the database before and after a schema change.
+    `workload` is a list of {"query", "weight", "new_query"} (new_query for
+    queries that must be rewritten for the new schema). Both databases get
+    the same scale factor. Each query is "broken" when it fails only on the
+    new schema, "regressed" when its plan loses an index search (see
+    plan_changes) or it slows down by min_slowdown and min_delta_ms,
+    "improved" for the reverse, "failing" when it fails on both.
+    Queries are ranked by verdict, then weighted added time.
+    Raises ValueError when either setup SQL fails.
+    """
+    sides = {}
+    for side, setup_sql in (('old', old_setup_sql), ('new', new_setup_sql)):
+        try:
+            conn = open_database(setup_sql, base_image)
+        except sqlite3.Error as e:
+            raise ValueError(f'Error in {side} setup SQL: {str(e)}')
+        try:
+            side_queries = [item.get('new_query') or item['query'] if side == 'new' else item['query']
+                            for item in workload]
+            tables = underlying_tables(conn, ';\n'.join(side_queries))
+            # Time both sides on in-memory tables, not one of them on the attached base image
+            copy_image_tables(conn, tables)
+            scaled = scale_database(conn, scale, tables=tables) if scale > 1 else None
+            measured = [measure_workload_query(conn, query, runs) for query in side_queries]
+        finally:
+            conn.close()
+        sides[side] = (scaled, measured)
+
+    queries = []
+    for item, old, new in zip(workload, sides['old'][1], sides['new'][1]):
+        entry = {
+            'query': item['query'],
+            'weight': item['weight'],
+            'old_ms': old.get('ms'),
+            'new_ms': new.get('ms'),
+            'slowdown': None,
+            'impact_ms': None,
+            'plan_changes': [],
+            'reasons': [],
+            'old_plan': old.get('plan'),
+            'new_plan': new.get('plan')
+        }
+        if item.get('new_query'):
+            entry['new_query'] = item['new_query']
+        if new.get('error') or old.get('error'):
+            entry['verdict'] = 'failing' if old.get('error') and new.get('error') else 'broken' if new.get('error') else 'improved'
+            entry['old_error'], entry['new_error'] = old.get('error'), new.get('error')
+            queries.append(entry)
+            continue
+
+        changes, plan_regressed = plan_changes(old['plan'], new['plan'])
+        delta = new['ms'] - old['ms']
+        entry.update({
+            'slowdown': round(new['ms'] / old['ms'], 2) if old['ms'] else None,
+            'impact_ms': round(item['weight'] * delta, 3),
+            'plan_changes': changes,
+            'results_match': old['rows_digest'] == new['rows_digest']
+        })
+        if plan_regressed:
+            entry['reasons'].append('plan')
+        if delta >= min_delta_ms and new['ms'] > old['ms'] * min_slowdown:
+            entry['reasons'].append('runtime')
+        if entry['reasons']:
+            entry['verdict'] = 'regressed'
+        elif -delta >= min_delta_ms and old['ms'] > new['ms'] * min_slowdown:
+            entry['verdict'] = 'improved'
+        else:
+            entry['verdict'] = 'unchanged'
+        queries.append(entry)
+
+    queries.sort(key=lambda q: (VERDICT_ORDER[q['verdict']], -(q['impact_ms'] or 0)))
+    counts = {verdict: sum(q['verdict'] == verdict for q in queries) for verdict in VERDICT_ORDER}
+    timed = [q for q in queries if q['old_ms'] is not None and q['new_ms'] is not None]
+    old_total = sum(q['weight'] * q['old_ms'] for q in timed)
+    new_total = sum(q['weight'] * q['new_ms'] for q in timed)
+    return {
+        'scale': {'old': sides['old'][0], 'new': sides['new'][0]},
+        'summary': {
+            **counts,
+            'old_ms': round(old_total, 3),
+            'new_ms': round(new_total, 3),
+            'slowdown': round(new_total / old_total, 2) if old_total else None
+        },
+        'queries': queries
+    }
+
+# ================== SCALE GRADING ==================
+
+# Serializes building scale databases and measuring references, so a
+# reference is never timed while another request is loading the machine
+scale_lock = threading.Lock()
+# (question_id, rows) -> cost of the reference solution on that scale database
+scale_reference_costs = {}
+
+def scale_rows(question_id):
+    return min(SCALE_QUESTION_ROWS.get(question_id, SCALE_DEFAULT_ROWS), SCALE_DEFAULT_ROWS)
+
+def scale_question_db_path(question_id):
+    return os.path.join(QUESTION_DB_DIR, f'q{int(question_id)}-scale-{scale_rows(question_id)}.db')
+
+def build_scale_question_db(question_id):
+    """
+    Write the large version of a practice question's database: its seed
+    data plus populate_synthetic rows (seeded with the question id, so every
+    build is identical). Returns ({table: row count}, file size).
+    """
+    conn = init_question_db(question_id)
+    try:
+        counts = populate_synthetic(conn, scale_rows(question_id), seed=question_id)
+        size = write_immutable_db(conn, scale_question_db_path(question_id))
+    finally:
+        conn.close()
+    return counts, size
+
+def open_scale_question_db(question_id):
+    """Open the question's scale database read-only, building it on first use."""
+    path = scale_question_db_path(question_id)
+    if not os.path.exists(path):
+        with scale_lock:
+            if not os.path.exists(path):
+                build_scale_question_db(question_id)
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+    conn.execute(f'PRAGMA mmap_size={QUESTION_DB_MMAP_BYTES}')
+    return conn
+
+def run_with_budget(conn, sql, timeout, max_steps=None, interval=SCALE_PROGRESS_INTERVAL):
+    """
+    Execute and fetch all rows under a wall-time and a VM-step budget.
+    Returns (rows, vm_steps, elapsed_ms), steps counted in `interval`
+    increments; raises QueryTimeout naming the budget that ran out. Timing
+    runs pass a coarse interval: the handler's own cost grows with the step
+    count and would skew the time towards it.
+    """
+    calls = 0
+    exceeded = None
+    start = time.perf_counter()
+    deadline = start + timeout
+
+    def progress():
+        nonlocal calls, exceeded
+        calls += 1
+        if max_steps is not None and calls * interval > max_steps:
+            exceeded = f'VM step budget ({max_steps:,} steps)'
+        elif time.perf_counter() > deadline:
+            exceeded = f'time budget ({timeout * 1000:g} ms)'
+        return 1 if exceeded else 0
+
+    conn.set_progress_handler(progress, interval)
+    try:
+        rows = conn.execute(sql).fetchall()
+    except sqlite3.OperationalError as e:
+        if exceeded:
+            raise QueryTimeout(f'Query exceeded the {exceeded}')
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+    return rows, calls * interval, round((time.perf_counter() - start) * 1000, 3)
+
+def measure_at_scale(conn, sql, runs, timeout, max_steps=None):
+    """Median time, VM steps, rows and a digest of the rows over `runs` budgeted executions."""
+    timings = []
+    for _ in range(runs):
+        rows, steps, elapsed_ms = run_with_budget(conn, sql, timeout, max_steps)
+        timings.append(elapsed_ms)
+    timings.sort()
+    return {
+        'elapsed_ms': timings[len(timings) // 2],
+        'vm_steps': steps,
+        'row_count': len(rows),
+        'rows_digest': hashlib.sha256(repr(normalized_rows(rows)).encode('utf-8')).hexdigest()[:16]
+    }
+
+def reference_cost(conn, question_id, runs=3):
+    """Cost of the question's reference solution on its scale database, measured once per process."""
+    key = (question_id, scale_rows(question_id))
+    with scale_lock:
+        if key not in scale_reference_costs:
+            solution = PRACTICE_QUESTIONS_BY_ID[question_id]['solution']
+            scale_reference_costs[key] = measure_at_scale(conn, solution, runs, QUERY_TIMEOUT_SECONDS)
+        return scale_reference_costs[key]
+
+def scale_grade(ratio):
+    for limit, grade, verdict in SCALE_GRADES:
+        if limit is None or ratio <= limit:
+            return grade, verdict
+
+def grade_at_scale(question_id, query, runs=3):
+    """
+    Run an answer to a practice question on its scale database and grade
+    it against the reference solution. The answer must return the same rows
+    as the reference; its budget is SCALE_TIME_BUDGET_FACTOR times the
+    reference's time (capped at QUERY_TIMEOUT_SECONDS) and
+    SCALE_STEP_BUDGET_FACTOR times its VM steps. The grade comes from the
+    median time ratio, with the reference and the answer timed alternately
+    in the same request so machine load affects both alike. VM steps miss
+    sorting, temp B-trees and other work done in C, so they only set the
+    budget; their ratio is reported next to the time's. Answers that return
+    other rows or run out of budget get "F".
+    """
+    solution = PRACTICE_QUESTIONS_BY_ID[question_id]['solution']
+    conn = open_scale_question_db(question_id)
+    try:
+        try:
+            reference = reference_cost(conn, question_id)
+        except QueryTimeout as e:
+            raise QueryTimeout(f'The reference solution could not be measured on the scale database: {str(e)}')
+        time_budget = min(max(reference['elapsed_ms'] * SCALE_TIME_BUDGET_FACTOR, SCALE_MIN_TIME_BUDGET_MS) / 1000,
+                          QUERY_TIMEOUT_SECONDS)
+        step_budget = max(reference['vm_steps'], SCALE_PROGRESS_INTERVAL) * SCALE_STEP_BUDGET_FACTOR
+        tables = {name: conn.execute(f'SELECT COUNT(*) FROM {quote_ident(name)}').fetchone()[0]
+                  for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")}
+        result = {
+            'question_id': question_id,
+            'tables': tables,
+            'budget': {'time_ms': round(time_budget * 1000, 3), 'vm_steps': step_budget},
+            'reference': {
+                'elapsed_ms': reference['elapsed_ms'],
+                'vm_steps': reference['vm_steps'],
+                'row_count': reference['row_count'],
+                'plan': query_plan(conn, solution)
+            }
+        }
+        plan = query_plan(conn, query)
+        timings = {'reference': [], 'answer': []}
+        try:
+            answer = measure_at_scale(conn, query, 1, time_budget, step_budget)
+            correct = answer['rows_digest'] == reference['rows_digest']
+            if correct:
+                for _ in range(runs):
+                    timings['reference'].append(
+                        run_with_budget(conn, solution, QUERY_TIMEOUT_SECONDS, interval=SCALE_TIMING_INTERVAL)[2])
+                    timings['answer'].append(
+                        run_with_budget(conn, query, time_budget, step_budget, SCALE_TIMING_INTERVAL)[2])
+        except QueryTimeout as e:
+            result.update({'correct': None, 'grade': 'F', 'verdict': str(e), 'answer': {'plan': plan}})
+            return result
+    finally:
+        conn.close()
+
+    result['answer'] = {
+        'elapsed_ms': answer['elapsed_ms'],
+        'vm_steps': answer['vm_steps'],
+        'row_count': answer['row_count'],
+        'plan': plan
+    }
+    result['correct'] = correct
+    if not correct:
+        result.update({'grade': 'F', 'verdict': 'returns different rows than the reference on the large data'})
+        return result
+    answer_ms = sorted(timings['answer'])[runs // 2]
+    reference_ms = sorted(timings['reference'])[runs // 2]
+    result['answer']['elapsed_ms'] = answer_ms
+    result['reference']['elapsed_ms'] = reference_ms
+    # Both counts are floored at one interval, so two tiny queries compare as equal, not 0x
+    step_ratio = max(answer['vm_steps'], SCALE_PROGRESS_INTERVAL) / max(reference['vm_steps'], SCALE_PROGRESS_INTERVAL)
+    time_ratio = answer_ms / reference_ms if reference_ms else None
+    result['grade'], result['verdict'] = scale_grade(time_ratio if time_ratio is not None else step_ratio)
+    result['ratio'] = {
+        'time': round(time_ratio, 2) if time_ratio is not None else None,
+        'vm_steps': round(step_ratio, 2)
+    }
+    return result
+
+# ================== PLAYGROUND SESSIONS ==================
+
+# Statements that would break the per-step savepoint stack
+SESSION_FORBIDDEN_STATEMENTS = {'BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'VACUUM', 'ATTACH', 'DETACH'}
+
+class PlaygroundSession:
+    """
+    A live in-memory database for one playground user. Every step runs
+    inside its own SAVEPOINT (step_1, step_2, ...), nested in the previous
+    ones, so rolling back to step k is a single ROLLBACK TO step_{k+1}.
+    """
+
+    def __init__(self, session_id, setup_sql, base_image=None):
+        self.id = session_id
+        self.lock = threading.Lock()
+        self.conn = open_database(setup_sql, base_image, copy=True, check_same_thread=False, isolation_level=None,
+                                  cached_statements=STATEMENT_CACHE_SIZE)
+        self.steps = []
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.memory_bytes = 0
+        self.closed = False
+        self.capture = ChangeCapture(self.conn)
+        self.update_memory()
+
+    def update_memory(self):
+        page_count = self.conn.execute('PRAGMA page_count').fetchone()[0]
+        page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+        self.memory_bytes = page_count * page_size
+
+    def run_step(self, query, collect_stats=False):
+        """
+        Run one statement as the next step. On error the database is left unchanged.
+        Returns (result, affected_rows, changes, schema_changes, stats); see
+        ChangeCapture.collect. stats is None unless collect_stats is set.
+        """
+        forbidden = [word for word in statement_keywords(query) if word in SESSION_FORBIDDEN_STATEMENTS]
+        if forbidden:
+            raise ValueError(f'{forbidden[0]} is not allowed in a playground session step')
+
+        savepoint = f'step_{len(self.steps) + 1}'
+        cursor = self.conn.cursor()
+        cursor.execute(f'SAVEPOINT {savepoint}')
+        stats = ExecutionStats(self.conn, query) if collect_stats else None
+        try:
+            self.capture.begin_step(query)
+            with stats or contextlib.nullcontext():
+                cursor.execute(query)
+                result, affected_rows = fetch_result(cursor)
+            changes, schema_changes = self.capture.collect()
+        except sqlite3.Error:
+            cursor.execute(f'ROLLBACK TO {savepoint}')
+            cursor.execute(f'RELEASE {savepoint}')
+            raise
+
+        self.steps.append(query)
+        self.update_memory()
+        return result, affected_rows, changes, schema_changes, stats.report if stats else None
+
+    def run_batch(self, statement, parameter_sets, batch_size, return_rows=False):
+        """
+        Run a parameterized statement for every parameter set as the next
+        step (see run_parameter_batches). Row deltas are not captured: the
+        capture triggers would log every row, so they are dropped and the
+        next run_step reinstalls them. On error the database is left unchanged.
+        """
+        savepoint = f'step_{len(self.steps) + 1}'
+        self.conn.execute(f'SAVEPOINT {savepoint}')
+        try:
+            self.capture.remove_triggers()
+            report = run_parameter_batches(self.conn, statement, parameter_sets, batch_size,
+                                           transactions=False, return_rows=return_rows)
+        except Exception:
+            self.conn.execute(f'ROLLBACK TO {savepoint}')
+            self.conn.execute(f'RELEASE {savepoint}')
+            raise
+
+        self.steps.append(statement)
+        self.update_memory()
+        return report
+
+    def rollback(self, step):
+        """Return the database to its state right after `step` (0 = just the setup SQL)."""
+        if step < 0 or step > len(self.steps):
+            raise ValueError(f'step must be between 0 and {len(self.steps)}')
+        if step == len(self.steps):
+            return
+        savepoint = f'step_{step + 1}'
+        self.conn.execute(f'ROLLBACK TO {savepoint}')
+        self.conn.execute(f'RELEASE {savepoint}')
+        del self.steps[step:]
+        self.update_memory()
+
+    def close(self):
+        self.closed = True
+        self.conn.close()
+
+class PlaygroundSessionStore:
+    """Sessions by id, evicted when idle past the TTL, then LRU-first over the count or memory budget."""
+
+    def __init__(self, ttl, max_sessions, memory_budget_bytes):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.memory_budget_bytes = memory_budget_bytes
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def create(self, setup_sql, base_image=None):
+        session = PlaygroundSession(uuid.uuid4().hex, setup_sql, base_image)
+        with self.lock:
+            self.sessions[session.id] = session
+            self._evict(keep=session.id)
+        metrics_incr('playground_sessions_created')
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            self._evict()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is not None:
+            with session.lock:
+                session.close()
+        return session is not None
+
+    def enforce_budget(self):
+        """Called after a step grows a session's database."""
+        with self.lock:
+            self._evict()
+
+    def total_memory(self):
+        return sum(s.memory_bytes for s in self.sessions.values())
+
+    def _evict(self, keep=None):
+        now = time.time()
+        victims = [sid for sid, s in self.sessions.items() if now - s.last_used > self.ttl and sid != keep]
+        for sid in victims:
+            self._drop(sid)
+
+        while len(self.sessions) > 1 and (
+            len(self.sessions) > self.max_sessions or self.total_memory() > self.memory_budget_bytes
+        ):
+            oldest = next(iter(self.sessions))
+            if oldest == keep:
+                self.sessions.move_to_end(oldest)
+                oldest = next(iter(self.sessions))
+            self._drop(oldest)
+
+    def _drop(self, session_id):
+        session = self.sessions.pop(session_id)
+        metrics_incr('playground_sessions_evicted')
+        # A step may be running; close once it is done
+        with session.lock:
+            session.close()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'sessions': len(self.sessions),
+                'memory_bytes': self.total_memory(),
+                'memory_budget_bytes': self.memory_budget_bytes
+            }
+
+playground_sessions = PlaygroundSessionStore(
+    PLAYGROUND_SESSION_TTL,
+    PLAYGROUND_MAX_SESSIONS,
+    PLAYGROUND_MEMORY_BUDGET_MB * 1024 * 1024
+)
+
+# ================== PARAMETERIZED BATCHES ==================
+
+BATCH_QUERY_STATEMENTS = {'SELECT', 'WITH', 'VALUES'}
+BATCH_DML_STATEMENTS = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+
+class BatchError(Exception):
+    pass
+
+def has_named_parameters(statement):
+    """True when the statement uses :name / @name / $name placeholders rather than ? / ?N."""
+    return any(kind == 'param' and text[0] in ':@$' and not text[1:].isdigit()
+               for kind, text in sql_tokens(statement))
+
+def parameter_sets_from_stream(stream, fmt, has_header=True, named=False):
+    """
+    Lazily read bind-parameter sets from a CSV / TSV / JSONL upload: tuples
+    in column order, or dicts keyed by column name for named placeholders
+    (which need a header row or JSONL keys).
+    """
+    if named and fmt != 'jsonl' and not has_header:
+        raise ValueError('Named parameters need a header row to match them by name')
+    columns, sample, rest = read_import_rows(stream, fmt, has_header)
+    rows = itertools.chain(sample, rest)
+    if named:
+        return (dict(zip(columns, row)) for row in rows)
+    return (tuple(row) for row in rows)
+
+def with_statement_verb(tokens):
+    """
+    The statement a WITH clause leads into: the first SELECT / VALUES / DML
+    keyword outside parentheses (CTE bodies are parenthesized), or None.
+    """
+    depth = 0
+    for kind, text in tokens[1:]:
+        if kind == 'op' and text == '(':
+            depth += 1
+        elif kind == 'op' and text == ')':
+            depth -= 1
+        elif depth == 0 and kind == 'ident' and text.upper() in BATCH_QUERY_STATEMENTS | BATCH_DML_STATEMENTS:
+            return text.upper()
+    return None
+
+def run_parameter_batches(conn, statement, parameter_sets, batch_size=BATCH_DEFAULT_SIZE, transactions=True,
+                          return_rows=False, timeout=BATCH_TIMEOUT_SECONDS):
+    """
+    Run one parameterized statement for every parameter set, batch_size
+    sets at a time. DML goes through a single executemany() per batch;
+    queries run once per set, and the connection's statement cache keeps
+    them prepared, so the statement is parsed once either way. With
+    `transactions` (a connection in autocommit mode) every batch is its own
+    BEGIN / COMMIT. Returns per-batch row counts and timings, totals and
+    throughput; queries also return the first BATCH_SAMPLE_RESULTS result
+    sets, and every result row (tagged with its parameter set) with
+    return_rows. Raises BatchError naming the failed batch (rolled back)
+    and QueryTimeout when the run passes `timeout` seconds.
+    """
+    tokens = sql_tokens(statement)
+    kind = tokens[0][1].upper() if tokens else ''
+    if kind not in BATCH_QUERY_STATEMENTS | BATCH_DML_STATEMENTS:
+        raise ValueError('Only SELECT / WITH / VALUES / INSERT / UPDATE / DELETE / REPLACE statements can be batched')
+    if kind == 'WITH' and with_statement_verb(tokens) in BATCH_DML_STATEMENTS:
+        # WITH ... DELETE / INSERT / UPDATE returns no rows: batch it like the DML it is
+        kind = with_statement_verb(tokens)
+    is_query = kind in BATCH_QUERY_STATEMENTS
+    parameter_sets = iter(parameter_sets)
+
+    start = time.perf_counter()
+    deadline = start + timeout
+    conn.set_progress_handler(lambda: 1 if time.perf_counter() > deadline else 0, 10000)
+    cursor = conn.cursor()
+    batches = []
+    samples = []
+    columns = None
+    result_rows = []
+    truncated = False
+    total_sets = total_rows = 0
+    try:
+        while True:
+            batch = list(itertools.islice(parameter_sets, batch_size))
+            if not batch:
+                break
+            if time.perf_counter() > deadline:
+                raise QueryTimeout(f'Batch run exceeded {timeout:g}s after {total_sets} parameter sets')
+            number = len(batches) + 1
+            offset = 0
+            batch_start = time.perf_counter()
+            try:
+                if transactions:
+                    cursor.execute('BEGIN')
+                if is_query:
+                    rows = 0
+                    for offset, params in enumerate(batch):
+                        cursor.execute(statement, params)
+                        fetched = cursor.fetchall()
+                        rows += len(fetched)
+                        if columns is None:
+                            columns = [d[0] for d in cursor.description]
+                        if len(samples) < BATCH_SAMPLE_RESULTS:
+                            samples.append({'parameters': params, **encode_rows(columns, fetched)})
+                        if return_rows and not truncated:
+                            room = BATCH_MAX_RESULT_ROWS - len(result_rows)
+                            truncated = len(fetched) > room
+                            result_rows.extend((total_sets + offset, *row) for row in fetched[:room])
+                else:
+                    changes = conn.total_changes
+                    cursor.executemany(statement, batch)
+                    # rowcount is -1 for statements that start with WITH
+                    rows = cursor.rowcount if cursor.rowcount >= 0 else conn.total_changes - changes
+                if transactions:
+                    cursor.execute('COMMIT')
+            except sqlite3.Error as e:
+                if transactions and conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                if 'interrupted' in str(e):
+                    raise QueryTimeout(f'Batch run exceeded {timeout:g}s after {total_sets} parameter sets')
+                if is_query or len(batch) == 1:
+                    where = f'parameter set {total_sets + offset}'
+                else:
+                    where = f'parameter sets {total_sets}-{total_sets + len(batch) - 1}'
+                raise BatchError(f'Error in batch {number} ({where}): {str(e)}')
+
+            seconds = time.perf_counter() - batch_start
+            batches.append({
+                'batch': number,
+                'parameter_sets': len(batch),
+                'rows': rows,
+                'ms': round(seconds * 1000, 3),
+                'sets_per_second': round(len(batch) / seconds) if seconds else None
+            })
+            total_sets += len(batch)
+            total_rows += rows
+    finally:
+        conn.set_progress_handler(None, 0)
+
+    if not batches:
+        raise ValueError('At least one parameter set is required')
+    seconds = time.perf_counter() - start
+    report = {
+        'statement_type': kind,
+        'batch_size': batch_size,
+        'batches': batches,
+        'totals': {
+            'batches': len(batches),
+            'parameter_sets': total_sets,
+            'rows': total_rows,
+            'seconds': round(seconds, 3),
+            'sets_per_second': round(total_sets / seconds) if seconds else None,
+            'rows_per_second': round(total_rows / seconds) if seconds else None
+        }
+    }
+    if is_query:
+        report['samples'] = samples
+        if return_rows:
+            report['result'] = encode_rows(['parameter_set'] + (columns or []), result_rows)
+            report['truncated'] = truncated
+    return report
+
+# ================== ROUTES ==================
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+# ---------- ANALYZE / OPTIMIZE / EXPLAIN ----------
+
+@app.route('/analyze', methods=['POST'])
+def analyze_query():
+    try:
+        data = request.json
+        query = data.get('query', '')
+        dialect = data.get('dialect', 'PostgreSQL')
+        # Optional: schema + seed data, used only to give the LLM the relevant DDL
+        setup_sql = (data.get('setup_sql') or '').strip()
+        # Similarity cache: "auto" (return or hint by threshold), "hint" (never return cached), "off"
+        cache_mode = data.get('cache', 'auto')
+        # Add ANALYZE statistics of the setup data to the prompt
+        statistics = statistics_requested(data)
+
+        if not query.strip():
+            return jsonify({'error': 'Query cannot be empty'}), 400
+
+        schema_ddl = schema_ddl_from_setup(setup_sql, query, statistics)
+        analyze_prompt = build_analyze_prompt(query, dialect, schema_ddl)
+
+        scope = analysis_scope(dialect, schema_ddl)
+        match = analysis_index.lookup(scope, query) if cache_mode != 'off' else None
+        cache = {'similarity': match[0], 'matched_query': match[1]} if match else None
+
+        # Only returned when wildcards, LIMIT / OFFSET and NULLs match: they change how the query runs
+        if match and cache_mode == 'auto' and match[0] >= SIMILARITY_RETURN_THRESHOLD \
+                and literal_shape(query) == literal_shape(match[1]):
+            metrics_incr('similarity_cache_hits')
+            return jsonify({
+                'success': True,
+                'analysis': match[2],
+                'approximate': True,
+                'cache': {**cache, 'used': 'returned'},
+                'llm_usage': None
+            })
+        if match and match[0] >= SIMILARITY_HINT_THRESHOLD:
+            metrics_incr('similarity_cache_hints')
+            analyze_prompt += similar_analysis_hint(match[1], match[2])
+            cache['used'] = 'hint'
+        else:
+            metrics_incr('similarity_cache_misses')
+
+        analysis = call_llm_json(ANALYZE_SYSTEM_PROMPT, analyze_prompt, 'analysis')
+        if cache_mode != 'off':
+            analysis_index.add(scope, query, analysis)
+
+        return jsonify({
+            'success': True,
+            'analysis': analysis,
+            'approximate': False,
+            'cache': cache,
+            'llm_usage': request_llm_usage()
+        })
+
+    except LLMOutputError as e:
+        return jsonify({'error': f'Failed to parse analysis response: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/optimize', methods=['POST'])
+def optimize_query():
+    try:
+        data = request.json
+        query = data.get('query', '')
+        analysis = data.get('analysis', {})
+        setup_sql = (data.get('setup_sql') or '').strip()
+        mode = data.get('mode', 'single')
+
+        if not query.strip():
+            return jsonify({'error': 'Query cannot be empty'}), 400
+
+        if mode == 'tournament':
+            return optimize_tournament(data, query.strip().rstrip(';'), analysis, setup_sql)
+        if mode == 'rules':
+            return optimize_rules(data, query.strip().rstrip(';'), setup_sql)
+
+        statistics = statistics_requested(data)
+        optimize_prompt = build_optimize_prompt(query, analysis, schema_ddl_from_setup(setup_sql, query, statistics))
+
+        optimized = call_llm_json(OPTIMIZE_SYSTEM_PROMPT, optimize_prompt, 'optimization')
 
         return jsonify({
             'success': True,
-            'optimized': optimized
+            'optimized': optimized,
+            'llm_usage': request_llm_usage()
         })
 
-    except json.JSONDecodeError as e:
+    except LLMOutputError as e:
         return jsonify({'error': f'Failed to parse optimization response: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def optimize_rules(data, query, setup_sql):
+    """
+    /optimize with mode="rules": the deterministic rewrites (REWRITE_RULES)
+    only, no LLM call, verified on setup_sql / base_image when given.
+    "optimized" is the best verified one in the LLM reply's shape (None
+    when no rule applies, none returned the same rows or there was no data
+    to verify them on; "rewrites" still lists them all).
+    """
+    if sqlglot is None:
+        return jsonify({'error': 'Rewrite rules need sqlglot (pip install sqlglot)'}), 400
+    try:
+        rewrites = verified_rewrites(query, data.get('dialect', 'SQLite'), setup_sql, data.get('base_image'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.Error as e:
+        return jsonify({'error': f'Error in setup SQL: {str(e)}'}), 400
+
+    usable = [r for r in rewrites if r['equivalent']]
+    best = next((r for r in usable if r['rule'] == 'combined'), usable[0] if usable else None)
+    optimized = None
+    if best:
+        optimized = {
+            'original': f"{query[:100]}...",
+            'optimized_query': best['optimized_query'],
+            'changes_made': best['notes'],
+            'performance_gain': 'Deterministic rewrite, same rows as the original on your data'
+        }
+    return jsonify({'success': True, 'optimized': optimized, 'rewrites': rewrites})
+
+def optimize_tournament(data, query, analysis, setup_sql):
+    """
+    /optimize with mode="tournament": K candidate rewrites plus local
+    variants, verified for equivalence on the user's data (setup_sql or
+    base_image) and ranked by measured latency on a scaled-up copy.
+    Optional: k (candidates from the LLM), scale (data multiplier), runs.
+    """
+    base_image = data.get('base_image')
+    if not setup_sql and not base_image:
+        return jsonify({'error': 'Tournament mode needs setup_sql or a base_image to measure candidates on'}), 400
+    if not is_read_query(query):
+        return jsonify({'error': 'Tournament mode only supports SELECT / WITH queries'}), 400
+
+    try:
+        k = min(max(int(data.get('k', TOURNAMENT_DEFAULT_K)), 1), TOURNAMENT_MAX_K)
+        scale = max(int(data.get('scale', TOURNAMENT_DEFAULT_SCALE)), 1)
+        runs = min(max(int(data.get('runs', 3)), 1), 15)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k, scale and runs must be integers'}), 400
+    statistics = statistics_requested(data)
+
+    try:
+        tournament = run_tournament(query, analysis, setup_sql, base_image, k, scale, runs, statistics)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueryTimeout as e:
+        return jsonify({'error': f'Original query: {str(e)}'}), 400
+    except sqlite3.Error as e:
+        return jsonify({'error': f'SQL Error: {str(e)}'}), 400
+
+    return jsonify({
+        'success': True,
+        'tournament': tournament,
+        'llm_usage': request_llm_usage()
+    })
+
 @app.route('/explain', methods=['POST'])
 def explain_query():
     try:
@@ -691,247 +5769,902 @@ def explain_query():
         explain_prompt = f"""
 Dialect: {dialect}
 
-Original query:
-{original}
+Original query:
+{original}
+
+Optimized query:
+{optimized}
+
+Explain in markdown format:
+1. What the original query does
+2. What optimizations were made
+3. Why these optimizations improve performance
+4. Any trade-offs to consider
+
+Keep it simple and educational.
+"""
+
+        explanation = call_groq(EXPLAIN_SYSTEM_PROMPT, explain_prompt, "markdown")
+
+        return jsonify({
+            'success': True,
+            'explanation': explanation
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ---------- GENERIC SQL PLAYGROUND (user-provided schema) ----------
+# (You can still keep this if you want step-by-step multi-query execution.)
+
+@app.route('/playground/execute', methods=['POST'])
+def playground_execute():
+    """
+    Execute user-provided setup SQL (schema + seed data) and then a sequence of queries.
+    Returns:
+      - last query result (if SELECT)
+      - affected rows (if non-SELECT)
+      - per-step row deltas (inserted / updated / deleted) and schema changes
+      - snapshot of all tables after all queries (skipped with include_tables=false)
+      - execution statistics per step with stats=true
+    Steps run on the requested engine ("sqlite" default, or "duckdb");
+    row deltas and schema changes are only tracked on SQLite.
+    """
+    try:
+        data = request.json or {}
+        setup_sql = (data.get('setup_sql') or '').strip()
+        base_image = data.get('base_image')
+        queries = data.get('queries') or []
+        include_tables = bool(data.get('include_tables', True))
+        collect_stats = bool(data.get('stats', False))
+
+        if not setup_sql and not base_image:
+            return jsonify({'error': 'Setup SQL (schema + seed data) or a base_image is required'}), 400
+        if not isinstance(queries, list) or len(queries) == 0:
+            return jsonify({'error': 'At least one query is required'}), 400
+
+        # 1) Apply schema + seed data (on top of the base image, if any)
+        try:
+            engine = get_engine(data.get('engine'))
+            conn = engine.open(setup_sql, base_image, copy=True)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except sqlite3.Error as e:
+            return jsonify({'error': f'Error in setup SQL: {str(e)}'}), 400
+
+        last_result = None
+        affected_rows = None
+        last_query_type = None
+        last_query_text = None
+        capture = ChangeCapture(conn) if engine.name == 'sqlite' else None
+        step_changes = []
+
+        # 2) Apply each step query in order
+        for raw_q in queries:
+            q = (raw_q or '').strip()
+            if not q:
+                continue
+            last_query_text = q
+            last_query_type = (statement_keywords(q) or [None])[0]
+
+            stats = engine.stats(conn, q) if collect_stats else None
+            try:
+                if capture:
+                    capture.begin_step(q)
+                with stats or contextlib.nullcontext():
+                    columns, rows, affected_rows = engine.execute(conn, q)
+                last_result = encode_rows(columns, rows) if columns is not None else None
+                changes, schema_changes = capture.collect() if capture else (None, None)
+            except engine.errors as e:
+                conn.close()
+                return jsonify({'error': f'Error in query \"{q}\": {str(e)}'}), 400
+
+            step = {
+                'query': q,
+                'changes': changes,
+                'schema_changes': schema_changes
+            }
+            if stats:
+                step['stats'] = stats.report
+            step_changes.append(step)
+
+        # 3) Snapshot all tables
+        tables = engine.snapshot(conn) if include_tables else None
+
+        conn.close()
+
+        return payload_response({
+            'success': True,
+            'engine': engine.name,
+            'last_query_type': last_query_type,
+            'last_query_text': last_query_text,
+            'result': last_result,
+            'affected_rows': affected_rows,
+            'step_changes': step_changes,
+            'tables': tables
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ---------- PLAYGROUND SESSIONS (incremental steps) ----------
+
+@app.route('/playground/sessions', methods=['POST'])
+def create_playground_session():
+    """
+    Start a session from setup SQL. Later steps are sent one at a time to
+    /playground/sessions/<id>/steps and run against the live database.
+    """
+    try:
+        data = request.json or {}
+        setup_sql = (data.get('setup_sql') or '').strip()
+        base_image = data.get('base_image')
+
+        if not setup_sql and not base_image:
+            return jsonify({'error': 'Setup SQL (schema + seed data) or a base_image is required'}), 400
+
+        try:
+            session = playground_sessions.create(setup_sql, base_image)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except sqlite3.Error as e:
+            return jsonify({'error': f'Error in setup SQL: {str(e)}'}), 400
+
+        with session.lock:
+            tables = snapshot_tables(session.conn.cursor())
+
+        return payload_response({
+            'success': True,
+            'session_id': session.id,
+            'step': 0,
+            'tables': tables
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/playground/sessions/<session_id>/steps', methods=['POST'])
+def playground_session_step(session_id):
+    try:
+        data = request.json or {}
+        query = (data.get('query') or '').strip()
+        include_tables = bool(data.get('include_tables', False))
+        collect_stats = bool(data.get('stats', False))
+
+        if not query:
+            return jsonify({'error': 'Query cannot be empty'}), 400
+
+        session = playground_sessions.get(session_id)
+        if session is None:
+            return jsonify({'error': 'Playground session not found or expired'}), 404
+
+        with session.lock:
+            if session.closed:
+                return jsonify({'error': 'Playground session not found or expired'}), 404
+            try:
+                result, affected_rows, changes, schema_changes, stats = session.run_step(query, collect_stats)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except sqlite3.Error as e:
+                return jsonify({'error': f'Error in query \"{query}\": {str(e)}'}), 400
+            tables = snapshot_tables(session.conn.cursor()) if include_tables else None
+            step = len(session.steps)
+
+        playground_sessions.enforce_budget()
+
+        return payload_response({
+            'success': True,
+            'session_id': session.id,
+            'step': step,
+            'last_query_type': (statement_keywords(query) or [None])[0],
+            'last_query_text': query,
+            'result': result,
+            'affected_rows': affected_rows,
+            'changes': changes,
+            'schema_changes': schema_changes,
+            'stats': stats,
+            'tables': tables
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/playground/sessions/<session_id>/rollback', methods=['POST'])
+def playground_session_rollback(session_id):
+    try:
+        data = request.json or {}
+        step = data.get('step')
+
+        if not isinstance(step, int):
+            return jsonify({'error': 'step (integer) is required'}), 400
+
+        session = playground_sessions.get(session_id)
+        if session is None:
+            return jsonify({'error': 'Playground session not found or expired'}), 404
+
+        with session.lock:
+            if session.closed:
+                return jsonify({'error': 'Playground session not found or expired'}), 404
+            try:
+                session.rollback(step)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            tables = snapshot_tables(session.conn.cursor())
+
+        return payload_response({
+            'success': True,
+            'session_id': session.id,
+            'step': step,
+            'tables': tables
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/playground/sessions/<session_id>', methods=['GET'])
+def get_playground_session(session_id):
+    session = playground_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Playground session not found or expired'}), 404
+
+    return jsonify({
+        'success': True,
+        'session_id': session.id,
+        'step': len(session.steps),
+        'steps': list(session.steps),
+        'memory_bytes': session.memory_bytes,
+        'idle_seconds': round(time.time() - session.last_used, 1)
+    })
+
+@app.route('/playground/sessions/<session_id>', methods=['DELETE'])
+def delete_playground_session(session_id):
+    if not playground_sessions.delete(session_id):
+        return jsonify({'error': 'Playground session not found or expired'}), 404
+    return jsonify({'success': True})
+
+# ---------- PARAMETERIZED BATCHES ----------
+
+@app.route('/playground/batch', methods=['POST'])
+def playground_batch():
+    """
+    Run one parameterized statement (? / ?N / :name placeholders) for many
+    bind-parameter sets; see run_parameter_batches.
+    JSON body: statement, params (a list of lists, or of objects for named
+    placeholders), and setup_sql / base_image for a throwaway database or
+    session_id to run it as the next step of a playground session.
+    Optional: batch_size, return_rows.
+    Parameter sets can also be streamed as a CSV / TSV / JSONL upload, like
+    /import: multipart field "file" or the raw body, with the other
+    parameters (plus format and header) as form fields or query string.
+    """
+    try:
+        upload = request.files.get('file') if request.files else None
+        if request.is_json:
+            data = request.json or {}
+        else:
+            data = request.form if upload is not None else request.args
+        statement = (data.get('statement') or '').strip().rstrip(';')
+        setup_sql = (data.get('setup_sql') or '').strip()
+        base_image = data.get('base_image')
+        session_id = data.get('session_id')
+        return_rows = str(data.get('return_rows', False)).lower() in ('1', 'true')
+
+        if not statement:
+            return jsonify({'error': 'statement is required'}), 400
+        try:
+            batch_size = min(max(int(data.get('batch_size', BATCH_DEFAULT_SIZE)), 1), BATCH_MAX_SIZE)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'batch_size must be an integer'}), 400
+        if not session_id and not setup_sql and not base_image:
+            return jsonify({'error': 'Setup SQL, a base_image or a session_id is required'}), 400
+
+        if request.is_json:
+            parameter_sets = data.get('params')
+            if not isinstance(parameter_sets, list):
+                return jsonify({'error': 'params must be a list of parameter sets'}), 400
+        else:
+            filename = upload.filename if upload is not None else data.get('filename', '')
+            fmt = (data.get('format') or os.path.splitext(filename or '')[1].lstrip('.') or 'csv').lower()
+            if fmt == 'ndjson':
+                fmt = 'jsonl'
+            if fmt not in IMPORT_FORMATS:
+                return jsonify({'error': f'Unsupported format "{fmt}" (use csv, tsv or jsonl)'}), 400
+            try:
+                parameter_sets = parameter_sets_from_stream(
+                    upload.stream if upload is not None else request.stream, fmt,
+                    data.get('header', 'true').lower() != 'false', has_named_parameters(statement))
+            except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                return jsonify({'error': f'Reading parameters failed: {str(e)}'}), 400
+
+        session = None
+        if session_id:
+            session = playground_sessions.get(session_id)
+            if session is None:
+                return jsonify({'error': 'Playground session not found or expired'}), 404
+        else:
+            try:
+                conn = open_database(setup_sql, base_image, copy=True, isolation_level=None,
+                                     cached_statements=STATEMENT_CACHE_SIZE)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except sqlite3.Error as e:
+                return jsonify({'error': f'Error in setup SQL: {str(e)}'}), 400
+
+        try:
+            if session is not None:
+                with session.lock:
+                    if session.closed:
+                        return jsonify({'error': 'Playground session not found or expired'}), 404
+                    report = session.run_batch(statement, parameter_sets, batch_size, return_rows)
+                    step = len(session.steps)
+                playground_sessions.enforce_budget()
+                report = {'session_id': session.id, 'step': step, **report}
+            else:
+                try:
+                    report = run_parameter_batches(conn, statement, parameter_sets, batch_size,
+                                                   return_rows=return_rows)
+                finally:
+                    conn.close()
+        except (ValueError, BatchError, QueryTimeout, UnicodeDecodeError, csv.Error) as e:
+            return jsonify({'error': str(e)}), 400
+        except sqlite3.Error as e:
+            return jsonify({'error': f'SQL Error: {str(e)}'}), 400
+
+        metrics_incr('batch_parameter_sets', report['totals']['parameter_sets'])
+        return payload_response({'success': True, **report})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ---------- BULK IMPORT / BASE IMAGES ----------
+
+@app.route('/import', methods=['POST'])
+def import_dataset():
+    """
+    Stream a CSV / TSV / JSONL file into a table of a base image.
+    Send the file either as multipart form field "file" or as the raw
+    request body (streamed without buffering). Parameters, as form fields
+    or query string: table, format (csv/tsv/jsonl, default from the file
+    name), header (true/false, CSV/TSV only), image_id (add the table to an
+    existing image instead of creating a new one).
+    Use the returned image_id as base_image in /compile-sql and the playground.
+    """
+    try:
+        upload = request.files.get('file') if request.files else None
+        params = request.form if upload is not None else request.args
+        filename = upload.filename if upload is not None else params.get('filename', '')
+
+        stem, ext = os.path.splitext(os.path.basename(filename or ''))
+        fmt = (params.get('format') or ext.lstrip('.') or 'csv').lower()
+        if fmt == 'ndjson':
+            fmt = 'jsonl'
+        table = (params.get('table') or stem or 'imported').strip()
+        has_header = params.get('header', 'true').lower() != 'false'
+        image_id = params.get('image_id') or None
+
+        if fmt not in IMPORT_FORMATS:
+            return jsonify({'error': f'Unsupported format "{fmt}" (use csv, tsv or jsonl)'}), 400
+
+        stream = upload.stream if upload is not None else request.stream
+        try:
+            summary = import_stream(stream, table, fmt, image_id, has_header)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return jsonify({'error': f'Import failed: {str(e)}'}), 400
+        except sqlite3.Error as e:
+            return jsonify({'error': f'Import failed: {str(e)}'}), 400
+
+        metrics_incr('import_rows', summary['rows'])
+        return jsonify({'success': True, **summary})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-Optimized query:
-{optimized}
+@app.route('/images', methods=['GET'])
+def list_images():
+    images = []
+    if os.path.isdir(IMPORT_DIR):
+        for name in sorted(os.listdir(IMPORT_DIR)):
+            image_id, ext = os.path.splitext(name)
+            if ext == '.db' and IMAGE_ID_RE.match(image_id):
+                images.append(describe_image(image_id))
+    return jsonify({'success': True, 'images': images})
+
+@app.route('/images/<image_id>', methods=['DELETE'])
+def delete_image(image_id):
+    try:
+        path = image_path(image_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not os.path.exists(path):
+        return jsonify({'error': f'Base image "{image_id}" not found'}), 404
+    os.remove(path)
+    return jsonify({'success': True})
+
+# ---------- WORKLOAD (slow-query logs) ----------
+
+@app.route('/workload/slowlog', methods=['POST'])
+def ingest_slowlog():
+    """
+    Stream a PostgreSQL (log_min_duration_statement) or MySQL slow query
+    log, group statements by fingerprint and return the top ones by total
+    time. Send the log as multipart field "file" or as the raw body (.gz
+    is decompressed when the file name ends with it). Parameters, as form
+    fields or query string: format (auto/postgres/mysql), top (default 20),
+    analyze (how many of the top fingerprints to send through
+    analyze + optimize, default 5, 0 to skip).
+    """
+    try:
+        upload = request.files.get('file') if request.files else None
+        params = request.form if upload is not None else request.args
+        filename = upload.filename if upload is not None else params.get('filename', '')
 
-Explain in markdown format:
-1. What the original query does
-2. What optimizations were made
-3. Why these optimizations improve performance
-4. Any trade-offs to consider
+        fmt = (params.get('format') or 'auto').lower()
+        try:
+            top_n = min(max(int(params.get('top', 20)), 1), 200)
+            analyze_n = min(max(int(params.get('analyze', 5)), 0), top_n)
+        except ValueError:
+            return jsonify({'error': 'top and analyze must be integers'}), 400
 
-Keep it simple and educational.
-"""
+        stream = upload.stream if upload is not None else request.stream
+        try:
+            fmt, workload = aggregate_slowlog(open_log_text(stream, filename or ''), fmt)
+        except (ValueError, OSError, EOFError) as e:
+            return jsonify({'error': f'Could not read log: {str(e)}'}), 400
 
-        explanation = call_groq(EXPLAIN_SYSTEM_PROMPT, explain_prompt, "markdown")
+        top = workload.top(top_n)
+        if analyze_n:
+            analyze_workload(top, SLOWLOG_DIALECTS[fmt], analyze_n)
 
         return jsonify({
             'success': True,
-            'explanation': explanation
+            'format': fmt,
+            **workload.summary(),
+            'top': top,
+            'llm_usage': request_llm_usage()
         })
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# ---------- GENERIC SQL PLAYGROUND (user-provided schema) ----------
-# (You can still keep this if you want step-by-step multi-query execution.)
-
-@app.route('/playground/execute', methods=['POST'])
-def playground_execute():
+@app.route('/workload/indexes', methods=['POST'])
+def recommend_indexes():
     """
-    Execute user-provided setup SQL (schema + seed data) and then a sequence of queries.
-    Returns:
-      - last query result (if SELECT)
-      - affected rows (if non-SELECT)
-      - snapshot of all tables after all queries
+    Recommend one index set for a whole workload.
+    Body: setup_sql or base_image, queries (strings or {"query", "weight"}),
+    optional max_indexes (default 5), max_bytes, scale, runs.
     """
     try:
         data = request.json or {}
         setup_sql = (data.get('setup_sql') or '').strip()
-        queries = data.get('queries') or []
+        base_image = data.get('base_image')
 
-        if not setup_sql:
-            return jsonify({'error': 'Setup SQL (schema + seed data) is required'}), 400
-        if not isinstance(queries, list) or len(queries) == 0:
-            return jsonify({'error': 'At least one query is required'}), 400
+        if not setup_sql and not base_image:
+            return jsonify({'error': 'setup_sql or base_image is required'}), 400
 
-        conn = sqlite3.connect(':memory:')
-        cursor = conn.cursor()
+        queries = data.get('queries') or []
+        if not isinstance(queries, list):
+            return jsonify({'error': 'queries must be a list'}), 400
+        workload = []
+        for item in queries:
+            if isinstance(item, str):
+                item = {'query': item}
+            if not isinstance(item, dict) or not isinstance(item.get('query') or '', str):
+                return jsonify({'error': 'Each query must be a string or {"query", "weight"}'}), 400
+            query = (item.get('query') or '').strip().rstrip(';')
+            if not query:
+                continue
+            if not is_read_query(query):
+                return jsonify({'error': f'Only SELECT / WITH queries can be in the workload: {query[:80]}'}), 400
+            try:
+                weight = float(item.get('weight', 1))
+            except (TypeError, ValueError):
+                return jsonify({'error': f'weight must be a number: {query[:80]}'}), 400
+            workload.append({'query': query, 'weight': weight})
+        if not workload:
+            return jsonify({'error': 'queries must contain at least one query'}), 400
+
+        try:
+            max_indexes = max(int(data.get('max_indexes', INDEX_ADVISOR_DEFAULT_MAX_INDEXES)), 0)
+            max_bytes = int(data['max_bytes']) if data.get('max_bytes') is not None else None
+            scale = max(int(data.get('scale', TOURNAMENT_DEFAULT_SCALE)), 1)
+            runs = min(max(int(data.get('runs', 3)), 1), 15)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'max_indexes, max_bytes, scale and runs must be integers'}), 400
 
-        # 1) Apply schema + seed data
         try:
-            cursor.executescript(setup_sql)
+            report = advise_indexes(workload, setup_sql, base_image, max_indexes, max_bytes, scale, runs)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except QueryTimeout as e:
+            return jsonify({'error': str(e)}), 400
         except sqlite3.Error as e:
-            conn.close()
-            return jsonify({'error': f'Error in setup SQL: {str(e)}'}), 400
+            return jsonify({'error': f'SQL Error: {str(e)}'}), 400
 
-        last_result = None
-        affected_rows = None
-        last_query_type = None
-        last_query_text = None
+        return jsonify({'success': True, **report})
 
-        # 2) Apply each step query in order
-        for raw_q in queries:
-            q = (raw_q or '').strip()
-            if not q:
-                continue
-            last_query_text = q
-            last_query_type = q.split()[0].upper()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-            try:
-                cursor.execute(q)
-            except sqlite3.Error as e:
-                conn.close()
-                return jsonify({'error': f'Error in query \"{q}\": {str(e)}'}), 400
+@app.route('/workload/schema-change', methods=['POST'])
+def schema_change_report():
+    """
+    Which workload queries get slower (or break) with a schema change.
+    Body: old_setup_sql, new_setup_sql (optionally on top of base_image),
+    queries (strings or {"query", "weight", "new_query"}), optional scale,
+    runs, min_slowdown, min_delta_ms.
+    """
+    try:
+        data = request.json or {}
+        old_setup_sql = (data.get('old_setup_sql') or '').strip()
+        new_setup_sql = (data.get('new_setup_sql') or '').strip()
+        base_image = data.get('base_image')
 
-            if cursor.description is not None:
-                cols = [d[0] for d in cursor.description]
-                rows = cursor.fetchall()
-                last_result = {
-                    'columns': cols,
-                    'rows': rows
-                }
-                affected_rows = None
-            else:
-                affected_rows = cursor.rowcount
-                last_result = None
+        if not old_setup_sql or not new_setup_sql:
+            return jsonify({'error': 'old_setup_sql and new_setup_sql are required'}), 400
 
-        # 3) Snapshot all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-        tables = {}
-        for (table_name,) in cursor.fetchall():
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            cols_meta = cursor.fetchall()
-            col_names = [c[1] for c in cols_meta]  # name
-            cursor.execute(f"SELECT * FROM {table_name}")
-            rows = cursor.fetchall()
-            tables[table_name] = {
-                'columns': col_names,
-                'rows': rows
-            }
+        queries = data.get('queries') or []
+        if not isinstance(queries, list):
+            return jsonify({'error': 'queries must be a list'}), 400
+        workload = []
+        for item in queries:
+            if isinstance(item, str):
+                item = {'query': item}
+            if (not isinstance(item, dict) or not isinstance(item.get('query') or '', str)
+                    or not isinstance(item.get('new_query') or '', str)):
+                return jsonify({'error': 'Each query must be a string or {"query", "weight", "new_query"}'}), 400
+            query = (item.get('query') or '').strip().rstrip(';')
+            new_query = (item.get('new_query') or '').strip().rstrip(';')
+            if not query:
+                continue
+            for sql in filter(None, (query, new_query)):
+                if not is_read_query(sql):
+                    return jsonify({'error': f'Only SELECT / WITH queries can be in the workload: {sql[:80]}'}), 400
+            try:
+                weight = float(item.get('weight', 1))
+            except (TypeError, ValueError):
+                return jsonify({'error': f'weight must be a number: {query[:80]}'}), 400
+            workload.append({'query': query, 'weight': weight, 'new_query': new_query})
+        if not workload:
+            return jsonify({'error': 'queries must contain at least one query'}), 400
 
-        conn.close()
+        try:
+            scale = max(int(data.get('scale', 1)), 1)
+            runs = min(max(int(data.get('runs', 3)), 1), 15)
+            min_slowdown = float(data.get('min_slowdown', SCHEMA_CHANGE_MIN_SLOWDOWN))
+            min_delta_ms = float(data.get('min_delta_ms', SCHEMA_CHANGE_MIN_DELTA_MS))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'scale and runs must be integers, min_slowdown and min_delta_ms numbers'}), 400
 
-        return jsonify({
-            'success': True,
-            'last_query_type': last_query_type,
-            'last_query_text': last_query_text,
-            'result': last_result,
-            'affected_rows': affected_rows,
-            'tables': tables
-        })
+        try:
+            report = schema_change_impact(workload, old_setup_sql, new_setup_sql, base_image,
+                                          scale, runs, min_slowdown, min_delta_ms)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return jsonify({'success': True, **report})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.cli.command('ingest-slowlog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'postgres', 'mysql']), default='auto')
+@click.option('--top', 'top_n', default=20, show_default=True, help='Fingerprints to report')
+@click.option('--analyze', 'analyze_n', default=0, show_default=True, help='Top fingerprints to send to the LLM')
+@click.option('--output', type=click.Path(dir_okay=False), help='Also write the full report as JSON')
+def ingest_slowlog_command(path, fmt, top_n, analyze_n, output):
+    """Aggregate a PostgreSQL / MySQL slow query log by query fingerprint."""
+    with open(path, 'rb') as f:
+        fmt, workload = aggregate_slowlog(open_log_text(f, path), fmt)
+    top = workload.top(top_n)
+    if analyze_n:
+        analyze_workload(top, SLOWLOG_DIALECTS[fmt], min(analyze_n, top_n))
+
+    summary = workload.summary()
+    click.echo(f"{fmt}: {summary['statements']} statements, {summary['fingerprints']} fingerprints, "
+               f"{summary['total_ms'] / 1000:.1f}s total")
+    for entry in top:
+        click.echo(f"{entry['total_ms']:>12.1f} ms {entry['count']:>8}x {entry['avg_ms']:>10.1f} ms avg  "
+                   f"{entry['fingerprint'][:100]}")
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'format': fmt, **summary, 'top': top}, f, indent=2)
+        click.echo(f'Report written to {output}')
+
 # ---------- NEW: SQL COMPILER (user schema + query + optimization) ----------
 
+def start_compile(data):
+    """
+    Validate a /compile-sql request, build its database and run the query
+    on the requested engine. Returns (engine, conn, query, dialect, mode,
+    schema_ddl, executed, stats) where executed is engine.execute's
+    (columns, rows, affected); raises ValueError with a user-facing message
+    on bad input or SQL errors.
+    """
+    setup_sql = (data.get('setup_sql') or '').strip()
+    query = (data.get('query') or '').strip()
+    dialect = data.get('dialect', 'PostgreSQL')
+    mode = data.get('mode') or COMPILE_MODE
+    base_image = data.get('base_image')
+    engine = get_engine(data.get('engine'))
+
+    if not setup_sql and not base_image:
+        raise ValueError('Setup SQL (schema + seed data) or a base_image is required')
+    if not query:
+        raise ValueError('Query cannot be empty')
+    if mode not in ('sequential', 'combined'):
+        raise ValueError('mode must be "sequential" or "combined"')
+
+    try:
+        source = open_database(setup_sql, base_image)
+    except sqlite3.Error as e:
+        raise ValueError(f'Error in setup SQL: {str(e)}')
+
+    # DDL is captured before the query runs, in case it alters the schema. Statistics come from
+    # a separate copy: ANALYZE adds sqlite_stat tables and changes the plans the query would get
+    schema_ddl = schema_ddl_for_query(source.cursor(), query)
+    if schema_ddl and statistics_requested(data):
+        stats_conn = open_database(setup_sql, base_image)
+        try:
+            schema_ddl += statistics_section(stats_conn, query)
+        finally:
+            stats_conn.close()
+    try:
+        copy_on_write(source, query)
+    except sqlite3.Error as e:
+        source.close()
+        raise ValueError(f'SQL Error in query: {str(e)}')
+    conn = engine.adopt(source)
+
+    try:
+        stats = engine.stats(conn, query) if data.get('stats') else None
+        with stats or contextlib.nullcontext():
+            executed = engine.execute(conn, query)
+    except engine.errors as e:
+        conn.close()
+        raise ValueError(f'SQL Error in query: {str(e)}')
+
+    return engine, conn, query, dialect, mode, schema_ddl, executed, stats
+
+def compile_stages(engine, conn, query, dialect, mode, schema_ddl, executed, stats):
+    """
+    Yield (stage, fields) for an executed /compile-sql query as each part is
+    ready: "result" (with "stats" when requested), "tables" (then the
+    database is closed), "analysis" and "optimized".
+    """
+    try:
+        columns, rows, affected_rows = executed
+        result = encode_rows(columns, rows) if columns is not None else None
+        yield 'result', {'result': result, 'affected_rows': affected_rows,
+                         'stats': stats.report if stats else None, 'engine': engine.name}
+
+        # Take snapshot of all tables after query
+        yield 'tables', {'tables': engine.snapshot(conn)}
+    finally:
+        conn.close()
+
+    # Analyze (and optimize) with the LLM
+    if mode == 'combined':
+        analysis, optimized = analyze_and_optimize(query, dialect, schema_ddl)
+        yield 'analysis', {'analysis': analysis}
+    else:
+        analysis = call_llm_json(ANALYZE_SYSTEM_PROMPT, build_analyze_prompt(query, dialect, schema_ddl), 'analysis')
+        yield 'analysis', {'analysis': analysis}
+
+        optimized = None
+        # If optimization needed, call optimizer
+        if analysis.get("needs_optimization", False):
+            optimized = call_llm_json(OPTIMIZE_SYSTEM_PROMPT, build_optimize_prompt(query, analysis, schema_ddl), 'optimization')
+    yield 'optimized', {'optimized': optimized, 'mode': mode}
+
 @app.route('/compile-sql', methods=['POST'])
 def compile_sql():
     """
     User provides:
       - setup_sql: schema + seed data (SQLite compatible)
+      - base_image: (optional) id of an imported dataset to start from
       - query: single SQL query
       - dialect: (optional) for LLM hints, defaults to PostgreSQL
+      - mode: (optional) "sequential" or "combined", defaults to COMPILE_MODE
+      - stats: (optional) true to add execution statistics (see ExecutionStats)
+      - engine: (optional) "sqlite" or "duckdb", defaults to DEFAULT_ENGINE
 
     We:
       1) Build in-memory DB, run setup_sql
-      2) Execute the query and capture result
+      2) Execute the query on the engine and capture result
       3) Analyze the query with Groq
       4) If needs_optimization == true, call optimize and return optimized query + hints
+    In "combined" mode steps 3 and 4 are a single LLM call. Either way the
+    prompts carry only the minified DDL of the tables the query references.
+    """
+    try:
+        try:
+            started = start_compile(request.json or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        payload = {"success": True}
+        for _, fields in compile_stages(*started):
+            payload.update(fields)
+        payload["llm_usage"] = request_llm_usage()
+        return payload_response(payload)
+
+    except LLMOutputError as e:
+        return jsonify({'error': f'Failed to parse Groq JSON: {str(e)}'}), 500
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/compile-sql/stream', methods=['POST'])
+def compile_sql_stream():
+    """
+    Same input as /compile-sql, answered as NDJSON: one line per stage as
+    soon as it is ready ({"stage": "result" | "tables" | "analysis" |
+    "optimized", ...}), then {"stage": "done", "llm_usage": ...}. A failure
+    after the first line arrives as {"stage": "error", "error": ...}.
+    """
+    try:
+        started = start_compile(request.json or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        try:
+            for stage, fields in compile_stages(*started):
+                yield ndjson_line({'stage': stage, **fields})
+            yield ndjson_line({'stage': 'done', 'llm_usage': request_llm_usage()})
+        except LLMOutputError as e:
+            yield ndjson_line({'stage': 'error', 'error': f'Failed to parse Groq JSON: {str(e)}'})
+        except Exception as e:
+            yield ndjson_line({'stage': 'error', 'error': str(e)})
+
+    response = app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# ---------- TABLE STATISTICS ----------
+
+@app.route('/statistics', methods=['POST'])
+def table_statistics():
+    """
+    ANALYZE statistics of a database: row counts, distinct / NULL counts,
+    index selectivity from sqlite_stat1 and histogram samples (sqlite_stat4
+    when available). Body: setup_sql, base_image or question_id; with a
+    query, only the tables it references. "condensed" is the text the
+    analyze / optimize prompts get with "statistics": true.
     """
     try:
         data = request.json or {}
         setup_sql = (data.get('setup_sql') or '').strip()
+        base_image = data.get('base_image')
+        question_id = data.get('question_id')
         query = (data.get('query') or '').strip()
-        dialect = data.get('dialect', 'PostgreSQL')
-
-        if not setup_sql:
-            return jsonify({'error': 'Setup SQL (schema + seed data) is required'}), 400
-        if not query:
-            return jsonify({'error': 'Query cannot be empty'}), 400
 
-        # 1. Build DB and run user's query
-        conn = sqlite3.connect(':memory:')
-        cursor = conn.cursor()
+        if not setup_sql and not base_image and question_id is None:
+            return jsonify({'error': 'setup_sql, base_image or question_id is required'}), 400
 
         try:
-            cursor.executescript(setup_sql)
+            if question_id is not None:
+                # Prebuilt question databases are read-only: analyze an in-memory copy
+                source = open_question_db(question_id)
+                conn = sqlite3.connect(':memory:')
+                source.backup(conn)
+                source.close()
+            else:
+                conn = open_database(setup_sql, base_image)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except sqlite3.Error as e:
-            conn.close()
             return jsonify({'error': f'Error in setup SQL: {str(e)}'}), 400
 
         try:
-            cursor.execute(query)
-        except sqlite3.Error as e:
+            tables = referenced_tables(conn.cursor(), query) if query else None
+            statistics = collect_statistics(conn, tables)
+        finally:
             conn.close()
-            return jsonify({'error': f'SQL Error in query: {str(e)}'}), 400
-
-        result = None
-        affected_rows = None
-        if cursor.description is not None:
-            cols = [d[0] for d in cursor.description]
-            rows = cursor.fetchall()
-            result = {
-                "columns": cols,
-                "rows": rows
-            }
-        else:
-            affected_rows = cursor.rowcount
-
-        # Take snapshot of all tables after query
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-        tables = {}
-        for (table_name,) in cursor.fetchall():
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            cols_meta = cursor.fetchall()
-            col_names = [c[1] for c in cols_meta]
-            cursor.execute(f"SELECT * FROM {table_name}")
-            rows = cursor.fetchall()
-            tables[table_name] = {
-                "columns": col_names,
-                "rows": rows
-            }
-
-        conn.close()
-
-        # 2. Analyze with Groq
-        analyze_prompt = f"""
-You must respond ONLY with valid JSON.
-Dialect: "{dialect}"
 
-SQL query:
-{query}
+        return jsonify({
+            'success': True,
+            'statistics': statistics,
+            'condensed': condensed_statistics(statistics)
+        })
 
-Return JSON in this exact format:
-{{
-  "syntax_issues": ["issue1", "issue2"],
-  "logical_issues": ["issue1"],
-  "performance_issues": ["issue1"],
-  "needs_optimization": true,
-  "overall_assessment": "brief assessment",
-  "hints_for_improvement": ["hint1", "hint2"]
-}}
-"""
-        analysis_json = call_groq(ANALYZE_SYSTEM_PROMPT, analyze_prompt, "json")
-        analysis = json.loads(analysis_json)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        optimized = None
-        # 3. If optimization needed, call optimizer
-        if analysis.get("needs_optimization", False):
-            optimize_prompt = f"""
-You must respond ONLY with valid JSON.
-Original SQL:
-{query}
+# ---------- EXECUTION ENGINES ----------
 
-Detected issues:
-{json.dumps(analysis, indent=2)}
+@app.route('/engines', methods=['GET'])
+def list_engines():
+    return jsonify({
+        'engines': list(EXECUTION_ENGINES),
+        'default': DEFAULT_ENGINE,
+        'duckdb_installed': duckdb is not None
+    })
 
-Generate ONE optimized version in this exact format:
-{{
-  "original": "{query[:100]}...",
-  "optimized_query": "SELECT ...",
-  "changes_made": ["change1", "change2", "change3"],
-  "performance_gain": "Expected improvement description"
-}}
-"""
-            optimized_json = call_groq(OPTIMIZE_SYSTEM_PROMPT, optimize_prompt, "json")
-            optimized = json.loads(optimized_json)
+@app.route('/engines/compare', methods=['POST'])
+def compare_engines():
+    """
+    Run and time one read query on several engines over the same data.
+
+    Input: query, plus setup_sql and/or base_image, or a question_id;
+    optional engines (default: all installed) and runs (default 3).
+    Per engine: load_ms (building / copying the database), median_ms and
+    timings_ms over the runs, row_count, the first rows of the result, or
+    the error; then whether all engines returned the same rows and each
+    engine's speedup over the first one.
+    """
+    try:
+        data = request.json or {}
+        query = (data.get('query') or '').strip().rstrip(';')
+        setup_sql = (data.get('setup_sql') or '').strip()
+        base_image = data.get('base_image')
+        question_id = data.get('question_id')
+        names = data.get('engines') or list(EXECUTION_ENGINES)
 
-        return jsonify({
-            "success": True,
-            "result": result,
-            "affected_rows": affected_rows,
-            "tables": tables,
-            "analysis": analysis,
-            "optimized": optimized
+        if not query:
+            return jsonify({'error': 'Query cannot be empty'}), 400
+        if not is_read_query(query):
+            return jsonify({'error': 'Only SELECT / WITH / VALUES queries can be compared'}), 400
+        if not setup_sql and not base_image and question_id is None:
+            return jsonify({'error': 'setup_sql, base_image or question_id is required'}), 400
+        try:
+            runs = max(1, min(int(data.get('runs', 3)), ENGINE_COMPARE_MAX_RUNS))
+            engines = [get_engine(name) for name in names]
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        results = {}
+        outputs = {}
+        for engine in engines:
+            started = time.perf_counter()
+            try:
+                if question_id is not None:
+                    conn = engine.open_question(question_id)
+                else:
+                    conn = engine.open(setup_sql, base_image)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except sqlite3.Error as e:
+                return jsonify({'error': f'Error in setup SQL: {str(e)}'}), 400
+            entry = {'load_ms': round((time.perf_counter() - started) * 1000, 3)}
+            try:
+                columns, rows, _ = engine.execute(conn, query)
+                timings = []
+                for _ in range(runs):
+                    started = time.perf_counter()
+                    engine.run(conn, query)
+                    timings.append(round((time.perf_counter() - started) * 1000, 3))
+                entry.update({
+                    'median_ms': sorted(timings)[len(timings) // 2],
+                    'timings_ms': timings,
+                    'row_count': len(rows),
+                    'result': encode_rows(columns, rows[:ENGINE_COMPARE_SAMPLE_ROWS])
+                })
+                outputs[engine.name] = comparable_rows(rows)
+            except QueryTimeout as e:
+                entry['error'] = str(e)
+            except engine.errors as e:
+                entry['error'] = f'SQL Error: {str(e)}'
+            finally:
+                conn.close()
+            results[engine.name] = entry
+
+        baseline = results[engines[0].name].get('median_ms')
+        for entry in results.values():
+            if baseline and entry.get('median_ms'):
+                entry['speedup'] = round(baseline / entry['median_ms'], 2)
+        matched = None
+        if len(outputs) == len(engines):
+            first = next(iter(outputs.values()))
+            matched = all(rows == first for rows in outputs.values())
+
+        return payload_response({
+            'success': True,
+            'engines': results,
+            'results_match': matched
         })
 
-    except json.JSONDecodeError as e:
-        return jsonify({'error': f'Failed to parse Groq JSON: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -947,37 +6680,81 @@ def execute_question():
         if not query:
             return jsonify({'error': 'Query cannot be empty'}), 400
 
+        if data.get('mode') == 'scale':
+            return grade_question_at_scale(data, query, question_id)
+
         if not query.upper().startswith('SELECT'):
             return jsonify({'error': 'Only SELECT queries are allowed'}), 400
 
-        conn = init_question_db(question_id)
-        cursor = conn.cursor()
-
-        cursor.execute(query)
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
+        try:
+            engine = get_engine(data.get('engine'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            conn = engine.open_question(question_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
 
-        conn.close()
+        stats = engine.stats(conn, query) if data.get('stats') else None
+        try:
+            with stats or contextlib.nullcontext():
+                columns, rows, _ = engine.execute(conn, query)
+        finally:
+            conn.close()
 
-        return jsonify({
+        payload = {
             'success': True,
-            'columns': columns,
-            'rows': rows,
-            'row_count': len(rows)
-        })
+            **encode_rows(columns, rows),
+            'row_count': len(rows),
+            'engine': engine.name
+        }
+        if stats:
+            payload['stats'] = stats.report
+        return payload_response(payload)
 
-    except sqlite3.Error as e:
+    except ENGINE_ERRORS as e:
         return jsonify({'error': f'SQL Error: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def grade_question_at_scale(data, query, question_id):
+    """
+    /execute-question with mode="scale": run the answer on the question's
+    large generated database under a time and VM-step budget and grade it
+    against the reference solution (see grade_at_scale). Built-in questions
+    on SQLite only. Optional: runs.
+    """
+    if not is_read_query(query):
+        return jsonify({'error': 'Only SELECT / WITH queries are allowed'}), 400
+    if data.get('engine', 'sqlite') != 'sqlite':
+        return jsonify({'error': 'Scale grading counts SQLite VM steps and only runs on the sqlite engine'}), 400
+    try:
+        question_id = int(question_id)
+        runs = min(max(int(data.get('runs', 3)), 1), 5)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Scale grading needs a built-in question id, and runs must be an integer'}), 400
+    if question_id not in PRACTICE_QUESTIONS_BY_ID:
+        return jsonify({'error': f'Unknown question "{question_id}"'}), 404
+
+    try:
+        grading = grade_at_scale(question_id, query, runs)
+    except QueryTimeout as e:
+        # Only the reference's measurement escapes; a slow answer is graded "F"
+        return jsonify({'error': str(e)}), 500
+    except sqlite3.Error as e:
+        return jsonify({'error': f'SQL Error: {str(e)}'}), 400
+    return jsonify({'success': True, 'mode': 'scale', **grading})
+
 @app.route('/get-question-schema', methods=['POST'])
 def get_question_schema():
     try:
         data = request.json
         question_id = data.get('question_id', 1)
 
-        conn = init_question_db(question_id)
+        try:
+            conn = open_question_db(question_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
         cursor = conn.cursor()
 
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -999,14 +6776,11 @@ def get_question_schema():
             cursor.execute(f"SELECT * FROM {table_name}")
             col_names = [description[0] for description in cursor.description]
             rows = cursor.fetchall()
-            table_data[table_name] = {
-                'columns': col_names,
-                'rows': rows
-            }
+            table_data[table_name] = encode_rows(col_names, rows)
 
         conn.close()
 
-        return jsonify({
+        return payload_response({
             'success': True,
             'schema': schema_info,
             'data': table_data
@@ -1019,222 +6793,37 @@ def get_question_schema():
 
 @app.route('/get-practice-questions', methods=['GET'])
 def get_practice_questions():
-    questions = [
-        {
-            "id": 1,
-            "difficulty": "Easy",
-            "title": "Employees Earning More Than Their Managers",
-            "description": "Find the employees who earn more than their managers.",
-            "tables": ["Employee (id, name, salary, managerId)"],
-            "example_output": "name\nJoe",
-            "hint": "Use a self-join to compare employee salary with their manager's salary.",
-            "solution": "SELECT e1.name FROM Employee e1 JOIN Employee e2 ON e1.managerId = e2.id WHERE e1.salary > e2.salary"
-        },
-        {
-            "id": 2,
-            "difficulty": "Easy",
-            "title": "Duplicate Emails",
-            "description": "Report all the duplicate emails.",
-            "tables": ["Person (id, email)"],
-            "example_output": "email\njohn@example.com",
-            "hint": "Use GROUP BY and HAVING COUNT(*) > 1.",
-            "solution": "SELECT email FROM Person GROUP BY email HAVING COUNT(*) > 1"
-        },
-        {
-            "id": 3,
-            "difficulty": "Easy",
-            "title": "Customers Who Never Order",
-            "description": "Find all customers who never order anything.",
-            "tables": ["Customers (id, name)", "Orders (id, customerId)"],
-            "example_output": "Customers\nHenry\nMax",
-            "hint": "Use LEFT JOIN or NOT IN to find customers without orders.",
-            "solution": "SELECT name AS Customers FROM Customers WHERE id NOT IN (SELECT customerId FROM Orders)"
-        },
-        {
-            "id": 4,
-            "difficulty": "Medium",
-            "title": "Second Highest Salary",
-            "description": "Find the second highest salary from the Employee table. If there is no second highest salary, return null.",
-            "tables": ["Employee (id, salary)"],
-            "example_output": "SecondHighestSalary\n200",
-            "hint": "Use DISTINCT, ORDER BY DESC, LIMIT with OFFSET.",
-            "solution": "SELECT (SELECT DISTINCT salary FROM Employee ORDER BY salary DESC LIMIT 1 OFFSET 1) AS SecondHighestSalary"
-        },
-        {
-            "id": 5,
-            "difficulty": "Medium",
-            "title": "Department Highest Salary",
-            "description": "Find employees who have the highest salary in each department.",
-            "tables": ["Employee (id, name, salary, departmentId)", "Department (id, name)"],
-            "example_output": "Department | Employee | Salary\nIT | Max | 90000\nIT | Joe | 85000\nSales | Henry | 80000",
-            "hint": "Use JOIN with a subquery to find max salary per department.",
-            "solution": "SELECT d.name AS Department, e.name AS Employee, e.salary AS Salary FROM Employee e JOIN Department d ON e.departmentId = d.id WHERE (e.departmentId, e.salary) IN (SELECT departmentId, MAX(salary) FROM Employee GROUP BY departmentId)"
-        },
-        {
-            "id": 6,
-            "difficulty": "Medium",
-            "title": "Rising Temperature",
-            "description": "Find the ids for days where the temperature is higher compared to the previous day.",
-            "tables": ["Weather (id, recordDate, temperature)"],
-            "example_output": "id\n2\n4",
-            "hint": "Self-join the table on recordDate-1 day and compare temperatures.",
-            "solution": "SELECT w1.id FROM Weather w1 JOIN Weather w2 ON DATE(w1.recordDate) = DATE(w2.recordDate, '+1 day') WHERE w1.temperature > w2.temperature"
-        },
-        {
-            "id": 7,
-            "difficulty": "Easy",
-            "title": "Delete Duplicate Emails (Identify)",
-            "description": "Identify duplicate emails. Keep only the row with the smallest id.",
-            "tables": ["Person (id, email)"],
-            "example_output": "email | id\njohn@example.com | 3",
-            "hint": "Use MIN(id) GROUP BY email to find which ones to keep.",
-            "solution": "SELECT p1.email, p1.id FROM Person p1 WHERE p1.id NOT IN (SELECT MIN(id) FROM Person GROUP BY email)"
-        },
-        {
-            "id": 8,
-            "difficulty": "Hard",
-            "title": "Rank Scores",
-            "description": "Rank scores from highest to lowest. Ties share the same rank, and the next rank is the next integer.",
-            "tables": ["Scores (id, score)"],
-            "example_output": "score | rank\n4.00 | 1\n4.00 | 1\n3.85 | 2",
-            "hint": "Use DENSE_RANK() or count distinct scores >= current.",
-            "solution": "SELECT score, (SELECT COUNT(DISTINCT score) FROM Scores s2 WHERE s2.score >= s1.score) AS rank FROM Scores s1 ORDER BY score DESC"
-        },
-        {
-            "id": 9,
-            "difficulty": "Medium",
-            "title": "Customers With Multiple Orders Per Month",
-            "description": "Find customers who placed at least 2 orders in the same calendar month.",
-            "tables": ["Customers (id, name)", "Orders (id, customer_id, order_date, amount)"],
-            "example_output": "name | order_month | order_count\nAlice | 2023-01 | 2\nBob | 2023-01 | 2",
-            "hint": "Group by customer and month (use strftime).",
-            "solution": "SELECT c.name, strftime('%Y-%m', o.order_date) AS order_month, COUNT(*) AS order_count FROM Customers c JOIN Orders o ON c.id = o.customer_id GROUP BY c.id, order_month HAVING COUNT(*) >= 2 ORDER BY c.name, order_month"
-        },
-        {
-            "id": 10,
-            "difficulty": "Medium",
-            "title": "Monthly Revenue by Product Category",
-            "description": "Compute total revenue per category per month. Revenue = quantity * price_per_unit.",
-            "tables": ["Products (id, name, category)", "Orders (id, product_id, order_date, quantity, price_per_unit)"],
-            "example_output": "category | month | revenue\nElectronics | 2023-01 | ...",
-            "hint": "Join Orders with Products, group by category and month.",
-            "solution": "SELECT p.category, strftime('%Y-%m', o.order_date) AS month, SUM(o.quantity * o.price_per_unit) AS revenue FROM Products p JOIN Orders o ON p.id = o.product_id GROUP BY p.category, month ORDER BY month, p.category"
-        },
-        {
-            "id": 11,
-            "difficulty": "Hard",
-            "title": "Top 3 Products by Revenue Per Category",
-            "description": "For each category, find up to 3 products with the highest total revenue.",
-            "tables": ["Products (id, name, category)", "OrderItems (id, product_id, quantity, price)"],
-            "example_output": "category | name | revenue | rank\nElectronics | MacBook | ... | 1",
-            "hint": "Aggregate revenue per product and use ROW_NUMBER() over each category.",
-            "solution": "SELECT category, name, revenue, rn AS rank FROM ( SELECT p.category, p.name, SUM(oi.quantity * oi.price) AS revenue, ROW_NUMBER() OVER(PARTITION BY p.category ORDER BY SUM(oi.quantity * oi.price) DESC) AS rn FROM Products p JOIN OrderItems oi ON p.id = oi.product_id GROUP BY p.category, p.name ) t WHERE rn <= 3 ORDER BY category, revenue DESC"
-        },
-        {
-            "id": 12,
-            "difficulty": "Medium",
-            "title": "Churned Users (No Activity in Last 30 Days)",
-            "description": "Assume today is 2023-03-31. Find users who have no events in the last 30 days but had at least one event before that.",
-            "tables": ["Users (id, name, signup_date)", "Events (id, user_id, event_time, event_type)"],
-            "example_output": "name\nBob",
-            "hint": "Find last event date per user and filter by date.",
-            "solution": "WITH last_event AS ( SELECT u.id, u.name, MAX(e.event_time) AS last_time FROM Users u LEFT JOIN Events e ON u.id = e.user_id GROUP BY u.id, u.name ) SELECT name FROM last_event WHERE last_time IS NOT NULL AND last_time < '2023-03-02'"
-        },
-        {
-            "id": 13,
-            "difficulty": "Medium",
-            "title": "Second Highest Salary Per Department",
-            "description": "For each department, find the second highest distinct salary. If it does not exist, return NULL.",
-            "tables": ["Department (id, name)", "Employee (id, name, salary, department_id)"],
-            "example_output": "department | second_highest_salary\nEngineering | 100000\nSales | 75000",
-            "hint": "Use subquery with DISTINCT salary ordered by DESC and OFFSET 1.",
-            "solution": "SELECT d.name AS department, ( SELECT DISTINCT salary FROM Employee e2 WHERE e2.department_id = d.id ORDER BY salary DESC LIMIT 1 OFFSET 1 ) AS second_highest_salary FROM Department d"
-        },
-        {
-            "id": 14,
-            "difficulty": "Medium",
-            "title": "Running Total of Revenue Per User",
-            "description": "For each user and order, compute the running total of revenue ordered by order_date.",
-            "tables": ["Users (id, name)", "Orders (id, user_id, order_date, amount)"],
-            "example_output": "name | order_date | amount | running_total\nAlice | 2023-01-01 | 50 | 50\nAlice | 2023-01-10 | 100 | 150",
-            "hint": "Use SUM(amount) OVER(PARTITION BY user_id ORDER BY order_date).",
-            "solution": "SELECT u.name, o.order_date, o.amount, SUM(o.amount) OVER(PARTITION BY o.user_id ORDER BY o.order_date) AS running_total FROM Users u JOIN Orders o ON u.id = o.user_id ORDER BY u.name, o.order_date"
-        },
-        {
-            "id": 15,
-            "difficulty": "Easy",
-            "title": "Most Recent Order Per Customer",
-            "description": "For each customer, find their most recent order date and amount.",
-            "tables": ["Customers (id, name)", "Orders (id, customer_id, order_date, amount)"],
-            "example_output": "name | order_date | amount\nAlice | 2023-03-01 | 70.0",
-            "hint": "Use ROW_NUMBER() over each customer ordered by date DESC.",
-            "solution": "SELECT name, order_date, amount FROM ( SELECT c.name, o.order_date, o.amount, ROW_NUMBER() OVER(PARTITION BY c.id ORDER BY o.order_date DESC) AS rn FROM Customers c JOIN Orders o ON c.id = o.customer_id ) t WHERE rn = 1 ORDER BY name"
-        },
-        {
-            "id": 16,
-            "difficulty": "Easy",
-            "title": "Daily Active Users (DAU)",
-            "description": "Count distinct active users per day based on Events.",
-            "tables": ["Users (id, name)", "Events (id, user_id, event_date, event_type)"],
-            "example_output": "event_date | dau\n2023-03-01 | 2\n2023-03-02 | 2",
-            "hint": "Count DISTINCT user_id per event_date.",
-            "solution": "SELECT event_date, COUNT(DISTINCT user_id) AS dau FROM Events GROUP BY event_date ORDER BY event_date"
-        },
-        {
-            "id": 17,
-            "difficulty": "Medium",
-            "title": "Conversion from View to Purchase",
-            "description": "Compute the number of users who viewed and also purchased, and the overall conversion rate.",
-            "tables": ["Events (id, user_id, event_time, event_type)"],
-            "example_output": "view_users | purchase_users | converted_users | conversion_rate",
-            "hint": "Find users with view, users with purchase, and their intersection.",
-            "solution": "WITH view_users AS (SELECT DISTINCT user_id FROM Events WHERE event_type = 'view'), purchase_users AS (SELECT DISTINCT user_id FROM Events WHERE event_type = 'purchase'), converted AS (SELECT v.user_id FROM view_users v INNER JOIN purchase_users p ON v.user_id = p.user_id) SELECT (SELECT COUNT(*) FROM view_users) AS view_users, (SELECT COUNT(*) FROM purchase_users) AS purchase_users, (SELECT COUNT(*) FROM converted) AS converted_users, 1.0 * (SELECT COUNT(*) FROM converted) / NULLIF((SELECT COUNT(*) FROM view_users), 0) AS conversion_rate"
-        },
-        {
-            "id": 18,
-            "difficulty": "Hard",
-            "title": "Users with 3 Consecutive Login Days",
-            "description": "Find users who logged in for at least 3 consecutive days.",
-            "tables": ["Logins (id, user_id, login_date)"],
-            "example_output": "user_id\n1\n3",
-            "hint": "Use LAG/LEAD or date difference tricks to detect streaks.",
-            "solution": "WITH ordered AS ( SELECT user_id, login_date, ROW_NUMBER() OVER(PARTITION BY user_id ORDER BY login_date) AS rn FROM Logins ), grouped AS ( SELECT user_id, DATE(login_date, '-' || rn || ' day') AS grp_key FROM ordered ) SELECT DISTINCT user_id FROM grouped GROUP BY user_id, grp_key HAVING COUNT(*) >= 3"
-        },
-        {
-            "id": 19,
-            "difficulty": "Medium",
-            "title": "Average Order Value per User Segment",
-            "description": "Compute average order value per user segment.",
-            "tables": ["Users (id, name, segment)", "Orders (id, user_id, amount)"],
-            "example_output": "segment | avg_order_value\nA | ...\nB | ...",
-            "hint": "Join Users and Orders, group by segment.",
-            "solution": "SELECT u.segment, AVG(o.amount) AS avg_order_value FROM Users u JOIN Orders o ON u.id = o.user_id GROUP BY u.segment"
-        },
-        {
-            "id": 20,
-            "difficulty": "Medium",
-            "title": "First Purchase Date Per Marketing Channel",
-            "description": "For each acquisition channel, find the earliest purchase date among its users.",
-            "tables": ["Users (id, name, channel)", "Orders (id, user_id, order_date, amount)"],
-            "example_output": "channel | first_purchase_date\nAds | 2023-01-10\nOrganic | 2023-01-05",
-            "hint": "Join Users and Orders, group by channel and take MIN(order_date).",
-            "solution": "SELECT u.channel, MIN(o.order_date) AS first_purchase_date FROM Users u JOIN Orders o ON u.id = o.user_id GROUP BY u.channel ORDER BY u.channel"
-        }
-    ]
-
     return jsonify({
         "success": True,
-        "questions": questions
+        "questions": PRACTICE_QUESTIONS
     })
 
-# ---------- EXTERNAL QUESTION SOURCE HOOK (still stub) ----------
+# ---------- METRICS ----------
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    with metrics_lock:
+        counters = dict(METRIC_COUNTERS)
+    return jsonify({
+        'counters': counters,
+        'llm': llm_router.snapshot(),
+        'playground': playground_sessions.snapshot(),
+        'admission': llm_admission.snapshot(),
+        'similarity_cache': analysis_index.snapshot()
+    })
+
+# ---------- EXTERNAL QUESTION SOURCES ----------
 
 @app.route('/get-external-questions', methods=['GET'])
 def get_external_questions():
     """
-    Generic hook to fetch SQL problems from external APIs (e.g., LeetCode-like).
-    You MUST configure EXTERNAL_SQL_SOURCES and map the JSON into the same
-    format used by /get-practice-questions.
+    Questions from an external source (EXTERNAL_SQL_SOURCES), in the
+    /get-practice-questions format with "source:id" ids that
+    /get-question-schema and /execute-question accept like built-in ones.
+    Served from the local cache; a stale copy is returned immediately while
+    it is refreshed in the background ("stale" / "refreshing" say so). The
+    first request for a source waits up to EXTERNAL_FIRST_FETCH_WAIT
+    seconds and answers 202 with no questions if the fetch is still running.
     """
     source = request.args.get('source', 'leetcode')
 
@@ -1242,27 +6831,29 @@ def get_external_questions():
         return jsonify({'error': f'External source \"{source}\" is not configured on the server.'}), 400
 
     try:
-        url = EXTERNAL_SQL_SOURCES[source]
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        raw = resp.json()
-
-        # TODO: Map "raw" to the expected format.
-        questions = []
+        entry, refreshing = external_questions.get(source, wait=EXTERNAL_FIRST_FETCH_WAIT)
+        fetched_at = entry['fetched_at']
+        questions = [{k: v for k, v in q.items() if k != 'setup_sql'} for q in entry['questions']]
 
         return jsonify({
             "success": True,
+            "source": source,
             "questions": questions,
-            "note": "You must implement mapping from the external API response to this format."
-        })
+            "fetched_at": fetched_at,
+            "stale": fetched_at is None or time.time() - fetched_at > EXTERNAL_REFRESH_SECONDS,
+            "refreshing": refreshing,
+            "error": entry['error']
+        }), 200 if fetched_at is not None else 202
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    app.run(
+        debug=os.getenv('FLASK_DEBUG', '1') == '1',
+        port=int(os.getenv('PORT', '5000'))
+    )
 
 
 
@@ -0,0 +1,231 @@
+"""
+Local stand-in for the Groq chat completions API.
+
+Speaks just enough of the OpenAI-compatible protocol for the Groq SDK:
+POST .../chat/completions returns a completion whose content matches the
+JSON format requested in the prompt (analysis and/or optimization fields),
+or a short markdown text otherwise.
+
+Latency is simulated as   --latency-ms + completion_tokens / --tokens-per-sec
+and --error-rate of the requests fail with a 503.
+
+--recordings FILE replays saved replies (benchmarks/optimizer_bench.py
+--record): a prompt containing a recorded query gets that query's recorded
+analysis/optimization instead of the canned one. Recordings with a
+prompt_sha256 (from the app's TRAFFIC_LOG, see benchmarks/replay.py) are
+returned verbatim for exactly that prompt.
+
+Run standalone:
+    python benchmarks/fake_groq.py --port 8081 --latency-ms 300 --tokens-per-sec 250
+then start the app with GROQ_BASE_URL=http://127.0.0.1:8081.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS_REPLY = {
+    "syntax_issues": [],
+    "logical_issues": [],
+    "performance_issues": ["SELECT * reads every column", "No index on the join column"],
+    "needs_optimization": True,
+    "overall_assessment": "Query is correct but scans more data than needed.",
+    "hints_for_improvement": ["Select only the needed columns", "Index the join column"]
+}
+
+OPTIMIZE_REPLY = {
+    "original": "SELECT ...",
+    "optimized_query": "SELECT 1",
+    "changes_made": ["Replaced SELECT * with explicit columns"],
+    "performance_gain": "Less I/O per row"
+}
+
+MARKDOWN_REPLY = (
+    "## What the query does\n\nIt joins two tables.\n\n"
+    "## Why it is faster\n\n- Fewer columns are read\n- The join can use an index\n"
+)
+
+
+def estimate_tokens(text):
+    """Roughly four characters per token, like most BPE tokenizers on English/SQL."""
+    return max(1, len(text) // 4)
+
+
+def find_recording(prompt, recordings):
+    """The recording whose query appears in the prompt (the longest one when several do)."""
+    matches = [r for r in recordings or () if r.get("query") and r["query"] in prompt]
+    return max(matches, key=lambda r: len(r["query"]), default=None)
+
+
+def prompt_sha256(messages):
+    """Same digest the app stores with each recorded LLM reply (app.prompt_digest)."""
+    return hashlib.sha256("\n".join(m.get("content", "") for m in messages).encode("utf-8")).hexdigest()
+
+
+def build_reply(messages, recordings=None):
+    """Pick a reply whose shape matches what the prompt asks for."""
+    prompt = "\n".join(m.get("content", "") for m in messages)
+    recording = find_recording(prompt, recordings)
+    if recording is not None:
+        if '"analysis": {' in prompt:
+            return json.dumps({"analysis": recording.get("analysis"), "optimized": recording.get("optimized")})
+        if '"needs_optimization": true' in prompt and recording.get("analysis") is not None:
+            return json.dumps(recording["analysis"])
+        if '"optimized_query"' in prompt and recording.get("optimized") is not None:
+            return json.dumps(recording["optimized"])
+    if '"candidates": [' in prompt:
+        return json.dumps({"candidates": [
+            {"strategy": "no-op", "optimized_query": "SELECT 1", "changes_made": ["placeholder"]}
+        ]})
+    if '"analysis": {' in prompt:
+        return json.dumps({"analysis": ANALYSIS_REPLY, "optimized": OPTIMIZE_REPLY})
+    reply = {}
+    if '"needs_optimization": true' in prompt:
+        reply.update(ANALYSIS_REPLY)
+    if '"optimized_query"' in prompt:
+        reply.update(OPTIMIZE_REPLY)
+    if reply:
+        return json.dumps(reply)
+    return MARKDOWN_REPLY
+
+
+class FakeGroqServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=300.0, tokens_per_sec=250.0, error_rate=0.0, seed=None, recordings=None):
+        super().__init__(address, FakeGroqHandler)
+        self.recordings = recordings or []
+        self.replies = {r["prompt_sha256"]: r["reply"] for r in self.recordings if "prompt_sha256" in r}
+        self.latency_ms = latency_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "replayed": 0}
+
+    def count(self, **deltas):
+        with self.lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.lock:
+                self.send_json(200, dict(self.server.stats))
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        server = self.server
+        with server.lock:
+            fail = server.random.random() < server.error_rate
+
+        if fail:
+            server.count(requests=1, errors=1)
+            time.sleep(server.latency_ms / 1000.0)
+            self.send_json(503, {"error": {"message": "simulated upstream error", "type": "service_unavailable"}})
+            return
+
+        request_body = json.loads(raw or b"{}")
+        messages = request_body.get("messages", [])
+        content = server.replies.get(prompt_sha256(messages)) if server.replies else None
+        if content is not None:
+            server.count(replayed=1)
+        else:
+            content = build_reply(messages, server.recordings)
+
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        delay = server.latency_ms / 1000.0
+        if server.tokens_per_sec > 0:
+            delay += completion_tokens / server.tokens_per_sec
+        time.sleep(delay)
+
+        server.count(requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self.send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request_body.get("model", "fake-model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+
+def start_fake_groq(host="127.0.0.1", port=0, **options):
+    """Start the fake server on a background thread and return it (server.server_port is the bound port)."""
+    server = FakeGroqServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def load_recordings(path):
+    """Recorded replies from an optimizer_bench.py --record file (a list, or {"recordings": [...]})."""
+    with open(path) as f:
+        data = json.load(f)
+    return data.get("recordings", []) if isinstance(data, dict) else data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Groq-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fixed latency per request")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="simulated generation speed (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--recordings", default=None, help="replies recorded by optimizer_bench.py --record")
+    args = parser.parse_args()
+
+    server = FakeGroqServer(
+        (args.host, args.port),
+        latency_ms=args.latency_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        recordings=load_recordings(args.recordings) if args.recordings else None
+    )
+    print(f"Fake Groq listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
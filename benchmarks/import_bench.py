@@ -0,0 +1,87 @@
+"""
+Measure bulk-import throughput (rows/second) of app.import_stream.
+
+Generates a synthetic orders-like CSV (or JSONL) of the requested size in a
+temporary directory, imports it into a fresh base image and prints rows/s
+and MB/s. The default size is 1 GB; use --size-mb for quicker runs.
+
+    python benchmarks/import_bench.py --size-mb 1024
+    python benchmarks/import_bench.py --size-mb 100 --format jsonl --batch-size 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CITIES = ["New York", "Los Angeles", "Chicago", "Houston", "Phoenix", "Seattle"]
+STATUSES = ["placed", "shipped", "delivered", "returned"]
+
+
+def generate(path, size_mb, fmt, seed=42):
+    """Write rows until the file reaches size_mb; return the row count."""
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    rows = 0
+    with open(path, "w", newline="") as f:
+        if fmt == "csv":
+            f.write("id,customer_id,city,status,amount,order_date\n")
+        while f.tell() < target:
+            lines = []
+            for _ in range(10000):
+                rows += 1
+                record = (rows, rng.randint(1, 500000), rng.choice(CITIES), rng.choice(STATUSES),
+                          round(rng.uniform(1, 2000), 2),
+                          f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")
+                if fmt == "csv":
+                    lines.append("%d,%d,%s,%s,%.2f,%s\n" % record)
+                else:
+                    lines.append(json.dumps(dict(zip(
+                        ["id", "customer_id", "city", "status", "amount", "order_date"], record))) + "\n")
+            f.write("".join(lines))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming CSV/JSONL import")
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--batch-size", type=int, default=None, help="rows per executemany (default IMPORT_BATCH_SIZE)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated file and image")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="import-bench-")
+    os.environ["DATA_DIR"] = workdir
+    sys.path.insert(0, REPO_ROOT)
+    import app  # noqa: E402  (DATA_DIR must be set first)
+
+    source = os.path.join(workdir, f"orders.{args.format}")
+    start = time.perf_counter()
+    generated = generate(source, args.size_mb, args.format)
+    print(f"Generated {generated:,} rows ({os.path.getsize(source) / 1e6:.0f} MB) in {time.perf_counter() - start:.1f}s")
+
+    options = {"batch_size": args.batch_size} if args.batch_size else {}
+    with open(source, "rb") as f:
+        summary = app.import_stream(f, "orders", args.format, **options)
+
+    mb = os.path.getsize(source) / 1e6
+    print(f"Imported {summary['rows']:,} rows in {summary['seconds']}s: "
+          f"{summary['rows_per_second']:,} rows/s, {mb / summary['seconds']:.1f} MB/s")
+    print(f"Column types: {', '.join(c['name'] + ' ' + c['type'] for c in summary['columns'])}")
+    print(f"Image size: {summary['image_bytes'] / 1e6:.0f} MB")
+
+    if args.keep:
+        print(f"Kept files in {workdir}")
+    else:
+        os.remove(source)
+        os.remove(app.image_path(summary["image_id"]))
+        os.rmdir(app.IMPORT_DIR)
+        os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    main()
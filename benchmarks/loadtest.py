@@ -0,0 +1,379 @@
+"""
+Load-test the app against a local fake Groq server.
+
+Starts benchmarks/fake_groq.py in-process, launches app.py pointed at it
+(GROQ_BASE_URL), then drives a weighted mix of endpoints from N concurrent
+workers for a fixed duration. Reports throughput, p50/p95/p99 latency per
+route and the app's RSS, and writes the numbers to a JSON baseline that can
+be diffed against a previous run.
+
+Examples:
+    python benchmarks/loadtest.py --concurrency 16 --duration 30 --label main
+    python benchmarks/loadtest.py --label my-branch --compare benchmarks/results/main.json
+    python benchmarks/loadtest.py --mix execute-question=1 --latency-ms 0
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from fake_groq import start_fake_groq
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+DEFAULT_MIX = "compile-sql=3,execute-question=4,get-question-schema=2,analyze=1"
+
+ROUTES = {
+    "compile-sql": "/compile-sql",
+    "execute-question": "/execute-question",
+    "get-question-schema": "/get-question-schema",
+    "analyze": "/analyze",
+}
+
+COMPILER_QUERIES = [
+    "SELECT * FROM orders WHERE customer_id = 7",
+    "SELECT c.name, COUNT(*) AS n FROM customers c JOIN orders o ON o.customer_id = c.id GROUP BY c.name ORDER BY n DESC",
+    "SELECT p.category, SUM(o.quantity * p.price) AS revenue FROM orders o JOIN products p ON p.id = o.product_id GROUP BY p.category",
+    "SELECT name FROM customers WHERE id IN (SELECT customer_id FROM orders WHERE quantity > 3)",
+]
+
+ANALYZE_QUERIES = COMPILER_QUERIES + [
+    "SELECT DISTINCT c.* FROM customers c, orders o WHERE c.id = o.customer_id AND o.order_date LIKE '2024%'",
+]
+
+
+def build_sample_schema(customers=50, products=20, orders=300, seed=7):
+    """Schema + seed data similar in size to what users paste into the compiler."""
+    rng = random.Random(seed)
+    cities = ["New York", "Los Angeles", "Chicago", "Houston", "Phoenix"]
+    categories = ["Electronics", "Furniture", "Books", "Apparel"]
+    parts = [
+        "CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL, category TEXT, price REAL, stock INTEGER);",
+        "CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT NOT NULL, email TEXT UNIQUE, city TEXT);",
+        "CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER, product_id INTEGER, quantity INTEGER, order_date DATE);",
+    ]
+    for i in range(1, products + 1):
+        parts.append(f"INSERT INTO products VALUES ({i}, 'Product {i}', '{rng.choice(categories)}', {rng.randint(5, 2000)}.0, {rng.randint(0, 100)});")
+    for i in range(1, customers + 1):
+        parts.append(f"INSERT INTO customers VALUES ({i}, 'Customer {i}', 'c{i}@example.com', '{rng.choice(cities)}');")
+    for i in range(1, orders + 1):
+        parts.append(
+            f"INSERT INTO orders VALUES ({i}, {rng.randint(1, customers)}, {rng.randint(1, products)}, "
+            f"{rng.randint(1, 5)}, '2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}');"
+        )
+    return "\n".join(parts)
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise SystemExit(f"Unknown route in --mix: {name} (choose from {', '.join(ROUTES)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    errors = sum(1 for s in statuses if s is None or s >= 400)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(ordered) / len(ordered), 2) if ordered else None,
+        "p50_ms": round(percentile(ordered, 50), 2) if ordered else None,
+        "p95_ms": round(percentile(ordered, 95), 2) if ordered else None,
+        "p99_ms": round(percentile(ordered, 99), 2) if ordered else None,
+        "max_ms": round(ordered[-1], 2) if ordered else None,
+    }
+
+
+def read_rss_bytes(pid):
+    """RSS of the app process, including worker children when psutil is available."""
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            return proc.memory_info().rss + sum(c.memory_info().rss for c in proc.children(recursive=True))
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            rss = read_rss_bytes(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self.stop_event.wait(self.interval)
+
+    def summary(self):
+        if not self.samples:
+            return {"start_mb": None, "peak_mb": None, "end_mb": None}
+        mb = 1024 * 1024
+        return {
+            "start_mb": round(self.samples[0] / mb, 1),
+            "peak_mb": round(max(self.samples) / mb, 1),
+            "end_mb": round(self.samples[-1] / mb, 1),
+        }
+
+
+class Workload:
+    """Builds request bodies for each route."""
+
+    def __init__(self, questions):
+        self.schema = build_sample_schema()
+        self.questions = questions
+
+    def body(self, route, rng):
+        if route == "compile-sql":
+            return {"setup_sql": self.schema, "query": rng.choice(COMPILER_QUERIES), "dialect": "SQLite"}
+        if route == "execute-question":
+            q = rng.choice(self.questions)
+            return {"question_id": q["id"], "query": q["solution"]}
+        if route == "get-question-schema":
+            return {"question_id": rng.choice(self.questions)["id"]}
+        return {"query": rng.choice(ANALYZE_QUERIES), "dialect": rng.choice(["PostgreSQL", "MySQL", "SQLite"])}
+
+
+def post_json(conn, path, body, headers=None):
+    payload = json.dumps(body).encode("utf-8")
+    all_headers = {"Content-Type": "application/json"}
+    all_headers.update(headers or {})
+    conn.request("POST", path, body=payload, headers=all_headers)
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def worker(port, mix, workload, deadline, seed, records, headers):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    local = []
+    while time.perf_counter() < deadline:
+        route = rng.choices(names, weights)[0]
+        body = workload.body(route, rng)
+        start = time.perf_counter()
+        try:
+            status = post_json(conn, ROUTES[route], body, headers)
+        except (OSError, http.client.HTTPException):
+            status = None
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        local.append((route, status, (time.perf_counter() - start) * 1000.0))
+    conn.close()
+    records.extend(local)
+
+
+def wait_until_ready(port, proc, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"App exited early with code {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/get-practice-questions")
+            response = conn.getresponse()
+            data = response.read()
+            conn.close()
+            if response.status == 200:
+                return json.loads(data)["questions"]
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    raise SystemExit("App did not become ready in time")
+
+
+def run_phase(port, mix, workload, concurrency, seconds, seed, headers):
+    records = []
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=worker, args=(port, mix, workload, deadline, seed + i, records, headers))
+        for i in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return records, time.perf_counter() - started
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def pct(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nComparison against {baseline_path} ({baseline.get('label')}):")
+    print(f"{'route':<22}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    rows = [("overall", current["overall"], baseline["overall"])]
+    for route, stats in current["routes"].items():
+        if route in baseline.get("routes", {}):
+            rows.append((route, stats, baseline["routes"][route]))
+    for name, new, old in rows:
+        print(f"{name:<22}{pct(new['throughput_rps'], old['throughput_rps']):>10}"
+              f"{pct(new['p50_ms'], old['p50_ms']):>10}{pct(new['p95_ms'], old['p95_ms']):>10}"
+              f"{pct(new['p99_ms'], old['p99_ms']):>10}")
+    new_rss, old_rss = current["rss"]["peak_mb"], baseline.get("rss", {}).get("peak_mb")
+    print(f"{'peak RSS':<22}{pct(new_rss, old_rss):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test app.py against a fake Groq server")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before the run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"route=weight list (default {DEFAULT_MIX})")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fake Groq fixed latency")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="fake Groq generation speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake Groq 503 rate")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--header", action="append", default=[], help="extra request header, e.g. X-Result-Format:columnar")
+    parser.add_argument("--app-cmd", default=None,
+                        help="command to start the app; {port} is substituted (default: python app.py)")
+    parser.add_argument("--label", default=None, help="name of the baseline file to write")
+    parser.add_argument("--output", default=None, help="explicit output path (overrides --label)")
+    parser.add_argument("--compare", default=None, help="baseline JSON to diff against")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    headers = dict(h.split(":", 1) for h in args.header)
+    headers = {k.strip(): v.strip() for k, v in headers.items()}
+
+    fake = start_fake_groq(
+        latency_ms=args.latency_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "GROQ_API_KEY": "fake-key",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{fake.server_port}",
+        "PORT": str(port),
+        "FLASK_DEBUG": "0",
+    })
+    # Measure the server, not the per-client rate limit (every worker shares one address)
+    env.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    if args.app_cmd:
+        cmd = shlex.split(args.app_cmd.format(port=port))
+    else:
+        cmd = [sys.executable, os.path.join(REPO_ROOT, "app.py")]
+
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        questions = wait_until_ready(port, proc)
+        workload = Workload(questions)
+
+        if args.warmup > 0:
+            run_phase(port, mix, workload, args.concurrency, args.warmup, args.seed + 10000, headers)
+
+        sampler = RSSSampler(proc.pid)
+        sampler.start()
+        records, elapsed = run_phase(port, mix, workload, args.concurrency, args.duration, args.seed, headers)
+        sampler.stop_event.set()
+        sampler.join()
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.shutdown()
+
+    routes = {}
+    for route in mix:
+        subset = [r for r in records if r[0] == route]
+        routes[route] = summarize([r[2] for r in subset], [r[1] for r in subset], elapsed)
+
+    label = args.label or datetime.now().strftime("run-%Y%m%d-%H%M%S")
+    result = {
+        "label": label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "mix": mix,
+            "fake_groq": {
+                "latency_ms": args.latency_ms,
+                "tokens_per_sec": args.tokens_per_sec,
+                "error_rate": args.error_rate,
+            },
+            "headers": headers,
+            "app_cmd": cmd,
+        },
+        "overall": summarize([r[2] for r in records], [r[1] for r in records], elapsed),
+        "routes": routes,
+        "rss": sampler.summary(),
+        "fake_groq_stats": dict(fake.stats),
+    }
+
+    print(f"{'route':<22}{'reqs':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, stats in [("overall", result["overall"])] + list(routes.items()):
+        print(f"{name:<22}{stats['requests']:>8}{stats['errors']:>6}{stats['throughput_rps'] or 0:>9}"
+              f"{stats['p50_ms'] or 0:>9}{stats['p95_ms'] or 0:>9}{stats['p99_ms'] or 0:>9}")
+    print(f"RSS MB start/peak/end: {result['rss']['start_mb']} / {result['rss']['peak_mb']} / {result['rss']['end_mb']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved baseline to {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Score the LLM optimizer on a fixed corpus of slow queries.
+
+Each case in benchmarks/optimizer_corpus.json is a deliberately slow (but
+correct) query over one of the practice-question schemas. The runner grows
+the question's seed data with app.populate_synthetic, sends the query
+through the same analyze -> optimize prompts the app uses (or the combined
+single-call prompt with --pipeline combined), then measures the rewrite:
+
+- equivalence: same rows as the original on the synthetic data
+- speedup: median time of the original / median time of the rewrite
+- plan: EXPLAIN QUERY PLAN before and after
+- LLM latency and prompt/completion tokens
+
+Per-case score: 0 when there is no usable equivalent rewrite, otherwise
+0.25 + 0.75 * min(1, log10(speedup)) (a 10x speedup scores 1). The run's
+score is the mean * 100 and is written with everything else to
+benchmarks/results/<label>.json.
+
+LLM sources:
+    --llm fake      the canned replies of benchmarks/fake_groq.py (plumbing check)
+    --llm replay    replies recorded earlier with --record (deterministic, offline)
+    --llm live      whatever .env configures (GROQ_API_KEY / LOCAL_LLM_URL)
+
+Examples:
+    python benchmarks/optimizer_bench.py --llm live --record benchmarks/recordings/main.json --label main
+    python benchmarks/optimizer_bench.py --llm replay --recordings benchmarks/recordings/main.json
+    python benchmarks/optimizer_bench.py --llm live --label my-prompt --compare benchmarks/results/main.json \\
+        --min-equivalence 0.9 --max-regression 5
+
+Gates (--min-score, --min-equivalence, --max-regression) make the script
+exit with status 1 when they fail, so it can run in CI.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime
+
+from fake_groq import load_recordings, start_fake_groq
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+DEFAULT_CORPUS = os.path.join(REPO_ROOT, "benchmarks", "optimizer_corpus.json")
+
+LLM_COUNTERS = ("llm_calls", "llm_prompt_tokens", "llm_completion_tokens")
+
+
+def case_score(equivalent, speedup):
+    if not equivalent or not speedup:
+        return 0.0
+    return round(0.25 + 0.75 * min(1.0, max(0.0, math.log10(speedup))), 4)
+
+
+def ask_optimizer(app, query, pipeline, schema_ddl):
+    """(analysis, optimized-or-None) from the LLM, the way the app's routes ask."""
+    if pipeline == "combined":
+        return app.analyze_and_optimize(query, "SQLite", schema_ddl)
+    analysis = app.call_llm_json(app.ANALYZE_SYSTEM_PROMPT,
+                                 app.build_analyze_prompt(query, "SQLite", schema_ddl), "analysis")
+    if not analysis.get("needs_optimization", False):
+        return analysis, None
+    optimized = app.call_llm_json(app.OPTIMIZE_SYSTEM_PROMPT,
+                                  app.build_optimize_prompt(query, analysis, schema_ddl), "optimization")
+    return analysis, optimized
+
+
+def run_case(app, case, args):
+    query = case["query"]
+    conn = app.init_question_db(case["question_id"])
+    app.populate_synthetic(conn, case["rows"], seed=args.seed)
+    schema_ddl = app.schema_ddl_for_query(conn.cursor(), query)
+    result = {"id": case["id"], "anti_pattern": case.get("anti_pattern"), "rows": case["rows"]}
+
+    expected = app.normalized_rows(app.run_with_timeout(conn, query, args.timeout))
+    result["original_ms"] = app.time_query(conn, query, args.runs, args.timeout)
+    result["plan_before"] = app.query_plan(conn, query)
+
+    before = {name: app.METRIC_COUNTERS[name] for name in LLM_COUNTERS}
+    started = time.perf_counter()
+    try:
+        analysis, optimized = ask_optimizer(app, query, args.pipeline, schema_ddl)
+    except Exception as e:
+        analysis, optimized = None, None
+        result["error"] = f"LLM: {e}"
+    result["llm"] = {
+        "latency_ms": round((time.perf_counter() - started) * 1000),
+        "calls": app.METRIC_COUNTERS["llm_calls"] - before["llm_calls"],
+        "prompt_tokens": app.METRIC_COUNTERS["llm_prompt_tokens"] - before["llm_prompt_tokens"],
+        "completion_tokens": app.METRIC_COUNTERS["llm_completion_tokens"] - before["llm_completion_tokens"],
+    }
+    result["recording"] = {"query": query, "analysis": analysis, "optimized": optimized}
+
+    candidate = ((optimized or {}).get("optimized_query") or "").strip().rstrip(";")
+    result["optimized_query"] = candidate or None
+    result["equivalent"] = False
+    result["speedup"] = None
+    if "error" in result:
+        result["status"] = "llm_error"
+    elif not candidate:
+        result["status"] = "not_optimized"
+    else:
+        try:
+            result["equivalent"] = app.results_equivalent(conn, query, candidate, expected)
+            result["status"] = "equivalent" if result["equivalent"] else "different_results"
+            if result["equivalent"]:
+                result["optimized_ms"] = app.time_query(conn, candidate, args.runs, args.timeout)
+                result["speedup"] = round(result["original_ms"] / max(result["optimized_ms"], 0.001), 2)
+                result["plan_after"] = app.query_plan(conn, candidate)
+                result["plan_changed"] = result["plan_after"] != result["plan_before"]
+        except app.QueryTimeout as e:
+            result["status"], result["error"] = "timeout", str(e)
+        except Exception as e:
+            result["status"], result["error"] = "sql_error", str(e)
+    conn.close()
+
+    result["score"] = case_score(result["equivalent"], result["speedup"])
+    return result
+
+
+def summarize(cases):
+    rewritten = [c for c in cases if c["optimized_query"]]
+    speedups = [c["speedup"] for c in cases if c["speedup"]]
+    return {
+        "cases": len(cases),
+        "score": round(100 * sum(c["score"] for c in cases) / len(cases), 2) if cases else 0.0,
+        "rewritten": len(rewritten),
+        "equivalent": sum(1 for c in cases if c["equivalent"]),
+        "equivalence_rate": round(sum(1 for c in rewritten if c["equivalent"]) / len(rewritten), 4) if rewritten else 0.0,
+        "geomean_speedup": round(math.exp(sum(math.log(s) for s in speedups) / len(speedups)), 2) if speedups else None,
+        "llm_latency_ms": sum(c["llm"]["latency_ms"] for c in cases),
+        "prompt_tokens": sum(c["llm"]["prompt_tokens"] for c in cases),
+        "completion_tokens": sum(c["llm"]["completion_tokens"] for c in cases),
+    }
+
+
+def compare(current, baseline):
+    """Print per-case score changes; return the aggregate score delta."""
+    old_cases = {c["id"]: c for c in baseline.get("cases", [])}
+    print(f"\nComparison against {baseline.get('label')}:")
+    print(f"{'case':<40}{'score':>9}{'was':>9}{'speedup':>10}{'was':>10}")
+    for case in current["cases"]:
+        old = old_cases.get(case["id"])
+        if old is None:
+            continue
+        marker = "  <- lost equivalence" if old["equivalent"] and not case["equivalent"] else ""
+        print(f"{case['id']:<40}{case['score']:>9}{old['score']:>9}"
+              f"{case['speedup'] or '-':>10}{old['speedup'] or '-':>10}{marker}")
+    delta = current["summary"]["score"] - baseline["summary"]["score"]
+    print(f"{'overall':<40}{current['summary']['score']:>9}{baseline['summary']['score']:>9}   ({delta:+.2f})")
+    return delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LLM optimizer on a corpus of slow queries")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--cases", default=None, help="comma-separated case ids (or id prefixes) to run")
+    parser.add_argument("--llm", choices=["fake", "replay", "live"], default="fake")
+    parser.add_argument("--recordings", default=None, help="recorded replies for --llm replay")
+    parser.add_argument("--record", default=None, help="save this run's LLM replies for later --llm replay")
+    parser.add_argument("--pipeline", choices=["two-step", "combined"], default="two-step",
+                        help="analyze then optimize (two LLM calls) or the combined single call")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per query (median is used)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a query run is aborted")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic data seed")
+    parser.add_argument("--label", default=None, help="name of the results file to write")
+    parser.add_argument("--output", default=None, help="explicit output path (overrides --label)")
+    parser.add_argument("--compare", default=None, help="previous results JSON to diff against")
+    parser.add_argument("--min-score", type=float, default=None, help="fail below this aggregate score (0-100)")
+    parser.add_argument("--min-equivalence", type=float, default=None,
+                        help="fail when fewer than this fraction of rewrites are equivalent (0-1)")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="fail when the score drops more than this many points below --compare")
+    args = parser.parse_args()
+
+    if args.llm == "replay" and not args.recordings:
+        parser.error("--llm replay needs --recordings")
+    if args.max_regression is not None and not args.compare:
+        parser.error("--max-regression needs --compare")
+
+    fake = None
+    if args.llm != "live":
+        recordings = load_recordings(args.recordings) if args.llm == "replay" else None
+        fake = start_fake_groq(latency_ms=0, tokens_per_sec=0, recordings=recordings)
+        # The environment wins over .env, so this pins the app to the fake server
+        os.environ.update({
+            "GROQ_API_KEY": "fake-key",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{fake.server_port}",
+            "LOCAL_LLM_URL": "",
+        })
+    sys.path.insert(0, REPO_ROOT)
+    import app  # noqa: E402  (the LLM environment must be set first)
+
+    with open(args.corpus) as f:
+        corpus = json.load(f)
+    cases = corpus["cases"]
+    if args.cases:
+        wanted = [c.strip() for c in args.cases.split(",") if c.strip()]
+        cases = [c for c in cases if any(c["id"].startswith(w) for w in wanted)]
+    if not cases:
+        parser.error("no matching cases")
+
+    results = []
+    try:
+        for case in cases:
+            result = run_case(app, case, args)
+            results.append(result)
+            print(f"{result['id']:<40}{result['status']:<18}score {result['score']:<7}"
+                  f"{result['original_ms']:>9.1f} ms -> "
+                  f"{result.get('optimized_ms', float('nan')):>9.1f} ms   llm {result['llm']['latency_ms']} ms")
+    finally:
+        if fake is not None:
+            fake.shutdown()
+
+    label = args.label or datetime.now().strftime("optimizer-%Y%m%d-%H%M%S")
+    report = {
+        "label": label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "corpus": os.path.relpath(args.corpus, REPO_ROOT),
+            "corpus_version": corpus.get("version"),
+            "llm": args.llm,
+            "pipeline": args.pipeline,
+            "runs": args.runs,
+            "seed": args.seed,
+        },
+        "summary": summarize(results),
+        "cases": [{k: v for k, v in r.items() if k != "recording"} for r in results],
+    }
+    summary = report["summary"]
+    print(f"\nScore {summary['score']} over {summary['cases']} cases: {summary['equivalent']} equivalent, "
+          f"{summary['rewritten']} rewritten, equivalence rate {summary['equivalence_rate']}, "
+          f"geomean speedup {summary['geomean_speedup']}, "
+          f"tokens {summary['prompt_tokens']} + {summary['completion_tokens']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}")
+
+    if args.record:
+        os.makedirs(os.path.dirname(os.path.abspath(args.record)), exist_ok=True)
+        with open(args.record, "w") as f:
+            json.dump({"label": label, "recordings": [r["recording"] for r in results]}, f, indent=2)
+        print(f"Saved {len(results)} recordings to {args.record}")
+
+    failures = []
+    if args.min_score is not None and summary["score"] < args.min_score:
+        failures.append(f"score {summary['score']} < {args.min_score}")
+    if args.min_equivalence is not None and summary["equivalence_rate"] < args.min_equivalence:
+        failures.append(f"equivalence rate {summary['equivalence_rate']} < {args.min_equivalence}")
+    if args.compare:
+        with open(args.compare) as f:
+            delta = compare(report, json.load(f))
+        if args.max_regression is not None and delta < -args.max_regression:
+            failures.append(f"score dropped {-delta:.2f} points (allowed {args.max_regression})")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
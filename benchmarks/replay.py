@@ -0,0 +1,360 @@
+"""
+Replay traffic recorded by the app (TRAFFIC_LOG) against a build of it.
+
+Starts benchmarks/fake_groq.py loaded with the LLM replies captured in the
+recording (so every prompt the build sends again gets the reply it got in
+production), launches the app pointed at it and re-sends the recorded
+requests with their original spacing divided by --speed (--speed 0 sends
+them back to back from --concurrency workers). Playground session ids are
+mapped to the ones the replayed build creates, and requests on one session
+keep their order. Records the app marked "replayable": false (file
+uploads, whose contents are not recorded) are skipped.
+
+Reports latency distributions per route (next to the recorded ones), the
+app's cache hit rates over the run (every <name>_hits / <name>_misses
+counter pair in /metrics) and how many LLM prompts matched a recorded
+reply. Results go to benchmarks/results/<label>.json; --compare diffs
+latencies and response bodies (volatile fields such as timings and
+session ids ignored) against another build's results.
+
+Examples:
+    TRAFFIC_LOG=data/traffic.jsonl python app.py                     # record
+    python benchmarks/replay.py data/traffic.jsonl --label main
+    python benchmarks/replay.py data/traffic.jsonl --speed 10 --label branch \\
+        --app-cmd "python ../branch/app.py" --compare benchmarks/results/main.json
+"""
+import argparse
+import gzip
+import hashlib
+import http.client
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+
+from fake_groq import start_fake_groq
+from loadtest import free_port, summarize, wait_until_ready
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+SESSION_PATH_RE = re.compile(r"^/playground/sessions/([^/]+)")
+# Response fields that legitimately differ between two runs of the same build
+VOLATILE_KEYS = {"session_id", "llm_usage", "stats", "timings_ms", "fetched_at", "expires_in"}
+DIFF_EXCERPT_CHARS = 300
+
+
+def traffic_files(path):
+    """The file and its rotated predecessors (path.N ... path.1, path), oldest first."""
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    return list(reversed(rotated)) + ([path] if os.path.exists(path) else [])
+
+
+def load_traffic(paths):
+    records = []
+    for path in paths:
+        for name in traffic_files(path):
+            with open(name, encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def route_name(path):
+    return SESSION_PATH_RE.sub("/playground/sessions/<id>", path)
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()
+                if k not in VOLATILE_KEYS and not k.endswith("_ms") and not k.endswith("_seconds")}
+    if isinstance(value, list):
+        return [normalize(v) for v in value]
+    return value
+
+
+def decode_body(raw, headers):
+    """Comparable form of a response: parsed JSON when possible, else the raw bytes' digest."""
+    if headers.get("Content-Encoding") == "gzip":
+        raw = gzip.decompress(raw)
+    content_type = headers.get("Content-Type", "")
+    try:
+        if "ndjson" in content_type:
+            return [json.loads(line) for line in raw.decode("utf-8").splitlines() if line.strip()]
+        if "json" in content_type:
+            return json.loads(raw)
+    except ValueError:
+        pass
+    return {"bytes": len(raw), "sha256": hashlib.sha256(raw).hexdigest()}
+
+
+class Replayer:
+    def __init__(self, port, records):
+        self.port = port
+        self.records = records
+        self.local = threading.local()
+        self.sessions = {}
+        self.results = [None] * len(records)
+
+    def connection(self):
+        if getattr(self.local, "conn", None) is None:
+            self.local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        return self.local.conn
+
+    def send(self, index, wait_for, done):
+        record = self.records[index]
+        try:
+            if wait_for is not None:
+                wait_for.wait()
+            path = record["path"]
+            match = SESSION_PATH_RE.match(path)
+            if match:
+                new_id = self.sessions.get(match.group(1), match.group(1))
+                path = path.replace(match.group(1), new_id, 1)
+            if record.get("query"):
+                path += "?" + urlencode(record["query"])
+            if record.get("form") is not None:
+                headers = {"Content-Type": "application/x-www-form-urlencoded"}
+                body = urlencode(record["form"]).encode("utf-8")
+            else:
+                headers = {"Content-Type": "application/json"}
+                body = json.dumps(record.get("body")).encode("utf-8") if record.get("body") is not None else None
+            headers.update(record.get("headers") or {})
+
+            conn = self.connection()
+            start = time.perf_counter()
+            try:
+                conn.request(record.get("method", "POST"), path, body=body, headers=headers)
+                response = conn.getresponse()
+                raw = response.read()
+                status = response.status
+                response_headers = dict(response.getheaders())
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self.local.conn = None
+                status, raw, response_headers = None, str(e).encode("utf-8"), {}
+            latency = (time.perf_counter() - start) * 1000.0
+
+            decoded = decode_body(raw, response_headers) if status is not None else {"error": raw.decode("utf-8")}
+            if record["path"] == "/playground/sessions" and record.get("session_id") and isinstance(decoded, dict):
+                self.sessions[record["session_id"]] = decoded.get("session_id", record["session_id"])
+            canonical = json.dumps(normalize(decoded), sort_keys=True, default=str)
+            self.results[index] = {
+                "index": index,
+                "route": route_name(record["path"]),
+                "status": status,
+                "recorded_status": record.get("status"),
+                "latency_ms": round(latency, 2),
+                "recorded_ms": record.get("duration_ms"),
+                "digest": hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16],
+                "excerpt": canonical[:DIFF_EXCERPT_CHARS],
+            }
+        finally:
+            done.set()
+
+    def run(self, speed, concurrency):
+        started = time.perf_counter()
+        first_ts = self.records[0]["ts"] if self.records else 0
+        last_done = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for index, record in enumerate(self.records):
+                if speed > 0:
+                    delay = (record["ts"] - first_ts) / speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                done = threading.Event()
+                match = SESSION_PATH_RE.match(record["path"])
+                session = match.group(1) if match else record.get("session_id")
+                wait_for = last_done.get(session) if session else None
+                if session:
+                    last_done[session] = done
+                executor.submit(self.send, index, wait_for, done)
+        return time.perf_counter() - started
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def cache_hit_rates(before, after):
+    """hits / (hits + misses) for every <name>_hits / <name>_misses counter pair that moved during the run."""
+    delta = {k: v - before.get(k, 0) for k, v in after.items()}
+    rates = {}
+    names = {key.rsplit("_", 1)[0] for key in delta if key.endswith(("_hits", "_misses"))}
+    for name in sorted(names):
+        hits, misses = delta.get(f"{name}_hits", 0), delta.get(f"{name}_misses", 0)
+        rates[name] = {"hits": hits, "misses": misses,
+                       "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None}
+    return rates, delta
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def pct(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nComparison against {baseline_path} ({baseline.get('label')}):")
+    print(f"{'route':<34}{'p50':>10}{'p95':>10}{'p99':>10}")
+    rows = [("overall", current["overall"], baseline["overall"])]
+    for route, stats in current["routes"].items():
+        if route in baseline.get("routes", {}):
+            rows.append((route, stats, baseline["routes"][route]))
+    for name, new, old in rows:
+        print(f"{name:<34}{pct(new['p50_ms'], old['p50_ms']):>10}"
+              f"{pct(new['p95_ms'], old['p95_ms']):>10}{pct(new['p99_ms'], old['p99_ms']):>10}")
+    for name, rate in current["cache_hit_rates"].items():
+        old = baseline.get("cache_hit_rates", {}).get(name, {}).get("hit_rate")
+        print(f"{name + ' hit rate':<34}{rate['hit_rate']!s:>10} (was {old})")
+
+    old_requests = {r["index"]: r for r in baseline["requests"]}
+    diffs = []
+    for new in current["requests"]:
+        old = old_requests.get(new["index"])
+        if old is None:
+            continue
+        if old["status"] != new["status"] or old["digest"] != new["digest"]:
+            diffs.append((old, new))
+    print(f"\nResponses: {len(current['requests']) - len(diffs)} identical, {len(diffs)} different")
+    for old, new in diffs[:10]:
+        print(f"  #{new['index']} {new['route']}: status {old['status']} -> {new['status']}")
+        if old["digest"] != new["digest"]:
+            print(f"    {baseline.get('label')}: {old['excerpt']}")
+            print(f"    {current['label']}: {new['excerpt']}")
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against a build of app.py")
+    parser.add_argument("traffic", nargs="+", help="TRAFFIC_LOG file(s); rotated .1 ... .N files are included")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay N times faster than recorded (0 = back to back)")
+    parser.add_argument("--concurrency", type=int, default=32, help="max requests in flight")
+    parser.add_argument("--routes", default=None, help="comma-separated path prefixes to replay (default: all)")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fake Groq fixed latency")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="fake Groq generation speed")
+    parser.add_argument("--app-cmd", default=None,
+                        help="command to start the build; {port} is substituted (default: python app.py)")
+    parser.add_argument("--label", default=None, help="name of the results file to write")
+    parser.add_argument("--output", default=None, help="explicit output path (overrides --label)")
+    parser.add_argument("--compare", default=None, help="results JSON of another build to diff against")
+    args = parser.parse_args()
+
+    records = load_traffic(args.traffic)
+    if args.routes:
+        prefixes = tuple(p.strip() for p in args.routes.split(","))
+        records = [r for r in records if r["path"].startswith(prefixes)]
+    skipped = sum(1 for r in records if r.get("replayable") is False)
+    if skipped:
+        print(f"Skipping {skipped} request(s) with uploaded files, which the recording does not hold")
+        records = [r for r in records if r.get("replayable") is not False]
+    if not records:
+        raise SystemExit("No recorded requests to replay")
+    recordings = [call for r in records for call in r.get("llm") or ()]
+
+    fake = start_fake_groq(latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec, recordings=recordings)
+    port = free_port()
+    env = dict(os.environ)
+    env.pop("TRAFFIC_LOG", None)
+    env.update({
+        "GROQ_API_KEY": "fake-key",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{fake.server_port}",
+        "PORT": str(port),
+        "FLASK_DEBUG": "0",
+    })
+    # Recorded clients are replayed from one address: keep the rate limit out of the numbers
+    env.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    if args.app_cmd:
+        cmd = shlex.split(args.app_cmd.format(port=port))
+    else:
+        cmd = [sys.executable, os.path.join(REPO_ROOT, "app.py")]
+
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port, proc)
+        before = get_json(port, "/metrics")["counters"]
+        replayer = Replayer(port, records)
+        elapsed = replayer.run(args.speed, args.concurrency)
+        after = get_json(port, "/metrics")["counters"]
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.shutdown()
+
+    results = replayer.results
+    hit_rates, counters = cache_hit_rates(before, after)
+    routes = {}
+    for route in sorted({r["route"] for r in results}):
+        subset = [r for r in results if r["route"] == route]
+        routes[route] = summarize([r["latency_ms"] for r in subset], [r["status"] for r in subset], elapsed)
+        recorded = [r["recorded_ms"] for r in subset if r["recorded_ms"] is not None]
+        routes[route]["recorded"] = summarize(recorded, [r["recorded_status"] for r in subset], None)
+
+    label = args.label or datetime.now().strftime("replay-%Y%m%d-%H%M%S")
+    result = {
+        "label": label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "traffic": args.traffic,
+            "speed": args.speed,
+            "concurrency": args.concurrency,
+            "fake_groq": {"latency_ms": args.latency_ms, "tokens_per_sec": args.tokens_per_sec},
+            "app_cmd": cmd,
+        },
+        "overall": summarize([r["latency_ms"] for r in results], [r["status"] for r in results], elapsed),
+        "routes": routes,
+        "cache_hit_rates": hit_rates,
+        "counters": counters,
+        "llm": {
+            "recorded_replies": len(recordings),
+            "prompts": fake.stats["requests"],
+            "replayed": fake.stats["replayed"],
+        },
+        "status_changes": sum(1 for r in results if r["status"] != r["recorded_status"]),
+        "requests": results,
+    }
+
+    print(f"{'route':<34}{'reqs':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'rec p50':>9}")
+    for name, stats in [("overall", result["overall"])] + list(routes.items()):
+        recorded_p50 = stats.get("recorded", {}).get("p50_ms")
+        print(f"{name:<34}{stats['requests']:>6}{stats['errors']:>5}{stats['p50_ms'] or 0:>9}"
+              f"{stats['p95_ms'] or 0:>9}{stats['p99_ms'] or 0:>9}{recorded_p50 or '':>9}")
+    for name, rate in hit_rates.items():
+        print(f"{name} hit rate: {rate['hit_rate']} ({rate['hits']} hits / {rate['misses']} misses)")
+    print(f"LLM prompts answered from the recording: {result['llm']['replayed']} / {result['llm']['prompts']}")
+    print(f"Status differs from the recording: {result['status_changes']} requests")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved results to {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Local stand-in for an external SQL question source (EXTERNAL_SQL_SOURCES).
+
+GET / answers {"questions": [...]} in the loosely-typed shape upstream
+question APIs use (questionTitle / content / sqlSchema as a list / answer /
+hints), with an ETag so conditional refreshes get a 304. --latency-ms delays
+every response to play a slow upstream; GET /stats counts requests.
+
+Run standalone:
+    python benchmarks/stub_questions.py --port 8082 --latency-ms 5000
+then start the app with EXTERNAL_SQL_SOURCES=stub=http://127.0.0.1:8082/.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_QUESTIONS = [
+    {
+        "questionId": "176",
+        "questionTitle": "Second Highest Salary",
+        "level": "Medium",
+        "content": "Find the second highest salary, or NULL if there is none.",
+        "sqlSchema": [
+            "CREATE TABLE Employee (id INTEGER PRIMARY KEY, salary INTEGER)",
+            "INSERT INTO Employee VALUES (1, 100), (2, 200), (3, 300)"
+        ],
+        "answer": "SELECT MAX(salary) AS SecondHighestSalary FROM Employee "
+                  "WHERE salary < (SELECT MAX(salary) FROM Employee)",
+        "hints": ["Exclude the maximum first."]
+    },
+    {
+        "questionId": "1757",
+        "questionTitle": "Recyclable and Low Fat Products",
+        "level": 1,
+        "content": "List the products that are both low fat and recyclable.",
+        "sqlSchema": "CREATE TABLE Products (product_id INTEGER, low_fats TEXT, recyclable TEXT);"
+                     "INSERT INTO Products VALUES (0, 'Y', 'N'), (1, 'Y', 'Y'), (2, 'N', 'Y');",
+        "answer": "SELECT product_id FROM Products WHERE low_fats = 'Y' AND recyclable = 'Y'"
+    },
+    {
+        "questionId": "broken",
+        "questionTitle": "Question whose solution does not run",
+        "sqlSchema": "CREATE TABLE T (a INTEGER);",
+        "answer": "SELECT b FROM T"
+    }
+]
+
+
+class StubQuestionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0.0, questions=None, status=200):
+        super().__init__(address, StubQuestionHandler)
+        self.latency_ms = latency_ms
+        self.status = status
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "not_modified": 0}
+        self.set_questions(SAMPLE_QUESTIONS if questions is None else questions)
+
+    def set_questions(self, questions):
+        body = json.dumps({"questions": questions}).encode("utf-8")
+        with self.lock:
+            self.body = body
+            self.etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+
+class StubQuestionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if self.path.rstrip("/").endswith("/stats"):
+            with server.lock:
+                self.send_body(200, json.dumps(server.stats).encode("utf-8"))
+            return
+
+        server.count("requests")
+        time.sleep(server.latency_ms / 1000.0)
+        with server.lock:
+            body, etag, status = server.body, server.etag, server.status
+        if status != 200:
+            self.send_body(status, b'{"error": "simulated upstream error"}')
+        elif self.headers.get("If-None-Match") == etag:
+            server.count("not_modified")
+            self.send_body(304, b"", [("ETag", etag)])
+        else:
+            self.send_body(200, body, [("ETag", etag)])
+
+
+def start_stub_questions(host="127.0.0.1", port=0, **options):
+    """Start the stub on a background thread and return it (server.server_port is the bound port)."""
+    server = StubQuestionServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub external SQL question source")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before every response")
+    parser.add_argument("--questions", default=None, help="JSON file with a list of questions to serve")
+    args = parser.parse_args()
+
+    questions = None
+    if args.questions:
+        with open(args.questions) as f:
+            questions = json.load(f)
+    server = StubQuestionServer((args.host, args.port), latency_ms=args.latency_ms, questions=questions)
+    print(f"Stub question source listening on http://{args.host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
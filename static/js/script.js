@@ -11,6 +11,10 @@ const compilerResultsContent = document.getElementById('compilerResultsContent')
 const compilerTables = document.getElementById('compilerTables');
 const compilerTablesContent = document.getElementById('compilerTablesContent');
 const compilerPlaceholder = document.getElementById('compilerPlaceholder');
+const compilerAnalysis = document.getElementById('compilerAnalysis');
+const compilerAnalysisContent = document.getElementById('compilerAnalysisContent');
+const compilerOptimization = document.getElementById('compilerOptimization');
+const compilerOptimizationContent = document.getElementById('compilerOptimizationContent');
 
 // DOM Elements - Optimizer
 const optimizerQuery = document.getElementById('optimizerQuery');
@@ -73,11 +77,14 @@ async function executeCompiler() {
     }
 
     showLoading(true);
+    hideSection(compilerAnalysis);
+    hideSection(compilerOptimization);
 
     try {
-        const response = await fetch('/compile-sql', {
+        // Stages arrive as NDJSON lines: result, tables, analysis, optimized, done
+        const response = await fetch('/compile-sql/stream', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'X-Result-Format': 'columnar' },
             body: JSON.stringify({
                 setup_sql: schema,
                 query: query,
@@ -85,14 +92,37 @@ async function executeCompiler() {
             })
         });
 
-        const data = await response.json();
-
-        if (data.error) {
+        if (!response.ok) {
+            const data = await response.json();
             alert('Error: ' + data.error);
             return;
         }
 
-        displayCompilerResults(data);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let newline;
+            while ((newline = buffer.indexOf('\n')) >= 0) {
+                const line = buffer.slice(0, newline).trim();
+                buffer = buffer.slice(newline + 1);
+                if (!line) continue;
+
+                const stage = JSON.parse(line);
+                if (stage.stage === 'error') {
+                    alert('Error: ' + stage.error);
+                    hideSection(compilerAnalysis);
+                    return;
+                }
+                displayCompilerResults(stage);
+                if (stage.stage === 'result') showLoading(false);
+            }
+        }
 
     } catch (error) {
         alert('Error: ' + error.message);
@@ -101,27 +131,44 @@ async function executeCompiler() {
     }
 }
 
+// Render one streamed /compile-sql stage ({ stage, ...fields }).
 function displayCompilerResults(data) {
+    if (data.stage === 'result') {
+        displayCompilerResult(data);
+    } else if (data.stage === 'tables') {
+        displayCompilerTables(data);
+    } else if (data.stage === 'analysis') {
+        compilerAnalysisContent.innerHTML = analysisHtml(data.analysis || {});
+        compilerOptimizationContent.innerHTML = '<p class="no-results">Optimizing...</p>';
+        showSection(compilerOptimization);
+    } else if (data.stage === 'optimized') {
+        compilerOptimizationContent.innerHTML = optimizationHtml(data.optimized || {}, false);
+        showSection(compilerOptimization);
+    }
+}
+
+function displayCompilerResult(data) {
     // Hide placeholder
     if (compilerPlaceholder) compilerPlaceholder.style.display = 'none';
 
     // Display Query Results
     let resultsHtml = '';
+    const result = data.result ? decodeResultSet(data.result) : null;
     
-    if (data.result && data.result.columns) {
+    if (result && result.columns) {
         resultsHtml += `<div class="result-stats">
-            <span class="stat-badge">📊 ${data.result.rows.length} rows returned</span>
+            <span class="stat-badge">📊 ${result.rows.length} rows returned</span>
         </div>`;
         
         resultsHtml += '<div class="table-wrapper">';
         resultsHtml += '<table class="data-table">';
         resultsHtml += '<thead><tr>';
-        data.result.columns.forEach(col => {
+        result.columns.forEach(col => {
             resultsHtml += `<th>${col}</th>`;
         });
         resultsHtml += '</tr></thead><tbody>';
         
-        data.result.rows.forEach(row => {
+        result.rows.forEach(row => {
             resultsHtml += '<tr>';
             row.forEach(cell => {
                 resultsHtml += `<td>${cell !== null ? cell : '<span class="null-value">NULL</span>'}</td>`;
@@ -142,11 +189,21 @@ function displayCompilerResults(data) {
     compilerResultsContent.innerHTML = resultsHtml;
     showSection(compilerResults);
 
+    // Analysis follows once the LLM answers
+    compilerAnalysisContent.innerHTML = '<p class="no-results">Analyzing...</p>';
+    showSection(compilerAnalysis);
+
+    // Scroll to results
+    compilerResults.scrollIntoView({ behavior: 'smooth', block: 'start' });
+}
+
+function displayCompilerTables(data) {
     // Display All Tables
     let tablesHtml = '';
     
     if (data.tables && Object.keys(data.tables).length > 0) {
-        for (const [tableName, tableData] of Object.entries(data.tables)) {
+        for (const [tableName, encodedTable] of Object.entries(data.tables)) {
+            const tableData = decodeResultSet(encodedTable);
             tablesHtml += `<div class="table-group">
                 <div class="table-group-header">
                     <h4>${tableName}</h4>
@@ -176,9 +233,6 @@ function displayCompilerResults(data) {
 
     compilerTablesContent.innerHTML = tablesHtml;
     showSection(compilerTables);
-
-    // Scroll to results
-    compilerResults.scrollIntoView({ behavior: 'smooth', block: 'start' });
 }
 
 function clearCompiler() {
@@ -186,8 +240,12 @@ function clearCompiler() {
     compilerQuery.value = '';
     compilerResultsContent.innerHTML = '';
     compilerTablesContent.innerHTML = '';
+    compilerAnalysisContent.innerHTML = '';
+    compilerOptimizationContent.innerHTML = '';
     hideSection(compilerResults);
     hideSection(compilerTables);
+    hideSection(compilerAnalysis);
+    hideSection(compilerOptimization);
     if (compilerPlaceholder) compilerPlaceholder.style.display = 'flex';
 }
 
@@ -293,6 +351,10 @@ async function analyzeQuery() {
 }
 
 function displayAnalysis(analysis) {
+    analysisContent.innerHTML = analysisHtml(analysis);
+}
+
+function analysisHtml(analysis) {
     let html = '';
 
     if (analysis.syntax_issues && analysis.syntax_issues.length > 0) {
@@ -332,7 +394,7 @@ function displayAnalysis(analysis) {
         html += '<div class="assessment success-assessment">✅ No major issues found! Your query looks good.</div>';
     }
 
-    analysisContent.innerHTML = html;
+    return html;
 }
 
 async function optimizeQuery() {
@@ -344,12 +406,26 @@ async function optimizeQuery() {
     }
 
     showLoading(true);
+    const dialect = dialectSelect.value;
 
     try {
+        // Deterministic rewrite rules answer in milliseconds; show them while the LLM works
+        const rulesResponse = await fetch('/optimize', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ query, dialect, mode: 'rules' })
+        });
+        const rules = await rulesResponse.json();
+        const rulesHtml = rewritesHtml(rules.rewrites || []);
+        if (rulesHtml) {
+            optimizationContent.innerHTML = rulesHtml;
+            showSection(optimizationSection);
+        }
+
         const response = await fetch('/optimize', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ query, analysis: currentAnalysis })
+            body: JSON.stringify({ query, analysis: currentAnalysis, dialect })
         });
 
         const data = await response.json();
@@ -359,7 +435,7 @@ async function optimizeQuery() {
             return;
         }
 
-        displayOptimizations(data.optimized);
+        displayOptimizations(data.optimized, rulesHtml);
         showSection(optimizationSection);
 
     } catch (error) {
@@ -369,7 +445,30 @@ async function optimizeQuery() {
     }
 }
 
-function displayOptimizations(optimized) {
+function displayOptimizations(optimized, rulesHtml = '') {
+    optimizationContent.innerHTML = optimizationHtml(optimized, true) + rulesHtml;
+}
+
+function rewritesHtml(rewrites) {
+    if (!rewrites.length) return '';
+
+    let html = '<h3>🧩 Rule-Based Rewrites</h3>';
+    rewrites.forEach(rewrite => {
+        const status = rewrite.equivalent === true ? '✅ Same results on your data'
+            : rewrite.equivalent === false ? '⚠️ Different results on your data'
+            : 'Not verified (no data)';
+        html += `<div class="optimization-variant">
+            <strong>${escapeHtml(rewrite.strategy)}</strong> <span class="rewrite-status">${status}</span>
+            <ul class="changes-list">
+                ${rewrite.notes.map(note => `<li>${escapeHtml(note)}</li>`).join('')}
+            </ul>
+            <div class="query-box">${escapeHtml(rewrite.optimized_query)}</div>
+        </div>`;
+    });
+    return html;
+}
+
+function optimizationHtml(optimized, withExplain) {
     let html = '';
 
     if (optimized.optimized_query) {
@@ -392,16 +491,18 @@ function displayOptimizations(optimized) {
             </div>`;
         }
         
-        html += `<div class="query-box">${escapeHtml(optimized.optimized_query)}</div>
-            <button class="btn btn-primary explain-btn" onclick="explainOptimization(\`${escapeHtml(optimized.optimized_query)}\`)">
+        html += `<div class="query-box">${escapeHtml(optimized.optimized_query)}</div>`;
+        if (withExplain) {
+            html += `<button class="btn btn-primary explain-btn" onclick="explainOptimization(\`${escapeHtml(optimized.optimized_query)}\`)">
                 📖 Explain Optimization
-            </button>
-        </div>`;
+            </button>`;
+        }
+        html += '</div>';
     } else {
         html += '<p class="no-results">No optimizations needed.</p>';
     }
 
-    optimizationContent.innerHTML = html;
+    return html;
 }
 
 async function explainOptimization(optimizedQuery) {
@@ -546,6 +647,7 @@ function displayQuestions(questions) {
                     <h4>✍️ Write Your Solution:</h4>
                     <textarea id="user-query-${q.id}" rows="5" placeholder="Write your SQL query here..."></textarea>
                     <button class="btn btn-success" onclick="runUserQuery(${q.id})">▶️ Run Query</button>
+                    <button class="btn btn-secondary" onclick="gradeAtScale(${q.id})">⏱️ Grade at Scale</button>
                 </div>
                 
                 <div id="results-${q.id}" class="query-results hidden"></div>
@@ -571,7 +673,7 @@ async function viewTables(questionId) {
     try {
         const response = await fetch('/get-question-schema', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'X-Result-Format': 'columnar' },
             body: JSON.stringify({ question_id: questionId })
         });
 
@@ -597,7 +699,8 @@ function displayTables(questionId, schema, data) {
     const tablesDiv = document.getElementById(`tables-${questionId}`);
     let html = '<h4>📋 Database Tables:</h4>';
 
-    for (const [tableName, tableData] of Object.entries(data)) {
+    for (const [tableName, encodedTable] of Object.entries(data)) {
+        const tableData = decodeResultSet(encodedTable);
         html += `<div class="table-section">
             <h5>${tableName}</h5>
             <div class="schema-info">
@@ -639,7 +742,7 @@ async function runUserQuery(questionId) {
     try {
         const response = await fetch('/execute-question', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'X-Result-Format': 'columnar' },
             body: JSON.stringify({ query, question_id: questionId })
         });
 
@@ -659,13 +762,47 @@ async function runUserQuery(questionId) {
     }
 }
 
-async function runSolution(questionId, solution) {
+async function gradeAtScale(questionId) {
+    const queryTextarea = document.getElementById(`user-query-${questionId}`);
+    const query = queryTextarea.value.trim();
+    
+    if (!query) {
+        alert('Please write a query first');
+        return;
+    }
+
     showLoading(true);
 
     try {
         const response = await fetch('/execute-question', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ query, question_id: questionId, mode: 'scale' })
+        });
+
+        const data = await response.json();
+
+        if (data.error) {
+            alert('Error: ' + data.error);
+            return;
+        }
+
+        displayScaleGrade(questionId, data, query);
+
+    } catch (error) {
+        alert('Error: ' + error.message);
+    } finally {
+        showLoading(false);
+    }
+}
+
+async function runSolution(questionId, solution) {
+    showLoading(true);
+
+    try {
+        const response = await fetch('/execute-question', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-Result-Format': 'columnar' },
             body: JSON.stringify({ query: solution, question_id: questionId })
         });
 
@@ -687,6 +824,7 @@ async function runSolution(questionId, solution) {
 
 function displayQueryResults(questionId, data, query) {
     const resultsDiv = document.getElementById(`results-${questionId}`);
+    const resultSet = decodeResultSet(data);
     
     let html = '<h4>✅ Query Results:</h4>';
     html += '<div class="executed-query">';
@@ -700,10 +838,10 @@ function displayQueryResults(questionId, data, query) {
         html += '<div class="table-wrapper">';
         html += '<table class="data-table">';
         html += '<thead><tr>';
-        data.columns.forEach(col => html += `<th>${col}</th>`);
+        resultSet.columns.forEach(col => html += `<th>${col}</th>`);
         html += '</tr></thead><tbody>';
         
-        data.rows.forEach(row => {
+        resultSet.rows.forEach(row => {
             html += '<tr>';
             row.forEach(cell => html += `<td>${cell !== null ? cell : '<span class="null-value">NULL</span>'}</td>`);
             html += '</tr>';
@@ -719,6 +857,40 @@ function displayQueryResults(questionId, data, query) {
     resultsDiv.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
 }
 
+function displayScaleGrade(questionId, data, query) {
+    const resultsDiv = document.getElementById(`results-${questionId}`);
+    const formatCost = cost => cost.elapsed_ms !== undefined
+        ? `${cost.elapsed_ms} ms, ${cost.vm_steps.toLocaleString()} VM steps, ${cost.row_count} rows`
+        : 'did not finish';
+    const tables = Object.entries(data.tables).map(([name, count]) => `${name} (${count.toLocaleString()} rows)`).join(', ');
+
+    let html = `<h4>⏱️ Grade at Scale: ${data.grade}</h4>`;
+    html += '<div class="executed-query">';
+    html += '<strong>Executed Query:</strong>';
+    html += `<pre class="code-block"><code>${escapeHtml(query)}</code></pre>`;
+    html += '</div>';
+
+    html += '<div class="result-info">';
+    html += `<p><strong>Verdict:</strong> ${escapeHtml(data.verdict)}</p>`;
+    html += `<p><strong>Data:</strong> ${tables}</p>`;
+    html += `<p><strong>Your query:</strong> ${formatCost(data.answer)}</p>`;
+    html += `<p><strong>Reference:</strong> ${formatCost(data.reference)}</p>`;
+    if (data.ratio) {
+        html += `<p><strong>Relative cost:</strong> ${data.ratio.vm_steps}x VM steps, ${data.ratio.time}x time</p>`;
+    }
+    html += `<p><strong>Budget:</strong> ${data.budget.time_ms} ms, ${data.budget.vm_steps.toLocaleString()} VM steps</p>`;
+    html += '</div>';
+
+    html += '<strong>Your plan:</strong>';
+    html += `<pre class="code-block"><code>${escapeHtml(data.answer.plan.join('\n'))}</code></pre>`;
+    html += '<strong>Reference plan:</strong>';
+    html += `<pre class="code-block"><code>${escapeHtml(data.reference.plan.join('\n'))}</code></pre>`;
+
+    resultsDiv.innerHTML = html;
+    resultsDiv.classList.remove('hidden');
+    resultsDiv.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
+}
+
 function filterQuestions(difficulty) {
     const filtered = difficulty === 'all' ? allQuestions : allQuestions.filter(q => q.difficulty === difficulty);
     displayQuestions(filtered);
@@ -750,6 +922,25 @@ function showLoading(show) {
     }
 }
 
+// Turn a result set from the server into { columns, rows }.
+// Columnar payloads carry one array per column; repetitive text columns
+// arrive dictionary-encoded as { dict: [...], codes: [...] }.
+function decodeResultSet(resultSet) {
+    if (!resultSet || resultSet.encoding !== 'columnar') return resultSet;
+
+    const columns = resultSet.data.map(col => {
+        if (Array.isArray(col)) return col;
+        return col.codes.map(code => code === null ? null : col.dict[code]);
+    });
+
+    const rows = new Array(resultSet.length);
+    for (let i = 0; i < resultSet.length; i++) {
+        rows[i] = columns.map(col => col[i]);
+    }
+
+    return { columns: resultSet.columns, rows };
+}
+
 function escapeHtml(text) {
     const map = {
         '&': '&amp;',
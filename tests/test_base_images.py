@@ -0,0 +1,103 @@
+"""
+Base images are attached read-only and immutable instead of being copied
+into every request's database: tables are copied into the request's own
+database only when something writes them, playground connections still
+get a full copy, and imports never change an image file in place.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="sql-compiler-tests-"))
+
+import app  # noqa: E402
+
+ORDERS_CSV = "id,customer,amount\n" + "".join(f"{i},c{i % 7},{i * 10}\n" for i in range(1, 201))
+
+
+def main_tables(conn):
+    return sorted(name for (name,) in conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'"))
+
+
+class BaseImageTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+        self.image_id = self.import_csv("orders", ORDERS_CSV)
+
+    def import_csv(self, table, body, image_id=None):
+        url = f"/import?table={table}&format=csv" + (f"&image_id={image_id}" if image_id else "")
+        response = self.client.post(url, data=body)
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True)[:300])
+        return response.get_json()["image_id"]
+
+    def open(self, setup_sql=""):
+        conn = app.open_database(setup_sql, self.image_id)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_reads_go_to_the_attached_image(self):
+        conn = self.open()
+        self.assertTrue(app.image_attached(conn))
+        self.assertEqual(main_tables(conn), [])
+        self.assertEqual(conn.execute("SELECT COUNT(*), SUM(amount) FROM orders").fetchone(), (200, 201000))
+        self.assertIn("CREATE TABLE", app.schema_ddl_for_query(conn.cursor(), "SELECT * FROM orders"))
+        self.assertEqual(app.referenced_tables(conn.cursor(), "SELECT * FROM orders"), ["orders"])
+
+    def test_writes_copy_the_table_and_leave_the_image_alone(self):
+        conn = self.open("INSERT INTO orders VALUES (201, 'new', 5); CREATE INDEX orders_customer ON orders(customer);")
+        self.assertEqual(main_tables(conn), ["orders"])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0], 201)
+        self.assertEqual(self.open().execute("SELECT COUNT(*) FROM orders").fetchone()[0], 200)
+
+    def test_drop_does_not_uncover_the_image_table(self):
+        conn = self.open("DROP TABLE orders; CREATE TABLE other (x);")
+        self.assertFalse(app.image_attached(conn))
+        self.assertEqual(main_tables(conn), ["other"])
+
+    def test_scale_up_and_analyze_copy_only_what_they_use(self):
+        self.import_csv("customers", "name\n" + "".join(f"c{i}\n" for i in range(7)), self.image_id)
+        conn = self.open()
+        scaled = app.scale_database(conn, 3, tables=app.underlying_tables(conn, "SELECT * FROM orders"))
+        self.assertEqual(scaled["rows"], {"orders": 600})
+        self.assertEqual(main_tables(conn), ["orders"])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0], 7)
+
+        statistics = app.collect_statistics(self.open(), ["customers"])
+        self.assertEqual(statistics["customers"]["rows"], 7)
+
+    def test_import_replaces_the_image_without_touching_open_readers(self):
+        conn = self.open()
+        self.import_csv("extra", "x\n1\n", self.image_id)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0], 200)
+        reopened = self.open()
+        self.assertEqual(reopened.execute("SELECT x FROM extra").fetchall(), [(1,)])
+        self.assertEqual(reopened.execute("SELECT COUNT(*) FROM orders").fetchone()[0], 200)
+
+    def test_routes_on_a_base_image(self):
+        response = self.client.post("/engines/compare", json={
+            "base_image": self.image_id, "runs": 1, "query": "SELECT customer, SUM(amount) FROM orders GROUP BY 1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()["results_match"])
+
+        response = self.client.post("/workload/indexes", json={
+            "base_image": self.image_id, "scale": 2, "runs": 1,
+            "queries": ["SELECT amount FROM orders WHERE customer = 'c3'"]})
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True)[:300])
+
+        response = self.client.post("/playground/execute", json={
+            "base_image": self.image_id, "queries": ["DELETE FROM orders WHERE id > 100"], "include_tables": False})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["affected_rows"], 100)
+        self.assertEqual(self.open().execute("SELECT COUNT(*) FROM orders").fetchone()[0], 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+The DuckDB engine must not let user SQL reach the host: file readers,
+COPY ... TO, ATTACH and extension installs are rejected on every route
+that runs queries on it.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="sql-compiler-tests-"))
+
+import app  # noqa: E402
+
+SETUP_SQL = "CREATE TABLE t (id INTEGER, name TEXT); INSERT INTO t VALUES (1, 'a'), (2, 'b');"
+
+
+@unittest.skipIf(app.duckdb is None, "duckdb is not installed")
+class DuckDBSandboxTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+        self.target = os.path.join(tempfile.mkdtemp(prefix="duckdb-"), "out.csv")
+        self.statements = [
+            "SELECT content FROM read_text('/etc/hostname')",
+            "SELECT * FROM read_csv('/etc/passwd')",
+            f"COPY (SELECT 42) TO '{self.target}'",
+            "ATTACH ':memory:' AS other",
+            f"ATTACH '{self.target}.duckdb' AS other",
+            "INSTALL httpfs",
+            "LOAD httpfs",
+            "SET enable_external_access = true",
+        ]
+
+    def assertRejected(self, response, sql):
+        self.assertEqual(response.status_code, 400, f"{sql}: {response.get_data(as_text=True)[:200]}")
+        self.assertFalse(os.path.exists(self.target))
+
+    def test_execute_question(self):
+        for sql in self.statements:
+            response = self.client.post("/execute-question", json={"engine": "duckdb", "question_id": 1, "query": sql})
+            self.assertRejected(response, sql)
+
+    def test_compile_sql(self):
+        for sql in self.statements:
+            response = self.client.post("/compile-sql", json={"engine": "duckdb", "setup_sql": SETUP_SQL, "query": sql})
+            self.assertRejected(response, sql)
+            self.assertIn("SQL Error", response.get_json()["error"])
+
+    def test_engines_compare(self):
+        for sql in self.statements[:2]:
+            response = self.client.post("/engines/compare", json={"engines": ["duckdb"], "setup_sql": SETUP_SQL,
+                                                                  "query": sql, "runs": 1})
+            self.assertEqual(response.status_code, 200)
+            entry = response.get_json()["engines"]["duckdb"]
+            self.assertNotIn("result", entry)
+            self.assertIn("SQL Error", entry["error"])
+
+    def test_queries_on_the_copied_data_still_run(self):
+        response = self.client.post("/engines/compare", json={"setup_sql": SETUP_SQL, "runs": 1,
+                                                              "query": "SELECT name FROM t ORDER BY id"})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body["engines"]["duckdb"]["row_count"], 2)
+        self.assertTrue(body["results_match"])
+
+
+if __name__ == "__main__":
+    unittest.main()
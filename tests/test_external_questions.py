@@ -0,0 +1,168 @@
+"""
+ExternalQuestionCache against the stub question source
+(benchmarks/stub_questions.py): cold start, stale-while-revalidate,
+conditional refreshes, backoff after a failed fetch and "source:id" ids in
+the question routes.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "benchmarks"))
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="sql-compiler-tests-"))
+
+import app  # noqa: E402
+from stub_questions import SAMPLE_QUESTIONS, start_stub_questions  # noqa: E402
+
+SOURCE = "stub"
+MAX_AGE = 3600
+RETRY_AFTER = 60
+
+
+class ExternalQuestionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = start_stub_questions()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+
+        directory = tempfile.mkdtemp(prefix="external-")
+        sources = {SOURCE: f"http://127.0.0.1:{self.stub.server_port}/"}
+        self.cache = app.ExternalQuestionCache(sources, directory, MAX_AGE, RETRY_AFTER)
+        self.addCleanup(self.cache.executor.shutdown, wait=True)
+        for name, value in [("EXTERNAL_QUESTION_DIR", directory), ("EXTERNAL_SQL_SOURCES", sources),
+                            ("external_questions", self.cache), ("EXTERNAL_FIRST_FETCH_WAIT", 5)]:
+            patcher = mock.patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app.app.test_client()
+
+    def wait_for_refresh(self):
+        future = self.cache.pending.get(SOURCE)
+        if future is not None:
+            future.result(timeout=10)
+
+    def fetch(self):
+        return self.client.get(f"/get-external-questions?source={SOURCE}")
+
+    def make_stale(self):
+        with self.cache.lock:
+            self.cache.entries[SOURCE]["fetched_at"] -= 2 * MAX_AGE
+
+    def test_cold_start_answers_202_until_the_first_fetch_lands(self):
+        self.stub.latency_ms = 500
+        with mock.patch.object(app, "EXTERNAL_FIRST_FETCH_WAIT", 0.05):
+            response = self.fetch()
+        self.assertEqual(response.status_code, 202)
+        body = response.get_json()
+        self.assertEqual(body["questions"], [])
+        self.assertTrue(body["refreshing"])
+        self.assertTrue(body["stale"])
+
+        self.wait_for_refresh()
+        response = self.fetch()
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual([q["id"] for q in body["questions"]], ["stub:176", "stub:1757"])
+        self.assertFalse(body["stale"])
+        self.assertNotIn("setup_sql", body["questions"][0])
+        self.assertEqual(len(self.cache.entries[SOURCE]["rejected"]), 1)
+
+    def test_stale_copy_is_served_while_it_is_refreshed(self):
+        self.assertEqual(self.fetch().status_code, 200)
+        self.stub.set_questions(SAMPLE_QUESTIONS[:1])
+        self.stub.latency_ms = 300
+        self.make_stale()
+
+        started = time.perf_counter()
+        response = self.fetch()
+        self.assertLess(time.perf_counter() - started, 0.3)
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertTrue(body["stale"])
+        self.assertTrue(body["refreshing"])
+        self.assertEqual(len(body["questions"]), 2)
+
+        self.wait_for_refresh()
+        body = self.fetch().get_json()
+        self.assertFalse(body["stale"])
+        self.assertEqual([q["id"] for q in body["questions"]], ["stub:176"])
+
+    def test_unchanged_source_answers_304_and_keeps_the_questions(self):
+        self.assertEqual(self.fetch().status_code, 200)
+        fetched_at = self.cache.entries[SOURCE]["fetched_at"]
+        self.make_stale()
+
+        self.fetch()
+        self.wait_for_refresh()
+        self.assertEqual(self.stub.stats, {"requests": 2, "not_modified": 1})
+        entry = self.cache.entries[SOURCE]
+        self.assertGreaterEqual(entry["fetched_at"], fetched_at)
+        self.assertEqual(len(entry["questions"]), 2)
+        self.assertIsNone(entry["error"])
+
+    def test_failed_fetch_keeps_questions_and_backs_off(self):
+        self.assertEqual(self.fetch().status_code, 200)
+        self.stub.status = 500
+        self.make_stale()
+
+        self.fetch()
+        self.wait_for_refresh()
+        body = self.fetch().get_json()
+        self.assertIn("500", body["error"])
+        self.assertEqual(len(body["questions"]), 2)
+        self.assertFalse(body["refreshing"])
+
+        for _ in range(3):
+            self.fetch()
+        self.wait_for_refresh()
+        self.assertEqual(self.stub.stats["requests"], 2)
+
+        with self.cache.lock:
+            self.cache.entries[SOURCE]["attempted_at"] -= 2 * RETRY_AFTER
+        self.stub.status = 200
+        self.fetch()
+        self.wait_for_refresh()
+        self.assertEqual(self.stub.stats["requests"], 3)
+        self.assertIsNone(self.cache.entries[SOURCE]["error"])
+
+    def test_source_ids_work_with_the_question_routes(self):
+        self.assertEqual(self.fetch().status_code, 200)
+
+        response = self.client.post("/get-question-schema", json={"question_id": "stub:176"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.get_json()["schema"]), ["Employee"])
+
+        response = self.client.post("/execute-question", json={
+            "question_id": "stub:176",
+            "query": "SELECT MAX(salary) AS SecondHighestSalary FROM Employee WHERE salary < 300"
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["rows"], [[200]])
+
+        response = self.client.post("/get-question-schema", json={"question_id": "stub:broken"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_setup_sql_past_the_time_limit_is_rejected(self):
+        slow = dict(SAMPLE_QUESTIONS[1], questionId="slow", sqlSchema=(
+            "CREATE TABLE T (a INTEGER);"
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) INSERT INTO T SELECT i FROM n;"))
+        self.stub.set_questions([SAMPLE_QUESTIONS[0], slow])
+        with mock.patch.object(app, "EXTERNAL_SETUP_TIMEOUT", 0.2):
+            self.assertEqual(self.fetch().status_code, 200)
+        entry = self.cache.entries[SOURCE]
+        self.assertEqual([q["id"] for q in entry["questions"]], ["stub:176"])
+        self.assertIn("exceeded", entry["rejected"][0]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
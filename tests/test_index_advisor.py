@@ -0,0 +1,57 @@
+"""
+Index advisor time limit: once the budget is used up, advise_indexes stops
+measuring candidates and returns the indexes chosen so far instead of
+running every round to completion.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="sql-compiler-tests-"))
+
+import app  # noqa: E402
+
+SETUP_SQL = ("CREATE TABLE orders (id INTEGER PRIMARY KEY, customer TEXT, status TEXT, amount INTEGER);"
+             "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 20000) "
+             "INSERT INTO orders SELECT i, 'c' || (i % 500), 's' || (i % 40), i FROM n;")
+WORKLOAD = [{"query": "SELECT amount FROM orders WHERE customer = 'c7'", "weight": 1},
+            {"query": "SELECT COUNT(*) FROM orders WHERE status = 's3'", "weight": 1}]
+
+
+class IndexAdvisorTimeLimitTest(unittest.TestCase):
+    def test_without_a_limit_every_candidate_is_measured(self):
+        report = app.advise_indexes(WORKLOAD, SETUP_SQL, scale=1, runs=1)
+        self.assertFalse(report["timed_out"])
+        self.assertGreaterEqual(len(report["candidates"]), 2)
+        self.assertEqual(len(report["indexes"]), 2)
+
+    def test_returns_the_indexes_chosen_before_the_limit(self):
+        measure = app.WorkloadCosts.measure
+
+        def slow_measure(costs):
+            result = measure(costs)
+            time.sleep(0.5)
+            return result
+
+        started = time.perf_counter()
+        with mock.patch.object(app.WorkloadCosts, "measure", slow_measure):
+            report = app.advise_indexes(WORKLOAD, SETUP_SQL, scale=1, runs=1, timeout=0.4)
+        self.assertLess(time.perf_counter() - started, 3)
+        self.assertTrue(report["timed_out"])
+        self.assertEqual(len(report["candidates"]), 1)
+        self.assertLessEqual(len(report["indexes"]), 1)
+        self.assertLessEqual(report["final_ms"], report["baseline_ms"])
+
+
+if __name__ == "__main__":
+    unittest.main()
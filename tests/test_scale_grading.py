@@ -0,0 +1,80 @@
+"""
+Scale grading (/execute-question with mode="scale") grades on the time
+ratio to the reference, not on VM steps: answers that take more steps but
+no more time still get an "A", and answers doing a known multiple of the
+reference's work land in the band for that multiple.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="sql-compiler-tests-"))
+
+import app  # noqa: E402
+
+SECOND_HIGHEST = "(SELECT DISTINCT salary FROM Employee ORDER BY salary DESC LIMIT 1 OFFSET 1)"
+
+
+def second_highest_with(extra):
+    """The reference answer to question 4 plus `extra` subqueries whose value is multiplied away."""
+    return f"SELECT {SECOND_HIGHEST}{''.join(f' + 0 * {sql}' for sql in extra)} AS SecondHighestSalary"
+
+
+def repeated_reference(copies):
+    """Subqueries redoing the reference's work (DISTINCT + sort over every salary) `copies` times."""
+    return [f"(SELECT DISTINCT salary + {i} FROM Employee ORDER BY salary + {i} DESC LIMIT 1 OFFSET 1)"
+            for i in range(1, copies + 1)]
+
+
+class ScaleGradeTest(unittest.TestCase):
+    def test_band_limits(self):
+        for ratio, grade in [(1.0, "A"), (1.25, "A"), (1.3, "B"), (2, "B"), (3, "C"), (5, "C"), (9, "D")]:
+            self.assertEqual(app.scale_grade(ratio)[0], grade, ratio)
+
+
+class ScaleGradingTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+
+    def grade(self, question_id, query):
+        response = self.client.post("/execute-question", json={
+            "question_id": question_id, "mode": "scale", "runs": 5, "query": query
+        })
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True)[:300])
+        body = response.get_json()
+        self.assertTrue(body["correct"], body.get("verdict"))
+        return body
+
+    def assertGrade(self, body, grade):
+        self.assertEqual(body["grade"], grade, f"ratio {body['ratio']}")
+
+    def test_more_steps_but_as_fast_gets_an_a(self):
+        body = self.grade(4, "SELECT MAX(salary) AS SecondHighestSalary FROM Employee "
+                             "WHERE salary < (SELECT MAX(salary) FROM Employee)")
+        self.assertGreater(body["ratio"]["vm_steps"], 2)
+        self.assertGrade(body, "A")
+
+    def test_same_plan_gets_an_a(self):
+        self.assertGrade(self.grade(1, "SELECT e1.name FROM Employee e2 JOIN Employee e1 "
+                                       "ON e1.managerId = e2.id WHERE e2.salary < e1.salary"), "A")
+
+    def test_an_extra_scan_gets_a_b(self):
+        self.assertGrade(self.grade(4, second_highest_with(["(SELECT MAX(salary) FROM Employee)"])), "B")
+
+    def test_the_reference_work_three_times_gets_a_c(self):
+        self.assertGrade(self.grade(4, second_highest_with(repeated_reference(2))), "C")
+
+    def test_the_reference_work_ten_times_gets_a_d(self):
+        self.assertGrade(self.grade(4, second_highest_with(repeated_reference(9))), "D")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Optimization tournament: candidates of a query with a top-level ORDER BY
+must return the rows in the same order, and the whole run stops at its
+time limit instead of running every candidate to its own timeout.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="sql-compiler-tests-"))
+
+import app  # noqa: E402
+
+SETUP_SQL = ("CREATE TABLE t (id INTEGER PRIMARY KEY, v INTEGER);"
+             "INSERT INTO t VALUES (1, 30), (2, 10), (3, 20), (4, 40);")
+SLOW = ("(WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+        "SELECT COUNT(*) FROM n)")
+
+
+def tournament(query, rewrites, **kwargs):
+    reply = {"candidates": [{"strategy": f"rewrite {i}", "optimized_query": sql} for i, sql in enumerate(rewrites)]}
+    with mock.patch.object(app, "call_llm_json", return_value=reply):
+        return app.run_tournament(query, {}, SETUP_SQL, k=len(rewrites), scale=2, runs=1, **kwargs)
+
+
+def by_query(result):
+    return {candidate["query"]: candidate for candidate in result["candidates"]}
+
+
+class TopLevelOrderByTest(unittest.TestCase):
+    def test_only_the_outermost_order_by_counts(self):
+        self.assertTrue(app.top_level_order_by("SELECT v FROM t ORDER BY v"))
+        self.assertTrue(app.top_level_order_by("SELECT v FROM t UNION SELECT id FROM t ORDER BY 1"))
+        self.assertFalse(app.top_level_order_by("SELECT * FROM (SELECT v FROM t ORDER BY v)"))
+        self.assertFalse(app.top_level_order_by("SELECT ROW_NUMBER() OVER (ORDER BY v) FROM t"))
+        self.assertFalse(app.top_level_order_by("SELECT 'ORDER BY' FROM t"))
+
+
+class TournamentTest(unittest.TestCase):
+    def test_ordered_query_needs_the_same_order(self):
+        query = "SELECT id, v FROM t ORDER BY v DESC"
+        same_order = "SELECT id, v FROM t ORDER BY -v"
+        reversed_order = "SELECT id, v FROM t ORDER BY v"
+        candidates = by_query(tournament(query, [same_order, reversed_order]))
+        self.assertTrue(candidates[same_order]["equivalent"])
+        self.assertFalse(candidates[reversed_order]["equivalent"])
+
+    def test_unordered_query_ignores_row_order(self):
+        query = "SELECT id, v FROM t"
+        rewrite = "SELECT id, v FROM t ORDER BY v"
+        self.assertTrue(by_query(tournament(query, [rewrite]))[rewrite]["equivalent"])
+
+    def test_run_stops_at_the_time_limit(self):
+        query = "SELECT COUNT(*) FROM t"
+        slow = f"SELECT COUNT(*) FROM t WHERE {SLOW} > 0"
+        started = time.perf_counter()
+        result = tournament(query, [slow], timeout=0.5)
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertTrue(result["timed_out"])
+        candidate = by_query(result)[slow]
+        self.assertIsNone(candidate["equivalent"])
+        self.assertIn("time limit", candidate["error"])
+        self.assertIsNone(result["winner"])
+
+
+if __name__ == "__main__":
+    unittest.main()